@@ -0,0 +1,329 @@
+"""
+Command line batch driver for large route, distance, buffer and extent jobs.
+
+Rows are read lazily from CSV (with a header row) or newline-delimited JSON,
+processed in chunks across a pool of worker processes, and written out in
+input order as they complete, so memory stays bounded however big the input.
+
+Expected fields (an optional 'id' field is carried through to the output):
+
+    route       lon1, lat1, lon2, lat2
+    distance    lon1, lat1, lon2, lat2
+    buffer      lon, lat, radius_m
+    extent      x1, y1, x2, y2, proj4
+
+Output is chosen with --output-format:
+
+    ndjson      geojson features (or {"id", "distance_m"}) one per line
+    csv         id,wkt (or id,distance_m)
+    wkb         length-prefixed WKB batch, see packed.py
+
+Rows with NaN or infinite results, e.g. from a latitude beyond 90, can't be
+written as JSON; they are left out of ndjson output and counted as skipped.
+
+e.g.
+    python batch.py route flights.csv routes.geojsonl --segments 200 --workers 8
+"""
+
+import argparse
+import csv
+import io
+import json
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from shapely.geometry import LineString, Polygon
+from geodesics import great_circles, great_circle_distances
+from geodesics import geodesic_point_buffers, convert_projection_extent
+from lazy import LazyGeometry
+from packed import write_wkb
+from utils import geometry_to_geojson
+
+FIELDS = {
+    'route': ('lon1', 'lat1', 'lon2', 'lat2'),
+    'distance': ('lon1', 'lat1', 'lon2', 'lat2'),
+    'buffer': ('lon', 'lat', 'radius_m'),
+    'extent': ('x1', 'y1', 'x2', 'y2', 'proj4')
+}
+
+OUTPUT_FORMATS = ('ndjson', 'csv', 'wkb')
+
+
+def read_rows(file_name, input_format=None):
+    """
+    Generator over the rows of a CSV or newline-delimited JSON file
+    :param file_name: path
+    :param input_format: 'csv' or 'ndjson', else guessed from the extension
+    :return: dicts, one per row
+    """
+    if input_format is None:
+        input_format = 'csv' if file_name.lower().endswith('.csv') else 'ndjson'
+    with open(file_name, "r", newline='') as fi:
+        if input_format == 'csv':
+            for row in csv.DictReader(fi):
+                yield row
+        else:
+            for line in fi:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def chunked(rows, chunk_size):
+    """
+    Group an iterable into lists of at most chunk_size
+    :param rows: iterable
+    :param chunk_size: maximum length of each list
+    :return: lists of rows
+    """
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _columns(rows, fields):
+    return [np.array([float(row[field]) for row in rows], dtype=np.float64)
+            for field in fields]
+
+
+def compute(job, rows, options):
+    """
+    Run one chunk of a job
+    :param job: one of FIELDS
+    :param rows: list of dicts
+    :param options: dict with at least segments and tolerance
+    :return: list of packed arrays, shapely geometries or distances
+    """
+    if job == 'route':
+        lon1, lat1, lon2, lat2 = _columns(rows, FIELDS[job])
+        return great_circles(lon1, lat1, lon2, lat2, options['segments'])
+    if job == 'distance':
+        lon1, lat1, lon2, lat2 = _columns(rows, FIELDS[job])
+        return great_circle_distances(lon1, lat1, lon2, lat2)
+    if job == 'buffer':
+        lon, lat, radius = _columns(rows, FIELDS[job])
+        rings = geodesic_point_buffers(lon, lat, options['segments'], radius)
+        # close the rings, as shapely would
+        return np.concatenate((rings, rings[:, :1]), axis=1)
+    return [convert_projection_extent(float(row['x1']), float(row['y1']),
+                                      float(row['x2']), float(row['y2']),
+                                      row['proj4'], tolerance=options['tolerance'])
+            for row in rows]
+
+
+def _geometry(job, result):
+    # lazy, so WKB output is written straight from the coordinates
+    if job == 'route':
+        return LazyGeometry(result, LineString)
+    if job == 'buffer':
+        return LazyGeometry(result, Polygon)
+    return result
+
+
+def result_geojson(job, result, precision):
+    """
+    :param job: one of FIELDS, other than distance
+    :param result: one item returned by compute
+    :param precision: decimal places to keep
+    :return: geojson geometry dict
+    """
+    if job == 'route':
+        return {'type': 'LineString', 'coordinates': np.round(result, precision).tolist()}
+    if job == 'buffer':
+        return {'type': 'Polygon', 'coordinates': [np.round(result, precision).tolist()]}
+    return geometry_to_geojson(result, precision)
+
+
+def process_chunk(job, start, rows, options):
+    """
+    Compute and serialise one chunk. Runs in a worker process.
+    :param job: one of FIELDS
+    :param start: row number of the first row, used when rows have no id
+    :param rows: list of dicts
+    :param options: dict of segments, tolerance, precision and output_format
+    :return: (number of rows, number of rows skipped, bytes to write);
+    ndjson output skips rows with NaN or infinite results (e.g. from a
+    latitude beyond 90), which JSON can't represent
+    """
+    results = compute(job, rows, options)
+    ids = [row.get('id', start + i) for i, row in enumerate(rows)]
+    output_format = options['output_format']
+    precision = options['precision']
+    if output_format == 'wkb':
+        out = io.BytesIO()
+        write_wkb((_geometry(job, result) for result in results), out)
+        return len(rows), 0, out.getvalue()
+    out = io.StringIO()
+    skipped = 0
+    if job == 'distance':
+        if output_format == 'csv':
+            writer = csv.writer(out, lineterminator='\n')
+            for row_id, dist in zip(ids, results):
+                writer.writerow([row_id, repr(float(dist))])
+        else:
+            encoder = json.JSONEncoder(allow_nan=False)
+            for row_id, dist in zip(ids, results):
+                try:
+                    line = encoder.encode({'id': row_id, 'distance_m': float(dist)})
+                except ValueError:
+                    skipped += 1
+                    continue
+                out.write(line)
+                out.write('\n')
+    elif output_format == 'csv':
+        writer = csv.writer(out, lineterminator='\n')
+        for row_id, result in zip(ids, results):
+            writer.writerow([row_id, _geometry(job, result).wkt])
+    else:
+        encoder = json.JSONEncoder(separators=(',', ':'), allow_nan=False)
+        for row_id, result in zip(ids, results):
+            try:
+                line = encoder.encode({
+                    'type': 'Feature',
+                    'properties': {'id': row_id},
+                    'geometry': result_geojson(job, result, precision)
+                })
+            except ValueError:
+                skipped += 1
+                continue
+            out.write(line)
+            out.write('\n')
+    return len(rows), skipped, out.getvalue().encode('utf-8')
+
+
+def _header(job, output_format):
+    if output_format != 'csv':
+        return b''
+    return b'id,distance_m\n' if job == 'distance' else b'id,wkt\n'
+
+
+def run(job, input_name, output_name,
+        workers=0, chunk_size=10000,
+        segments=100, tolerance=None, precision=6,
+        input_format=None, output_format='ndjson',
+        progress=None, report_every=5.0):
+    """
+    Run a batch job from one file to another
+    :param job: 'route', 'distance', 'buffer' or 'extent'
+    :param input_name: CSV or ndjson file
+    :param output_name: output file
+    :param workers: number of worker processes, 0 to run in this process
+    :param chunk_size: rows per chunk
+    :param segments: segments per route or buffer
+    :param tolerance: for extents, see convert_projection_extent
+    :param precision: decimal places in ndjson output
+    :param input_format: 'csv' or 'ndjson', else guessed from the extension
+    :param output_format: 'ndjson', 'csv' or 'wkb'
+    :param progress: text file to report progress to, e.g. sys.stderr
+    :param report_every: seconds between progress reports
+    :return: dict of rows, skipped (rows left out of ndjson output for
+    NaN or infinite results), chunks, seconds and rows_per_second
+    """
+    if job not in FIELDS:
+        raise ValueError("unknown job {}".format(job))
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError("unknown output format {}".format(output_format))
+    options = {
+        'segments': segments,
+        'tolerance': tolerance,
+        'precision': precision,
+        'output_format': output_format
+    }
+    chunks = chunked(read_rows(input_name, input_format), chunk_size)
+    started = last_report = time.time()
+    stats = {'rows': 0, 'skipped': 0, 'chunks': 0}
+
+    def report(final=False):
+        elapsed = max(time.time() - started, 1e-9)
+        stats['seconds'] = elapsed
+        stats['rows_per_second'] = stats['rows'] / elapsed
+        if progress is not None:
+            progress.write("{}{} rows, {} skipped, {} chunks, {:.1f}s, {:.0f} rows/s\n".format(
+                "done: " if final else "", stats['rows'], stats['skipped'], stats['chunks'],
+                elapsed, stats['rows_per_second']))
+            progress.flush()
+
+    with open(output_name, "wb") as fo:
+        fo.write(_header(job, output_format))
+        if workers:
+            executor = ProcessPoolExecutor(max_workers=workers)
+            try:
+                # only keep a couple of chunks per worker in flight, so neither
+                # the input nor the results pile up in memory
+                pending = deque()
+                start = 0
+                for chunk in chunks:
+                    pending.append(executor.submit(process_chunk, job, start, chunk, options))
+                    start += len(chunk)
+                    if len(pending) >= 2 * workers:
+                        count, skipped, data = pending.popleft().result()
+                        fo.write(data)
+                        stats['rows'] += count
+                        stats['skipped'] += skipped
+                        stats['chunks'] += 1
+                        if time.time() - last_report >= report_every:
+                            last_report = time.time()
+                            report()
+                while pending:
+                    count, skipped, data = pending.popleft().result()
+                    fo.write(data)
+                    stats['rows'] += count
+                    stats['skipped'] += skipped
+                    stats['chunks'] += 1
+                    if time.time() - last_report >= report_every:
+                        last_report = time.time()
+                        report()
+            finally:
+                # on an error, drop the chunks not yet started rather than
+                # leaving them, and the worker processes, running
+                executor.shutdown(cancel_futures=True)
+        else:
+            start = 0
+            for chunk in chunks:
+                count, skipped, data = process_chunk(job, start, chunk, options)
+                start += count
+                fo.write(data)
+                stats['rows'] += count
+                stats['skipped'] += skipped
+                stats['chunks'] += 1
+                if time.time() - last_report >= report_every:
+                    last_report = time.time()
+                    report()
+    report(final=True)
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch geodesic jobs")
+    parser.add_argument('job', choices=sorted(FIELDS))
+    parser.add_argument('input', help="CSV (with header) or ndjson file")
+    parser.add_argument('output', help="output file")
+    parser.add_argument('--input-format', choices=('csv', 'ndjson'))
+    parser.add_argument('--output-format', choices=OUTPUT_FORMATS, default='ndjson')
+    parser.add_argument('--workers', type=int, default=0,
+                        help="worker processes, 0 to run in this process")
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    parser.add_argument('--segments', type=int, default=100,
+                        help="segments per route or buffer")
+    parser.add_argument('--tolerance', type=float,
+                        help="adaptive densification of extents, degrees")
+    parser.add_argument('--precision', type=int, default=6,
+                        help="decimal places in ndjson output")
+    parser.add_argument('--quiet', action='store_true')
+    args = parser.parse_args(argv)
+    run(args.job, args.input, args.output,
+        workers=args.workers, chunk_size=args.chunk_size,
+        segments=args.segments, tolerance=args.tolerance,
+        precision=args.precision, input_format=args.input_format,
+        output_format=args.output_format,
+        progress=None if args.quiet else sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
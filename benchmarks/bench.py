@@ -0,0 +1,621 @@
+"""
+Benchmarks for the public functions in geodesics.py, cartesian.py and
+utils.py (plus packed.py and spatial_index.py), with realistic workloads.
+
+The batch hot paths are also timed with engine='sphere' (see
+spherical.py). Results can be saved as a JSON baseline and later runs
+compared against it, flagging anything that got slower. Everything runs
+offline.
+
+Run from the repository root, e.g.
+
+    python -m benchmarks.bench --save /tmp/baseline.json
+    python -m benchmarks.bench --compare /tmp/baseline.json
+    python -m benchmarks.bench --filter great_circle --scale 0.1
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import warnings
+import numpy as np
+import pyproj
+import shapely
+from shapely.geometry import Polygon, LineString
+import geodesics
+import cartesian
+import utils
+import packed
+from lazy import lazy
+from spatial_index import PointIndex
+
+BENCHMARKS = []
+
+# canvas extents in a range of coordinate systems
+EXTENTS = [
+    (5456328, -2786634, 14254990, 2320744,
+     "+proj=moll +lon_0=0 +x_0=0 +y_0=0 +datum=WGS84 +units=m +no_defs"),
+    (-6262958, -6367407, 9598379, 2839657,
+     "+proj=aeqd +lat_0=55.9533507888 +lon_0=-3.18890398422 +units=m"),
+    (-1828313, -1196252, 2280177, 2121200,
+     "+proj=tmerc +lat_0=49 +lon_0=-2 +k=0.9996012717 +x_0=400000 +y_0=-100000 "
+     "+ellps=airy +units=m +no_defs"),
+    (-5000000, -5000000, 5000000, 5000000,
+     "+proj=laea +lat_0=52 +lon_0=10 +x_0=0 +y_0=0 +ellps=GRS80 +units=m +no_defs"),
+    (-2000000, -2000000, 2000000, 2000000,
+     "+proj=stere +lat_0=90 +lat_ts=70 +lon_0=-45 +k=1 +x_0=0 +y_0=0 +datum=WGS84 +units=m"),
+    (-20037508, -15000000, 20037508, 15000000,
+     "+proj=merc +a=6378137 +b=6378137 +lat_ts=0 +lon_0=0 +x_0=0 +y_0=0 +k=1 +units=m"),
+    (-10000000, -5000000, 10000000, 5000000,
+     "+proj=robin +lon_0=0 +x_0=0 +y_0=0 +datum=WGS84 +units=m +no_defs"),
+    (-3000000, -2000000, 3000000, 2000000,
+     "+proj=lcc +lat_1=33 +lat_2=45 +lat_0=39 +lon_0=-96 +x_0=0 +y_0=0 +datum=NAD83 +units=m"),
+]
+
+
+def benchmark(name):
+    """
+    Register a benchmark. The decorated function takes a scale factor,
+    does any setup, and returns a callable which runs the workload once.
+    """
+    def register(setup):
+        BENCHMARKS.append((name, setup))
+        return setup
+    return register
+
+
+def _count(base, scale):
+    return max(1, int(base * scale))
+
+
+def _random_points(count, seed=0):
+    random = np.random.RandomState(seed)
+    lons = random.uniform(-180.0, 180.0, count)
+    lats = np.degrees(np.arcsin(random.uniform(-0.98, 0.98, count)))
+    return lons, lats
+
+
+def _routes(count, seed=0):
+    lon1, lat1 = _random_points(count, seed)
+    lon2, lat2 = _random_points(count, seed + 1)
+    return lon1, lat1, lon2, lat2
+
+
+# geodesics.py
+
+@benchmark('geodesics.convert_projection_extent')
+def _convert_projection_extent(scale):
+    def run():
+        for i in range(0, _count(5, scale)):
+            for x1, y1, x2, y2, spec in EXTENTS:
+                geodesics.convert_projection_extent(x1, y1, x2, y2, spec)
+    return run
+
+
+@benchmark('geodesics.convert_projection_extent[tolerance]')
+def _convert_projection_extent_tolerance(scale):
+    def run():
+        for i in range(0, _count(5, scale)):
+            for x1, y1, x2, y2, spec in EXTENTS:
+                geodesics.convert_projection_extent(x1, y1, x2, y2, spec, tolerance=0.01)
+    return run
+
+
+@benchmark('geodesics.get_great_circle_from_two_points')
+def _get_great_circle_from_two_points(scale):
+    def run():
+        for i in range(0, _count(5, scale)):
+            geodesics.get_great_circle_from_two_points(-109.28894, -27.12201, 31.13074, 29.97594)
+    return run
+
+
+@benchmark('geodesics.get_great_circle_from_two_points2')
+def _get_great_circle_from_two_points2(scale):
+    def run():
+        for i in range(0, _count(5, scale)):
+            geodesics.get_great_circle_from_two_points2(-109.28894, -27.12201, 31.13074, 29.97594)
+    return run
+
+
+@benchmark('geodesics.great_circles_through_points')
+def _great_circles_through_points(scale):
+    lon1, lat1, lon2, lat2 = _routes(_count(1000, scale))
+
+    def run():
+        geodesics.great_circles_through_points(lon1, lat1, lon2, lat2, resolution_m=50000.0)
+    return run
+
+
+@benchmark('geodesics.get_tissot_indicatrix')
+def _get_tissot_indicatrix(scale):
+    segments = _count(100, scale ** 0.5)
+
+    def run():
+        geodesics.get_tissot_indicatrix(segments=segments, radius_m=100000)
+    return run
+
+
+@benchmark('geodesics.get_bounding_box')
+def _get_bounding_box(scale):
+    def run():
+        for i in range(0, _count(100, scale)):
+            geodesics.get_bounding_box(10.0, 20.0, 45.0, 32.0)
+    return run
+
+
+@benchmark('geodesics.great_circle_distance')
+def _great_circle_distance(scale):
+    lon1, lat1, lon2, lat2 = _routes(_count(10000, scale))
+    pairs = list(zip(lon1.tolist(), lat1.tolist(), lon2.tolist(), lat2.tolist()))
+
+    def run():
+        for x1, y1, x2, y2 in pairs:
+            geodesics.great_circle_distance(x1, y1, x2, y2)
+    return run
+
+
+@benchmark('geodesics.great_circle_distances')
+def _great_circle_distances(scale):
+    lon1, lat1, lon2, lat2 = _routes(_count(1000000, scale))
+
+    def run():
+        geodesics.great_circle_distances(lon1, lat1, lon2, lat2)
+    return run
+
+
+@benchmark('geodesics.great_circle_distances[engine=sphere]')
+def _great_circle_distances_sphere(scale):
+    lon1, lat1, lon2, lat2 = _routes(_count(1000000, scale))
+
+    def run():
+        geodesics.great_circle_distances(lon1, lat1, lon2, lat2, engine='sphere')
+    return run
+
+
+@benchmark('geodesics.great_circle_distance_matrix[k=5]')
+def _great_circle_distance_matrix(scale):
+    lon_a, lat_a = _random_points(_count(10000, scale), 0)
+    lon_b, lat_b = _random_points(_count(200, scale ** 0.5), 1)
+
+    def run():
+        geodesics.great_circle_distance_matrix(lon_a, lat_a, lon_b, lat_b, k=5)
+    return run
+
+
+@benchmark('geodesics.great_circle')
+def _great_circle(scale):
+    lon1, lat1, lon2, lat2 = _routes(_count(1000, scale))
+    pairs = list(zip(lon1.tolist(), lat1.tolist(), lon2.tolist(), lat2.tolist()))
+
+    def run():
+        for x1, y1, x2, y2 in pairs:
+            geodesics.great_circle(x1, y1, x2, y2, 100)
+    return run
+
+
+@benchmark('geodesics.great_circle[max_deviation_m]')
+def _great_circle_adaptive(scale):
+    lon1, lat1, lon2, lat2 = _routes(_count(1000, scale))
+    pairs = list(zip(lon1.tolist(), lat1.tolist(), lon2.tolist(), lat2.tolist()))
+
+    def run():
+        for x1, y1, x2, y2 in pairs:
+            geodesics.great_circle(x1, y1, x2, y2, max_deviation_m=1000.0)
+    return run
+
+
+@benchmark('geodesics.great_circles')
+def _great_circles(scale):
+    lon1, lat1, lon2, lat2 = _routes(_count(10000, scale))
+
+    def run():
+        geodesics.great_circles(lon1, lat1, lon2, lat2, 100)
+    return run
+
+
+@benchmark('geodesics.great_circles[engine=sphere]')
+def _great_circles_sphere(scale):
+    lon1, lat1, lon2, lat2 = _routes(_count(10000, scale))
+
+    def run():
+        geodesics.great_circles(lon1, lat1, lon2, lat2, 100, engine='sphere')
+    return run
+
+
+@benchmark('geodesics.great_circles[LineString, split_antimeridian]')
+def _great_circles_split(scale):
+    lon1, lat1, lon2, lat2 = _routes(_count(10000, scale))
+
+    def run():
+        geodesics.great_circles(lon1, lat1, lon2, lat2, 100, LineString, split_antimeridian=True)
+    return run
+
+
+@benchmark('geodesics.geo_point_buffer')
+def _geo_point_buffer(scale):
+    lons, lats = _random_points(_count(200, scale))
+
+    def run():
+        for lon, lat in zip(lons, lats):
+            geodesics.geo_point_buffer(lon, lat, 360, 100000.0, Polygon)
+    return run
+
+
+@benchmark('geodesics.geodesic_point_buffer')
+def _geodesic_point_buffer(scale):
+    lons, lats = _random_points(_count(1000, scale))
+
+    def run():
+        for lon, lat in zip(lons, lats):
+            geodesics.geodesic_point_buffer(lon, lat, 360, 100000.0, Polygon)
+    return run
+
+
+@benchmark('geodesics.geodesic_point_buffers')
+def _geodesic_point_buffers(scale):
+    lons, lats = _random_points(_count(10000, scale))
+
+    def run():
+        geodesics.geodesic_point_buffers(lons, lats, 360, 100000.0)
+    return run
+
+
+@benchmark('geodesics.geodesic_point_buffers[engine=sphere]')
+def _geodesic_point_buffers_sphere(scale):
+    lons, lats = _random_points(_count(10000, scale))
+
+    def run():
+        geodesics.geodesic_point_buffers(lons, lats, 360, 100000.0, engine='sphere')
+    return run
+
+
+@benchmark('geodesics.geodesic_circle_bounds')
+def _geodesic_circle_bounds(scale):
+    lons, lats = _random_points(_count(100000, scale))
+    radii = np.random.RandomState(2).uniform(1000.0, 2000000.0, lons.size)
+
+    def run():
+        geodesics.geodesic_circle_bounds(lons, lats, radii)
+    return run
+
+
+@benchmark('geodesics.in_geodesic_point_buffer')
+def _in_geodesic_point_buffer(scale):
+    lons, lats = _random_points(_count(1000000, scale))
+
+    def run():
+        geodesics.in_geodesic_point_buffer(lons, lats, -3.189, 55.953, 4000000.0)
+    return run
+
+
+@benchmark('geodesics.geodesic_corridors')
+def _geodesic_corridors(scale):
+    lon1, lat1, lon2, lat2 = _routes(_count(1000, scale))
+
+    def run():
+        geodesics.geodesic_corridors(lon1, lat1, lon2, lat2, 50000.0, 100, 16)
+    return run
+
+
+@benchmark('geodesics.geodesic_areas')
+def _geodesic_areas(scale):
+    lons, lats = _random_points(_count(10000, scale))
+    rings = geodesics.geodesic_point_buffers(lons, lats, 64, 100000.0)
+
+    def run():
+        geodesics.geodesic_areas(rings)
+    return run
+
+
+@benchmark('geodesics.geodesic_perimeters')
+def _geodesic_perimeters(scale):
+    lons, lats = _random_points(_count(10000, scale))
+    rings = geodesics.geodesic_point_buffers(lons, lats, 64, 100000.0)
+
+    def run():
+        geodesics.geodesic_perimeters(rings)
+    return run
+
+
+@benchmark('geodesics.get_square_point_buffer')
+def _get_square_point_buffer(scale):
+    lons, lats = _random_points(_count(500, scale))
+
+    def run():
+        for lon, lat in zip(lons, lats):
+            geodesics.get_square_point_buffer(lon, lat, 10000.0)
+    return run
+
+
+@benchmark('geodesics.get_square_point_buffer_geodesic')
+def _get_square_point_buffer_geodesic(scale):
+    lons, lats = _random_points(_count(500, scale))
+
+    def run():
+        for lon, lat in zip(lons, lats):
+            geodesics.get_square_point_buffer_geodesic(lon, lat, 10000.0)
+    return run
+
+
+@benchmark('geodesics.get_size_of_degree_at')
+def _get_size_of_degree_at(scale):
+    latitudes = np.linspace(-89.0, 89.0, _count(10000, scale)).tolist()
+
+    def run():
+        for latitude in latitudes:
+            geodesics.get_size_of_degree_at(latitude)
+    return run
+
+
+@benchmark('geodesics.get_sizes_of_degree_at')
+def _get_sizes_of_degree_at(scale):
+    latitudes = np.random.RandomState(0).uniform(-89.0, 89.0, _count(1000000, scale))
+    geodesics.get_sizes_of_degree_at(0.0)  # build the table outside the timing
+
+    def run():
+        geodesics.get_sizes_of_degree_at(latitudes)
+    return run
+
+
+# cartesian.py
+
+@benchmark('cartesian.get_graticules')
+def _get_graticules(scale):
+    def run():
+        for i in range(0, _count(10, scale)):
+            cartesian.get_graticules(longitude_resolution=1.0, latitude_resolution=1.0)
+    return run
+
+
+@benchmark('cartesian.get_graticules[proj4_string, extent, tolerance]')
+def _get_graticules_projected(scale):
+    proj4_string = "+proj=laea +lat_0=52 +lon_0=10 +ellps=GRS80 +units=m"
+
+    def run():
+        for i in range(0, _count(10, scale)):
+            cartesian.get_graticules(longitude_resolution=1.0, latitude_resolution=1.0,
+                                     proj4_string=proj4_string,
+                                     extent=(-2000000.0, -2000000.0, 2000000.0, 2000000.0),
+                                     tolerance=10.0)
+    return run
+
+
+@benchmark('cartesian.get_line_cartesian')
+def _get_line_cartesian(scale):
+    def run():
+        for i in range(0, _count(1000, scale)):
+            cartesian.get_line_cartesian(-52.8, 48.1, 77.5, 8.0)
+    return run
+
+
+@benchmark('cartesian.get_bounding_box_cartesian')
+def _get_bounding_box_cartesian(scale):
+    def run():
+        for i in range(0, _count(1000, scale)):
+            cartesian.get_bounding_box_cartesian(-10.0, 40.0, 20.0, 60.0)
+    return run
+
+
+# utils.py
+
+@benchmark('utils.float_range')
+def _float_range(scale):
+    def run():
+        for i in range(0, _count(100, scale)):
+            list(utils.float_range(0.0, 1.0, 10000))
+    return run
+
+
+@benchmark('utils.float_range_by')
+def _float_range_by(scale):
+    def run():
+        for i in range(0, _count(100, scale)):
+            list(utils.float_range_by(0.0, 1.0, 0.0001))
+    return run
+
+
+@benchmark('utils.float_array')
+def _float_array(scale):
+    def run():
+        for i in range(0, _count(100, scale)):
+            utils.float_array(0.0, 1.0, 10000)
+    return run
+
+
+@benchmark('utils.float_array_by')
+def _float_array_by(scale):
+    def run():
+        for i in range(0, _count(100, scale)):
+            utils.float_array_by(0.0, 1.0, 0.0001)
+    return run
+
+
+@benchmark('utils.interpolate_coords')
+def _interpolate_coords(scale):
+    def run():
+        for i in range(0, _count(1000, scale)):
+            utils.interpolate_coords(-180.0, -90.0, 180.0, 90.0, 1000)
+    return run
+
+
+@benchmark('utils.dump_geometry_to_geojson')
+def _dump_geometry_to_geojson(scale):
+    geom = geodesics.get_tissot_indicatrix(segments=_count(40, scale ** 0.5))
+    file_name = os.path.join(tempfile.gettempdir(), "kayrtography_bench.geojson")
+
+    def run():
+        utils.dump_geometry_to_geojson(geom, file_name)
+    return run
+
+
+@benchmark('utils.geometry_to_geojson')
+def _geometry_to_geojson(scale):
+    geoms = geodesics.great_circles(*_routes(_count(10000, scale)), segments=100,
+                                    geom_type=LineString)
+
+    def run():
+        for geom in geoms:
+            utils.geometry_to_geojson(geom, 6)
+    return run
+
+
+@benchmark('utils.write_geojson')
+def _write_geojson(scale):
+    geoms = geodesics.geodesic_point_buffers(*_random_points(_count(10000, scale)),
+                                             segments=100, distances_m=50000.0,
+                                             geom_type=Polygon)
+
+    def run():
+        utils.write_geojson(((geom, {'id': i}) for i, geom in enumerate(geoms)),
+                            io.StringIO())
+    return run
+
+
+@benchmark('utils.parse_qgis_extent')
+def _parse_qgis_extent(scale):
+    def run():
+        for i in range(0, _count(10000, scale)):
+            utils.parse_qgis_extent("-18683478,-15461152 : 19141536,4348463")
+    return run
+
+
+# packed.py and spatial_index.py
+
+@benchmark('packed.write_packed/read_packed')
+def _packed(scale):
+    coords = geodesics.great_circles(*_routes(_count(10000, scale)), segments=100)
+    file_name = os.path.join(tempfile.gettempdir(), "kayrtography_bench.pack")
+
+    def run():
+        packed.write_packed(coords, file_name)
+        routes = packed.read_packed(file_name)
+        for i in range(0, len(routes), 10):
+            routes.coords(i)
+    return run
+
+
+@benchmark('packed.write_wkb/read_wkb')
+def _wkb(scale):
+    rings = geodesics.geodesic_point_buffers(*_random_points(_count(10000, scale)),
+                                             segments=64, distances_m=50000.0,
+                                             geom_type=lazy(Polygon))
+    file_name = os.path.join(tempfile.gettempdir(), "kayrtography_bench.wkb")
+
+    def run():
+        packed.write_wkb(rings, file_name)
+        for geom in packed.read_wkb(file_name):
+            pass
+    return run
+
+
+@benchmark('spatial_index.PointIndex.query_radius')
+def _point_index(scale):
+    index = PointIndex(*_random_points(_count(1000000, scale), 0))
+    lons, lats = _random_points(_count(1000, scale), 1)
+
+    def run():
+        index.query_radius(lons, lats, 50000.0)
+    return run
+
+
+def run_benchmarks(names=None, scale=1.0, repeat=3, progress=None):
+    """
+    Run benchmarks
+    :param names: substring filter on benchmark names, or None for all
+    :param scale: multiplies workload sizes, e.g. 0.1 for a quick run
+    :param repeat: number of timed runs of each benchmark
+    :param progress: text file to report each result to
+    :return: dict of meta data and results, ready for json
+    """
+    results = {}
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        for name, setup in BENCHMARKS:
+            if names and names not in name:
+                continue
+            run = setup(scale)
+            run()  # warm up caches, as a long running process would be
+            timings = []
+            for i in range(0, repeat):
+                started = time.perf_counter()
+                run()
+                timings.append(time.perf_counter() - started)
+            results[name] = {'best': min(timings), 'median': statistics.median(timings)}
+            if progress is not None:
+                progress.write("{:<60} {:>10.4f}s\n".format(name, min(timings)))
+                progress.flush()
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'numpy': np.__version__,
+            'pyproj': pyproj.__version__,
+            'shapely': shapely.__version__,
+            'scale': scale,
+            'repeat': repeat
+        },
+        'results': results
+    }
+
+
+def compare(baseline, current, threshold=1.25, noise_s=0.001):
+    """
+    Compare two runs
+    :param baseline: output of run_benchmarks, e.g. loaded from json
+    :param current: output of run_benchmarks
+    :param threshold: slowdown ratio flagged as a regression
+    :param noise_s: differences smaller than this are ignored
+    :return: list of (name, baseline seconds, current seconds, ratio)
+    for benchmarks that got slower
+    """
+    regressions = []
+    for name, result in sorted(current['results'].items()):
+        if name not in baseline['results']:
+            continue
+        before = baseline['results'][name]['best']
+        after = result['best']
+        ratio = after / before if before > 0 else float('inf')
+        if ratio > threshold and after - before > noise_s:
+            regressions.append((name, before, after, ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark kayrtography functions")
+    parser.add_argument('--filter', help="only run benchmarks whose name contains this")
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help="multiplies workload sizes")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--save', help="write results to this json file")
+    parser.add_argument('--compare', help="compare against this json baseline")
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help="slowdown ratio flagged as a regression")
+    args = parser.parse_args(argv)
+    current = run_benchmarks(args.filter, args.scale, args.repeat, sys.stdout)
+    if args.save:
+        with open(args.save, "w") as fo:
+            json.dump(current, fo, indent=4, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as fi:
+            baseline = json.load(fi)
+        if baseline['meta'].get('scale') != args.scale:
+            sys.stdout.write("warning: baseline was run at scale {}\n".format(
+                baseline['meta'].get('scale')))
+        regressions = compare(baseline, current, args.threshold)
+        for name, before, after, ratio in regressions:
+            sys.stdout.write("SLOWER {:<53} {:.4f}s -> {:.4f}s ({:.2f}x)\n".format(
+                name, before, after, ratio))
+        if regressions:
+            return 1
+        sys.stdout.write("no regressions against {}\n".format(args.compare))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
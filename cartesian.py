@@ -1,34 +1,134 @@
 from shapely.geometry import Polygon, MultiPoint, LineString, MultiLineString
 from shapely.geometry import LineString, MultiPoint, MultiPolygon
-from utils import float_range, float_range_by
+import numpy as np
+from registry import WGS84, get_transformer
+from utils import float_array_by, interpolate_coords, densify_projected, break_jumps
+from instrumentation import instrumented
+from disk_cache import disk_cached
 
 
+def _clip_lines(coords, extent):
+    """
+    Clip lines to a rectangle, all of their segments at once
+    (Liang-Barsky). Unlike a shapely intersection, lines crossing each
+    other aren't cut where they cross.
+    :param coords: (M, 2) array of lines, with non-finite vertices
+    between them
+    :param extent: (x1, y1, x2, y2)
+    :return: list of (K, 2) arrays, one per line or part of a line inside
+    """
+    lows = np.array(extent[:2], dtype=np.float64)
+    highs = np.array(extent[2:], dtype=np.float64)
+    start = coords[:-1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        delta = coords[1:] - start
+        # how far along each segment it crosses each side's line
+        to_low = (lows - start) / delta
+        to_high = (highs - start) / delta
+        enter = np.minimum(to_low, to_high)
+        leave = np.maximum(to_low, to_high)
+        # segments parallel to an axis are wholly in or out on that axis
+        flat = delta == 0.0
+        inside = (start >= lows) & (start <= highs)
+        enter[flat] = np.where(inside[flat], -np.inf, np.inf)
+        leave[flat] = np.where(inside[flat], np.inf, -np.inf)
+        t0 = np.maximum(enter.max(axis=1), 0.0)
+        t1 = np.minimum(leave.min(axis=1), 1.0)
+        keep = np.isfinite(delta).all(axis=1) & (t0 < t1)
+    kept = np.flatnonzero(keep)
+    if not kept.size:
+        return []
+    starts = start[kept] + t0[kept, None] * delta[kept]
+    ends = start[kept] + t1[kept, None] * delta[kept]
+    # a segment carries on the previous line unless either was cut short
+    follows = np.zeros(kept.size, dtype=bool)
+    follows[1:] = (np.diff(kept) == 1) & (t1[kept[:-1]] == 1.0) & (t0[kept[1:]] == 0.0)
+    first = np.flatnonzero(~follows)
+    # each line is its first segment's start then every segment's end
+    vertices = np.insert(ends, first, starts[first], axis=0)
+    return np.split(vertices, (first + np.arange(first.size))[1:])
+
+
+def _project_lines(lines, proj4_string, extent=None, tolerance=None):
+    """
+    Transform lon/lat lines into a projection all in one go, and clip
+    them to the map canvas
+    :param lines: list of (M, 2) arrays of lon/lat
+    :param proj4_string: proj4 definition of the map's coordinate system
+    :param extent: canvas (x1, y1, x2, y2) in projection coords to clip
+    to, or None
+    :param tolerance: None to keep the vertices given, else densify until
+    lines are within this many projection units of the true curves
+    :return: MultiLineString in projection coords
+    """
+    transformer = get_transformer(WGS84, proj4_string)
+    # one run of vertices, with NaN between the lines
+    gap = np.full((1, 2), np.nan)
+    coords = np.concatenate([part for line in lines for part in (gap, line)][1:])
+    if tolerance is None:
+        xx, yy = coords[:, 0], coords[:, 1]
+        tx, ty = transformer.transform(xx, yy)
+    else:
+        xx, yy, tx, ty = densify_projected(transformer, coords[:, 0], coords[:, 1], tolerance,
+                                           extent=extent)
+    # rather than drawing a chord across the map where a line crosses the
+    # projection's seam, end it there and start again on the other side
+    _, _, tx, ty = break_jumps(transformer, xx, yy, tx, ty, tolerance or 0.0)
+    if extent is None:
+        extent = (-np.inf, -np.inf, np.inf, np.inf)
+    # vertices outside the projection's domain come back as inf, and
+    # break the lines like the gaps do
+    return MultiLineString(_clip_lines(np.column_stack((tx, ty)), extent))
+
+
+@instrumented
+@disk_cached
 def get_graticules(min_longitude=-180.0, max_longitude=180.0,
                    min_latitude=-90.0, max_latitude=90.0,
                    longitude_resolution=10.0,
-                   latitude_resolution=10.0):
+                   latitude_resolution=10.0,
+                   proj4_string=None,
+                   extent=None,
+                   tolerance=None):
     """
-    Creates graticule lines (in cartesian space)
+    Creates graticule lines (in cartesian space), or with proj4_string,
+    the same lines ready projected onto a map. All of their vertices are
+    transformed in one call (densified adaptively if tolerance is given)
+    and the lines are clipped to the canvas extent.
     :param min_longitude: degrees [-180,180]
     :param max_longitude: degrees [-180,180]
     :param min_latitude: degrees [-90,90]
     :param max_latitude: degrees [-90,90]
     :param longitude_resolution: spacing of longitude lines, degrees
     :param latitude_resolution: spacing of latitude lines, degrees
-    :return: 
+    :param proj4_string: proj4 definition of the map's coordinate system,
+    or None for WGS84 lines
+    :param extent: canvas (x1, y1, x2, y2) in projection coords to clip
+    the projected lines to, or None
+    :param tolerance: None for 1000 segments per line, else only add
+    vertices where a projected line curves away by more than this many
+    projection units
+    :return: MultiLineString
     """
-    xx = [x for x in float_range_by(min_longitude, max_longitude, longitude_resolution)]
-    yy = [y for y in float_range_by(min_latitude, max_latitude, latitude_resolution)]
+    xx = float_array_by(min_longitude, max_longitude, longitude_resolution)
+    yy = float_array_by(min_latitude, max_latitude, latitude_resolution)
+    if proj4_string is None or tolerance is None:
+        meridian_steps = parallel_steps = 1000
+    else:
+        # seed vertices where the lines cross, and a few more on short lines
+        meridian_steps = max(8, len(yy) - 1)
+        parallel_steps = max(8, len(xx) - 1)
     lines = []
     for x in xx:
-        geom = get_line_cartesian(x, min_latitude, x, max_latitude)
-        lines.append(geom)
+        lines.append(interpolate_coords(x, min_latitude, x, max_latitude, meridian_steps))
     for y in yy:
-        geom = get_line_cartesian(min_longitude, y, max_longitude, y)
-        lines.append(geom)
+        lines.append(interpolate_coords(min_longitude, y, max_longitude, y, parallel_steps))
+    if proj4_string is not None:
+        return _project_lines(lines, proj4_string, extent, tolerance)
     return MultiLineString(lines)
 
 
+@instrumented
 def get_line_cartesian(longitude_start, latitude_start,
                        longitude_end, latitude_end,
                        segments=1000):
@@ -41,27 +141,38 @@ def get_line_cartesian(longitude_start, latitude_start,
     :param segments: number of segments
     :return: geometry (LineString)
     """
-    xx = [x for x in float_range(longitude_start, longitude_end, segments)]
-    yy = [y for y in float_range(latitude_start, latitude_end, segments)]
-    points = list(zip(xx, yy))
+    points = interpolate_coords(longitude_start, latitude_start,
+                                longitude_end, latitude_end, segments)
     return LineString(points)
 
 
+@instrumented
 def get_bounding_box_cartesian(longitude_sw, latitude_sw,
                                longitude_ne, latitude_ne,
-                               segments=1000):
+                               segments=1000,
+                               proj4_string=None,
+                               extent=None,
+                               tolerance=None):
     """
     Create a cartesian bounding box, densified (so it will curve nicely
-    when projected).
+    when projected), or with proj4_string, ready projected and clipped as
+    for get_graticules.
     :param longitude_sw: degrees [-180,180]
     :param latitude_sw: degrees [-90,90]
     :param longitude_ne: degrees [-180,180]
     :param latitude_ne:  degrees [-90,90]
-    :param segments: number of segments
+    :param segments: number of segments (per side, when tolerance is None)
+    :param proj4_string: see get_graticules
+    :param extent: see get_graticules
+    :param tolerance: see get_graticules
     :return: geometry (MultiLineString)
     """
-    line_w = get_line_cartesian(longitude_sw, latitude_sw, longitude_sw, latitude_ne, segments)
-    line_e = get_line_cartesian(longitude_ne, latitude_sw, longitude_ne, latitude_ne, segments)
-    line_n = get_line_cartesian(longitude_sw, latitude_ne, longitude_ne, latitude_ne, segments)
-    line_s = get_line_cartesian(longitude_sw, latitude_sw, longitude_ne, latitude_sw, segments)
+    if proj4_string is not None and tolerance is not None:
+        segments = 8
+    line_w = interpolate_coords(longitude_sw, latitude_sw, longitude_sw, latitude_ne, segments)
+    line_e = interpolate_coords(longitude_ne, latitude_sw, longitude_ne, latitude_ne, segments)
+    line_n = interpolate_coords(longitude_sw, latitude_ne, longitude_ne, latitude_ne, segments)
+    line_s = interpolate_coords(longitude_sw, latitude_sw, longitude_ne, latitude_sw, segments)
+    if proj4_string is not None:
+        return _project_lines([line_w, line_n, line_e, line_s], proj4_string, extent, tolerance)
     return MultiLineString([line_w, line_n, line_e, line_s])
@@ -0,0 +1,283 @@
+"""
+Opt-in persistent cache for generated layers.
+
+Functions like get_graticules and get_tissot_indicatrix depend only on
+their arguments, so once enabled their results are stored on disk as WKB,
+keyed on a hash of the function and its (normalized) arguments, and loaded
+back on later calls, in this process or any other.
+
+    enable_disk_cache("/var/cache/kayrtography", max_bytes=512 * 1024 * 1024)
+
+Entries are written to a temporary file and renamed into place, so several
+processes can share a folder safely. Each hit refreshes the entry's
+modification time, and when the folder grows past max_bytes the least
+recently used entries are removed. The most recently used results are
+also kept in memory (shapely geometries are immutable, so can be shared),
+so repeats within a process skip the disk altogether.
+"""
+
+import functools
+import hashlib
+import inspect
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from shapely import wkb
+
+# bump when a cached function's output changes, to ignore older entries
+VERSION = 1
+_SUFFIX = '.wkb'
+
+_cache = None
+
+
+def _normalize(value):
+    """
+    Arguments which give the same result should give the same key, e.g.
+    10 and 10.0, or proj4 strings differing only in whitespace
+    """
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        return repr(float(value))
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    if hasattr(value, 'tolist'):
+        return _normalize(value.tolist())
+    if isinstance(value, type):
+        return value.__name__
+    raise TypeError("can't cache on argument {!r}".format(value))
+
+
+class DiskCache(object):
+    """
+    Folder of WKB files, one per cached result, named by content hash
+    """
+
+    def __init__(self, folder, max_bytes=256 * 1024 * 1024, memory_items=32):
+        """
+        :param folder: where entries are kept; created if missing
+        :param max_bytes: size the folder is trimmed back to
+        :param memory_items: number of results also kept in memory
+        """
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self.hits = 0
+        self.memory_hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    def key(self, name, arguments):
+        """
+        :param name: module.function
+        :param arguments: dict of argument names to values
+        :return: hex digest identifying the result
+        """
+        text = json.dumps([VERSION, name, sorted((argument, _normalize(value))
+                                                 for argument, value in arguments.items())])
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.folder, key + _SUFFIX)
+
+    def get(self, key):
+        """
+        :param key: from key()
+        :return: geometry, or None if not cached
+        """
+        with self._lock:
+            try:
+                geometry = self._memory[key]
+            except KeyError:
+                pass
+            else:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                self.memory_hits += 1
+                return geometry
+        path = self._path(key)
+        try:
+            with open(path, "rb") as fi:
+                data = fi.read()
+            os.utime(path)
+        except OSError:
+            # missing, or evicted by another process
+            with self._lock:
+                self.misses += 1
+            return None
+        geometry = wkb.loads(data)
+        with self._lock:
+            self.hits += 1
+            self._remember(key, geometry)
+        return geometry
+
+    def _remember(self, key, geometry):
+        self._memory[key] = geometry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def put(self, key, geometry):
+        """
+        Store a result, then trim the folder if it is too big
+        :param key: from key()
+        :param geometry: shapely geometry
+        :return: n/a
+        """
+        with self._lock:
+            self._remember(key, geometry)
+        temp_name = None
+        try:
+            fd, temp_name = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+            with os.fdopen(fd, "wb") as fo:
+                fo.write(wkb.dumps(geometry))
+            os.replace(temp_name, self._path(key))
+        except OSError:
+            # a full or read-only folder, or another process holding the
+            # entry open; it's only a cache, so the write is skipped
+            if temp_name is not None:
+                try:
+                    os.remove(temp_name)
+                except OSError:
+                    pass
+            return
+        with self._lock:
+            self.writes += 1
+        self.trim()
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.folder):
+            if entry.name.endswith(_SUFFIX):
+                try:
+                    status = entry.stat()
+                except OSError:
+                    continue
+                entries.append((status.st_mtime, status.st_size, entry.path))
+        return entries
+
+    def trim(self):
+        """
+        Remove least recently used entries until the folder is within
+        max_bytes
+        :return: n/a
+        """
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except OSError:
+                # already gone
+                pass
+            else:
+                with self._lock:
+                    self.evictions += 1
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def clear(self):
+        """
+        Remove every entry and reset the statistics
+        :return: n/a
+        """
+        for _, _, path in self._entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        with self._lock:
+            self._memory.clear()
+            self.hits = 0
+            self.memory_hits = 0
+            self.misses = 0
+            self.writes = 0
+            self.evictions = 0
+
+    def stats(self):
+        """
+        :return: dict of hits (of which memory_hits), misses, hit_rate,
+        writes and evictions (by this process), and entries and bytes (in
+        the folder)
+        """
+        entries = self._entries()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'memory_hits': self.memory_hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'writes': self.writes,
+                'evictions': self.evictions,
+                'entries': len(entries),
+                'bytes': sum(size for _, size, _ in entries),
+                'max_bytes': self.max_bytes
+            }
+
+
+def enable_disk_cache(folder, max_bytes=256 * 1024 * 1024, memory_items=32):
+    """
+    Start caching the results of disk_cached functions
+    :param folder: where entries are kept
+    :param max_bytes: size the folder is trimmed back to
+    :param memory_items: number of results also kept in memory
+    :return: DiskCache
+    """
+    global _cache
+    _cache = DiskCache(folder, max_bytes, memory_items)
+    return _cache
+
+
+def disable_disk_cache():
+    """
+    Stop caching; entries already on disk are left alone
+    :return: n/a
+    """
+    global _cache
+    _cache = None
+
+
+def disk_cache_stats():
+    """
+    :return: see DiskCache.stats, or None if the cache isn't enabled
+    """
+    cache = _cache
+    return cache.stats() if cache is not None else None
+
+
+def disk_cached(function):
+    """
+    Decorator caching a function's geometry result on disk, while
+    enable_disk_cache() is in effect. The function must depend only on
+    its arguments.
+    """
+    name = "{}.{}".format(function.__module__, function.__name__)
+    signature = inspect.signature(function)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        cache = _cache
+        if cache is None:
+            return function(*args, **kwargs)
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        key = cache.key(name, bound.arguments)
+        result = cache.get(key)
+        if result is None:
+            result = function(*args, **kwargs)
+            cache.put(key, result)
+        return result
+    return wrapper
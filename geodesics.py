@@ -1,12 +1,279 @@
-import pyproj
 from shapely.geometry import Polygon, MultiPoint, LineString, MultiLineString
 import math
-from pyproj import Geod, Proj
-from shapely.geometry import LineString, MultiPoint, MultiPolygon, Point
-from utils import float_range
+import numpy as np
+from registry import WGS84, get_geod, get_transformer
+from shapely.geometry import LineString, MultiPoint, MultiPolygon, Point, box
+from shapely.affinity import translate
+from shapely.ops import unary_union
+from utils import float_array, interpolate_coords, densify_projected
+from instrumentation import instrumented, counted
+from spherical import SPHERE
+from lazy import lazy, LazyGeometry
+from disk_cache import disk_cached
 
 
-def convert_projection_extent(x1, y1, x2, y2, proj4_string):
+def _densify_geodesic(geo, lons, lats, max_deviation_m, max_depth=20):
+    """
+    Adaptively densify a polyline whose segments are geodesics. Segments
+    are split at their geodesic midpoint while that midpoint is more than
+    max_deviation_m from the straight (lon/lat) line drawn between the ends.
+    All remaining segments are tested together on each pass.
+    :param geo: pyproj Geod
+    :param lons: array of longitudes
+    :param lats: array of latitudes
+    :param max_deviation_m: maximum allowed deviation in meters
+    :param max_depth: maximum number of times a segment may be split
+    :return: (lons, lats) densified arrays
+    """
+    lons = np.asarray(lons, dtype=np.float64)
+    lats = np.asarray(lats, dtype=np.float64)
+    todo = np.ones(lons.size - 1, dtype=bool)
+    for _ in range(0, max_depth):
+        split = np.flatnonzero(todo)
+        if not split.size:
+            break
+        fwd, _, dist = geo.inv(lons[split], lats[split],
+                               lons[split + 1], lats[split + 1])
+        mid_x, mid_y, _ = geo.fwd(lons[split], lats[split], fwd,
+                                  np.asarray(dist) / 2.0)
+        # midpoint of the straight line, the short way round in longitude
+        delta = (lons[split + 1] - lons[split] + 180.0) % 360.0 - 180.0
+        line_x = (lons[split] + delta / 2.0 + 180.0) % 360.0 - 180.0
+        line_y = (lats[split] + lats[split + 1]) / 2.0
+        _, _, deviation = geo.inv(mid_x, mid_y, line_x, line_y)
+        wrong = np.asarray(deviation) > max_deviation_m
+        keep = split[wrong]
+        lons = np.insert(lons, keep + 1, np.asarray(mid_x)[wrong])
+        lats = np.insert(lats, keep + 1, np.asarray(mid_y)[wrong])
+        # both halves of a split segment are tested on the next pass
+        todo = np.zeros(lons.size - 1, dtype=bool)
+        new_index = keep + np.arange(keep.size)
+        todo[new_index] = True
+        todo[new_index + 1] = True
+    return lons, lats
+
+
+def _crossing_latitudes(start, end):
+    """
+    Latitudes where the segments from start to end cross the antimeridian
+    :param start: (K, 2) array of lon/lat
+    :param end: (K, 2) array of lon/lat
+    :return: (K,) array of latitudes
+    """
+    # move the end round the world so the segment is continuous
+    end_lon = end[:, 0] - 360.0 * np.sign(end[:, 0] - start[:, 0])
+    meridian = 180.0 * np.sign(start[:, 0])
+    fraction = (meridian - start[:, 0]) / (end_lon - start[:, 0])
+    return start[:, 1] + fraction * (end[:, 1] - start[:, 1])
+
+
+def _split_line(coords):
+    """
+    Split a line where it crosses the antimeridian, ending and starting
+    the pieces exactly on +/-180. A vertex on +/-180 counts as being on
+    the side of the next vertex (the previous one, at the end of the line).
+    :param coords: (M, 2) array of lon/lat
+    :return: list of (M, 2) arrays, each with at least two distinct vertices
+    """
+    on = np.abs(coords[:, 0]) == 180.0
+    if on.any() and not on.all():
+        positions = np.arange(len(coords))
+        following = np.minimum.accumulate(np.where(on, len(coords), positions)[::-1])[::-1]
+        preceding = np.maximum.accumulate(np.where(on, -1, positions))
+        side = np.where(following < len(coords), following, preceding)
+        coords = coords.copy()
+        coords[on, 0] = np.copysign(180.0, coords[side[on], 0])
+    cross = np.flatnonzero(np.abs(np.diff(coords[:, 0])) > 180.0)
+    if not cross.size:
+        return [coords]
+    lats = _crossing_latitudes(coords[cross], coords[cross + 1])
+    sides = np.copysign(180.0, coords[cross, 0])
+    bounds = np.concatenate(([0], cross + 1, [len(coords)]))
+    parts = []
+    for j in range(0, len(bounds) - 1):
+        part = coords[bounds[j]:bounds[j + 1]]
+        if j > 0 and not (part[0] == (-sides[j - 1], lats[j - 1])).all():
+            part = np.vstack(([(-sides[j - 1], lats[j - 1])], part))
+        if j < len(cross) and not (part[-1] == (sides[j], lats[j])).all():
+            part = np.vstack((part, [(sides[j], lats[j])]))
+        if (part != part[0]).any():
+            parts.append(part)
+    return parts
+
+
+def _clip_ring(ring, meridian, keep_west):
+    """
+    Clip a closed ring to one side of a meridian (Sutherland-Hodgman),
+    in a single vectorized pass
+    :param ring: (M, 2) array, unwrapped longitudes, first vertex repeated at the end
+    :param meridian: longitude to clip at
+    :param keep_west: keep the side west of the meridian, else east
+    :return: (K, 2) array, closed, or None if nothing is left
+    """
+    start = ring[:-1]
+    end = ring[1:]
+    if keep_west:
+        inside = start[:, 0] <= meridian
+        inside_end = end[:, 0] <= meridian
+    else:
+        inside = start[:, 0] >= meridian
+        inside_end = end[:, 0] >= meridian
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fraction = (meridian - start[:, 0]) / (end[:, 0] - start[:, 0])
+    crossing = np.column_stack((np.full(len(start), meridian),
+                                start[:, 1] + fraction * (end[:, 1] - start[:, 1])))
+    # each edge contributes its start (if inside) then its crossing (if any)
+    candidates = np.stack((start, crossing), axis=1).reshape(-1, 2)
+    keep = np.column_stack((inside, inside != inside_end)).ravel()
+    clipped = candidates[keep]
+    if len(clipped) < 3:
+        return None
+    return np.vstack((clipped, clipped[:1]))
+
+
+def _split_ring(coords, pole=None):
+    """
+    Split a polygon ring where it crosses the antimeridian. A ring around
+    a pole is opened at the antimeridian and closed along the pole instead.
+    :param coords: (M, 2) array of lon/lat, not closed
+    :param pole: 90 or -90 if the ring encloses that pole, else None
+    :return: list of closed (K, 2) rings
+    """
+    closed = np.vstack((coords, coords[:1]))
+    step = np.diff(closed[:, 0])
+    cross = np.abs(step) > 180.0
+    if not cross.any():
+        return [closed]
+    if pole is not None:
+        i = np.flatnonzero(cross)[0]
+        # start just after the crossing and run all the way round to it
+        ring = np.roll(coords, -(i + 1), axis=0)
+        lat = _crossing_latitudes(ring[-1:], ring[:1])[0]
+        first = math.copysign(180.0, ring[0, 0])
+        last = math.copysign(180.0, ring[-1, 0])
+        return [np.vstack(([(first, lat)], ring, [(last, lat), (last, pole),
+                                                  (first, pole), (first, lat)]))]
+    # unwrap the longitudes so the ring is continuous, then cut it
+    step[cross] -= 360.0 * np.sign(step[cross])
+    unwrapped = closed.copy()
+    unwrapped[1:, 0] = closed[0, 0] + np.cumsum(step)
+    rings = []
+    if unwrapped[:, 0].max() > 180.0:
+        meridian, shift = 180.0, -360.0
+    else:
+        meridian, shift = -180.0, 360.0
+    for keep_west in (True, False):
+        ring = _clip_ring(unwrapped, meridian, keep_west)
+        if ring is not None:
+            if (meridian > 0) != keep_west:
+                ring[:, 0] += shift
+            rings.append(ring)
+    return rings
+
+
+def _split_polygon(coords, pole=None):
+    """
+    Split a polygon ring at the antimeridian with shapely, for rings too
+    winding for _split_ring (crossing several times, or around a pole and
+    across it again)
+    :param coords: (M, 2) array of lon/lat, not closed
+    :param pole: 90 or -90 if the ring encloses that pole, else None
+    :return: Polygon or MultiPolygon
+    """
+    if pole is not None:
+        # start from the vertex nearest the pole, so the meridian the ring
+        # is closed along can't cut across it
+        coords = np.roll(coords, -int(np.argmax(coords[:, 1] * pole)), axis=0)
+        # on a multiple of 2^-40 degrees (well under a micron), that
+        # meridian is exactly the same again when moved by 360 degrees, so
+        # the pieces either side of it join up
+        coords[0, 0] = np.round(coords[0, 0] * 2.0 ** 40) / 2.0 ** 40
+    step = np.diff(coords[:, 0])
+    step = (step + 180.0) % 360.0 - 180.0
+    unwrapped = coords.copy()
+    unwrapped[1:, 0] = coords[0, 0] + np.cumsum(step)
+    if pole is not None:
+        # round the pole the ring doesn't join up; close it along the pole
+        turns = np.round((unwrapped[-1, 0] - coords[0, 0]) / 360.0)
+        end = coords[0, 0] + 360.0 * turns
+        unwrapped = np.vstack((unwrapped, [(end, coords[0, 1]), (end, pole),
+                                           (coords[0, 0], pole)]))
+    polygon = Polygon(unwrapped)
+    min_x, _, max_x, _ = polygon.bounds
+    parts = []
+    for k in range(int(math.floor((min_x + 180.0) / 360.0)),
+                   int(math.floor((max_x + 180.0) / 360.0)) + 1):
+        piece = polygon.intersection(box(360.0 * k - 180.0, -90.0, 360.0 * k + 180.0, 90.0))
+        piece = translate(piece, -360.0 * k)
+        parts.extend(getattr(piece, 'geoms', [piece]))
+    parts = [part for part in parts if isinstance(part, Polygon) and not part.is_empty]
+    if pole is not None:
+        # the pieces either side of the ring's first longitude join up again
+        merged = unary_union(parts)
+        parts = list(getattr(merged, 'geoms', [merged]))
+    if len(parts) == 1:
+        return parts[0]
+    return MultiPolygon(parts)
+
+
+def _pole_inside(longitudes, latitudes, distances_m):
+    """
+    Which pole (if any) each geodesic circle encloses
+    :return: array of 90.0, -90.0 or 0.0
+    """
+    geo = get_geod('WGS84')
+    _, _, to_north = geo.inv(longitudes, latitudes,
+                             longitudes, np.full_like(latitudes, 90.0))
+    _, _, to_south = geo.inv(longitudes, latitudes,
+                             longitudes, np.full_like(latitudes, -90.0))
+    poles = np.zeros_like(latitudes)
+    poles[np.asarray(to_north) < distances_m] = 90.0
+    poles[np.asarray(to_south) < distances_m] = -90.0
+    return poles
+
+
+def _split_geometry(coords, geom_type, ring=False, pole=None):
+    """
+    Build geom_type from coords, splitting it at the antimeridian first.
+    Lines become a MultiLineString and polygons a MultiPolygon if they
+    had to be split; other types are built as they are.
+    :param coords: (M, 2) array of lon/lat
+    :param geom_type: shapely type, or lazy type (split geometries are
+    always built as shapely geometries)
+    :param ring: coords are a ring, so a polygon may be made from them
+    :param pole: see _split_ring
+    :return: geometry
+    """
+    if isinstance(geom_type, lazy):
+        geom_type = geom_type.kind
+    if geom_type is Polygon and ring:
+        rings = _split_ring(coords, pole)
+        if len(rings) == 1:
+            return Polygon(rings[0])
+        return MultiPolygon([Polygon(part) for part in rings])
+    if geom_type is LineString:
+        parts = _split_line(coords)
+        if len(parts) == 1:
+            return LineString(parts[0])
+        return MultiLineString(parts)
+    return geom_type(coords)
+
+
+def _engine_geod(engine):
+    """
+    :param engine: 'wgs84' or 'sphere'
+    :return: shared pyproj Geod for WGS84, or the numpy SphericalGeod
+    """
+    if engine == 'wgs84':
+        return get_geod('WGS84')
+    if engine == 'sphere':
+        return counted(SPHERE, 'sphere')
+    raise ValueError("unknown engine {}".format(engine))
+
+
+@instrumented
+@disk_cached
+def convert_projection_extent(x1, y1, x2, y2, proj4_string, tolerance=None):
     """
     Use this to generate a densified outline of a projection's extent,
     converted to a WGS84 linestring. 
@@ -14,36 +281,44 @@ def convert_projection_extent(x1, y1, x2, y2, proj4_string):
     inside the area of interest.
     This is useful for showing the canvas extent of a projected map
     on a WGS84 basemap.
+    Vertices which can't be converted (e.g. outside the projection's
+    valid area) are dropped.
     :param x1: bottom left, in projection coords
     :param y1: 
     :param x2: top right, in projection coords
     :param y2: 
     :param proj4_string: proj4 definition of coordinate system 
+    :param tolerance: None for 1000 segments per edge, else only add
+    vertices where the edge curves by more than this many degrees
     :return: LINESTRING projected to WGS84
     """
-    coords = []
-    wgs84_coords = []
-    projector = Proj(proj4_string)
-    wgs84 = pyproj.Proj("+init=EPSG:4326")
-    for y in float_range(y1, y2, 1000):  # west edge
-        coords.append((x1, y))
-    for x in float_range(x1, x2, 1000):  # north edge
-        coords.append((x, y2))
-    for y in float_range(y2, y1, 1000):  # east edge
-        coords.append((x2, y))
-    for x in float_range(x2, x1, 1000):  # south edge
-        coords.append((x, y1))
-    for x, y in coords:
-        try:
-            x1, y1 = pyproj.transform(projector, wgs84, x, y)
-            wgs84_coords.append((x1, y1))
-        except RuntimeError:
-            # ignore tolerance condition errors
-            pass
-    return LineString(wgs84_coords)
-
-
-def get_great_circle_from_two_points(long_1, lat_1, long_2, lat_2, ellipsoid='WGS84'):
+    transformer = get_transformer(proj4_string, WGS84)
+    if tolerance is None:
+        coords = np.concatenate((
+            interpolate_coords(x1, y1, x1, y2, 1000),  # west edge
+            interpolate_coords(x1, y2, x2, y2, 1000),  # north edge
+            interpolate_coords(x2, y2, x2, y1, 1000),  # east edge
+            interpolate_coords(x2, y1, x1, y1, 1000)   # south edge
+        ))
+        lons, lats = transformer.transform(coords[:, 0], coords[:, 1])
+    else:
+        # a few seed vertices per edge, clockwise from bottom left, so
+        # that corners outside the projection's domain don't hide the edge
+        steps = np.linspace(0.0, 1.0, 9)[:-1]
+        xx = np.concatenate((np.full(8, x1), x1 + (x2 - x1) * steps,
+                             np.full(8, x2), x2 + (x1 - x2) * steps, [x1]))
+        yy = np.concatenate((y1 + (y2 - y1) * steps, np.full(8, y2),
+                             y2 + (y1 - y2) * steps, np.full(8, y1), [y1]))
+        _, _, lons, lats = densify_projected(transformer, xx, yy, tolerance)
+    wgs84_coords = np.column_stack((lons, lats))
+    # failed vertices come back as inf, ignore them
+    valid = np.isfinite(wgs84_coords).all(axis=1)
+    return LineString(wgs84_coords[valid])
+
+
+@instrumented
+def get_great_circle_from_two_points(long_1, lat_1, long_2, lat_2, ellipsoid='WGS84',
+                                     engine='wgs84'):
     """
     Get the great circle going through two points as multipoint
     note that a great circle may show a small gap at the end and
@@ -54,43 +329,143 @@ def get_great_circle_from_two_points(long_1, lat_1, long_2, lat_2, ellipsoid='WG
     :param long_2: other point lon
     :param lat_2: other point lat
     :param ellipsoid: use default or 'sphere' to make it join at the ends
+    :param engine: 'wgs84' for pyproj's geodesics on the ellipsoid, or
+    'sphere' for the quicker numpy ones in spherical.py (ellipsoid is
+    then ignored)
     :return: MULTIPOINT
     """
-    # first, find the angle
-    geo = Geod(ellps=ellipsoid)
-    fwd, back, dist = geo.inv(long_1, lat_1, long_2, lat_2, radians=False)
-    coords = []
-    for dist in float_range(0.0, 40075000.0, 10000.0):
-        to_lon, to_lat, to_z = geo.fwd(long_1, lat_1, fwd, dist, radians=False)
-        coords.append((to_lon, to_lat))
-    return MultiPoint(coords)
+    coords = great_circles_through_points(long_1, lat_1, long_2, lat_2,
+                                          resolution_m=4007.5,
+                                          ellipsoid=ellipsoid,
+                                          distance_m=40075000.0,
+                                          engine=engine)
+    return MultiPoint(coords[0])
 
 
-def get_great_circle_from_two_points2(long_1, lat_1, long_2, lat_2, ellipsoid='WGS84'):
+@instrumented
+def get_great_circle_from_two_points2(long_1, lat_1, long_2, lat_2, ellipsoid='WGS84',
+                                      engine='wgs84'):
     """
     Get the great circle going through two points as multipoint
     note that a great circle may show a small gap at the end and
     not join up, unless you choose the ellipsoid = 'sphere' (and even then, it may
     'over-run'.)
+    This version traces the circle from both points.
     :param long_1: start point long
     :param lat_1: start point lat
     :param long_2: other point lon
     :param lat_2: other point lat
     :param ellipsoid: use default or 'sphere' to make it join at the ends
+    :param engine: 'wgs84' for pyproj's geodesics on the ellipsoid, or
+    'sphere' for the quicker numpy ones in spherical.py (ellipsoid is
+    then ignored)
     :return: MULTIPOINT
     """
-    geo = Geod(ellps=ellipsoid)
-    fwd, back, dist = geo.inv(long_1, lat_1, long_2, lat_2, radians=False)
-    fwd2, back2, dist2 = geo.inv(long_2, lat_2, long_1, lat_1, radians=False)
-    coords = []
-    for dist in float_range(0.0, 40075000.0, 10000.0):
-        to_lon, to_lat, to_z = geo.fwd(long_1, lat_1, fwd, dist, radians=False)
-        coords.append((to_lon, to_lat))
-        to_lon, to_lat, to_z = geo.fwd(long_2, lat_2, fwd2, dist, radians=False)
-        coords.append((to_lon, to_lat))
-    return MultiPoint(coords)
+    # tracing 1->2 from the first point and 2->1 from the second
+    coords = great_circles_through_points([long_1, long_2], [lat_1, lat_2],
+                                          [long_2, long_1], [lat_2, lat_1],
+                                          resolution_m=4007.5,
+                                          ellipsoid=ellipsoid,
+                                          distance_m=40075000.0,
+                                          engine=engine)
+    # interleave the two traces, as they were always generated
+    return MultiPoint(coords.transpose(1, 0, 2).reshape(-1, 2))
+
+
+def _geodesic_loop_lengths(geo, latitudes, azimuths):
+    """
+    Length of one full circuit of the geodesics leaving the given latitudes
+    at the given azimuths, i.e. until each is back at its start latitude
+    heading the same way. Exact for meridians and the equator; others end
+    up slightly west or east of the start, as geodesics on an ellipsoid
+    don't close.
+    :param geo: Geod (or SphericalGeod) with semi-axes a and b
+    :param latitudes: array of start latitudes, degrees
+    :param azimuths: array of start azimuths, degrees
+    :return: array of lengths in meters
+    """
+    a, b = geo.a, geo.b
+    # azimuth where the geodesic crosses the equator, via the reduced latitude
+    reduced = np.arctan((b / a) * np.tan(np.radians(latitudes)))
+    sin_alpha0 = np.sin(np.radians(azimuths)) * np.cos(reduced)
+    k2 = (a * a - b * b) / (b * b) * (1.0 - sin_alpha0 ** 2)
+    # series for the arc length of a full turn on the auxiliary sphere,
+    # 2 pi b A1, as in Karney's "Algorithms for geodesics" eq. 17
+    eps = k2 / (np.sqrt(1.0 + k2) + 1.0) ** 2
+    eps2 = eps * eps
+    a1 = (1.0 + eps2 * (eps2 * (eps2 + 4.0) + 64.0) / 256.0) / (1.0 - eps)
+    lengths = 2.0 * math.pi * b * a1
+    # the equator itself is a circle of radius a, not a limit of the above
+    equator = (np.asarray(latitudes) == 0.0) & (np.abs(sin_alpha0) == 1.0)
+    lengths[equator] = 2.0 * math.pi * a
+    return lengths
+
+
+@instrumented
+def great_circles_through_points(longs_1, lats_1, longs_2, lats_2,
+                                 resolution_m=10000.0,
+                                 closed=False,
+                                 ellipsoid='WGS84',
+                                 distance_m=None,
+                                 geom_type=None,
+                                 engine='wgs84'):
+    """
+    Trace the full great circles going through many pairs of points at
+    once, starting at the first point of each pair and heading towards
+    the second.
+    :param longs_1: array of start point longitudes
+    :param lats_1: array of start point latitudes
+    :param longs_2: array of other point longitudes
+    :param lats_2: array of other point latitudes
+    :param resolution_m: maximum spacing of vertices, in meters
+    :param closed: if True, the last vertex is the start point, so each
+    circle joins up exactly; other than meridians and the equator,
+    geodesics on an ellipsoid don't close by themselves, so the last
+    segment then also bridges the gap
+    :param ellipsoid: ellipsoid name, e.g. 'WGS84' or 'sphere'
+    :param distance_m: length traced, defaults to one full circuit of each
+    geodesic, with vertices spaced evenly over it
+    :param geom_type: None for a packed array, else shapely type
+    (e.g. MultiPoint, LineString) applied to each circle,
+    or a lazy type (see lazy.py)
+    :param engine: 'wgs84' for pyproj's geodesics on the ellipsoid, or
+    'sphere' for the numpy ones in spherical.py (ellipsoid is then ignored)
+    :return: (N, M, 2) array of lon/lat, or list of geometries
+    """
+    lon1 = np.atleast_1d(np.asarray(longs_1, dtype=np.float64))
+    lat1 = np.atleast_1d(np.asarray(lats_1, dtype=np.float64))
+    lon2 = np.atleast_1d(np.asarray(longs_2, dtype=np.float64))
+    lat2 = np.atleast_1d(np.asarray(lats_2, dtype=np.float64))
+    lon1, lat1, lon2, lat2 = np.broadcast_arrays(lon1, lat1, lon2, lat2)
+    geo = _engine_geod(engine) if engine != 'wgs84' else get_geod(ellipsoid)
+    fwd = np.empty(lon1.shape, dtype=np.float64)
+    if lon1.size:
+        fwd[:], _, _ = geo.inv(lon1, lat1, lon2, lat2)
+    if distance_m is None:
+        lengths = _geodesic_loop_lengths(geo, lat1.ravel(), fwd.ravel())
+    else:
+        lengths = np.full(lon1.size, float(distance_m))
+    longest = float(lengths.max()) if lengths.size else 2.0 * math.pi * geo.a
+    steps = max(1, int(math.ceil(longest / resolution_m)))
+    shape = (lon1.size, steps + 1)
+    coords = np.empty(shape + (2,), dtype=np.float64)
+    if lon1.size:
+        distances = np.linspace(0.0, 1.0, steps + 1)[None, :] * lengths[:, None]
+        xx, yy, _ = geo.fwd(np.broadcast_to(lon1.reshape(-1, 1), shape),
+                            np.broadcast_to(lat1.reshape(-1, 1), shape),
+                            np.broadcast_to(fwd.reshape(-1, 1), shape),
+                            distances)
+        coords[:, :, 0] = xx
+        coords[:, :, 1] = yy
+    if closed:
+        coords[:, -1, :] = coords[:, 0, :]
+    if geom_type is None:
+        return coords
+    return [geom_type(circle) for circle in coords]
 
 
+@instrumented
+@disk_cached
 def get_tissot_indicatrix(min_longitude=-160, max_longitude=161,
                           min_latitude=-70, max_latitude=70,
                           segments=8,
@@ -105,19 +480,22 @@ def get_tissot_indicatrix(min_longitude=-160, max_longitude=161,
     :param radius_m: radius in meters
     :return: 
     """
-    xx = [x for x in float_range(min_longitude, max_longitude, segments)]
-    yy = [y for y in float_range(min_latitude, max_latitude, segments)]
-    polys = []
-    for x in xx:
-        for y in yy:
-            geom = geodesic_point_buffer(x, y, 100, radius_m, Polygon)
-            polys.append(geom)
+    xx = float_array(min_longitude, max_longitude, segments)
+    yy = float_array(min_latitude, max_latitude, segments)
+    # x-major order, as the grid was always generated
+    grid_x, grid_y = np.meshgrid(xx, yy, indexing='ij')
+    polys = geodesic_point_buffers(grid_x.ravel(), grid_y.ravel(),
+                                   100, radius_m, Polygon)
     return MultiPolygon(polys)
 
 
+@instrumented
+@disk_cached
 def get_bounding_box(longitude_sw, latitude_sw,
                      longitude_ne, latitude_ne,
-                     segments=1000):
+                     segments=1000,
+                     max_deviation_m=None,
+                     max_segment_m=None):
     """
     Create a great circle bounding box, densified (so it will curve nicely
     when projected).
@@ -126,59 +504,285 @@ def get_bounding_box(longitude_sw, latitude_sw,
     :param longitude_ne: degrees [-180,180]
     :param latitude_ne:  degrees [-90,90]
     :param segments: number of segments
+    :param max_deviation_m: see great_circle
+    :param max_segment_m: see great_circle
     :return: geometry (MultiLineString)
     """
-    line_w = great_circle(longitude_sw, latitude_sw, longitude_sw, latitude_ne, segments)
-    line_e = great_circle(longitude_ne, latitude_sw, longitude_ne, latitude_ne, segments)
-    line_n = great_circle(longitude_sw, latitude_ne, longitude_ne, latitude_ne, segments)
-    line_s = great_circle(longitude_sw, latitude_sw, longitude_ne, latitude_sw, segments)
+    options = {'segments': segments,
+               'max_deviation_m': max_deviation_m,
+               'max_segment_m': max_segment_m}
+    # the edges go straight from coordinates into the MultiLineString
+    line_w = _great_circle_coords(longitude_sw, latitude_sw, longitude_sw, latitude_ne, **options)
+    line_e = _great_circle_coords(longitude_ne, latitude_sw, longitude_ne, latitude_ne, **options)
+    line_n = _great_circle_coords(longitude_sw, latitude_ne, longitude_ne, latitude_ne, **options)
+    line_s = _great_circle_coords(longitude_sw, latitude_sw, longitude_ne, latitude_sw, **options)
     return MultiLineString([line_w, line_n, line_e, line_s])
 
 
+@instrumented
 def great_circle_distance(longitude_start, latitude_start,
-                          longitude_end, latitude_end):
+                          longitude_end, latitude_end,
+                          engine='wgs84'):
     """
     Return great circle distance between two lat/lon 
     :param longitude_start: degrees [-180,180] 
     :param latitude_start: degrees [-90,90]
     :param longitude_end: degrees [-180,180]
     :param latitude_end: degrees [-90,90]
+    :param engine: 'wgs84' for pyproj's ellipsoidal geodesics, or 'sphere'
+    for the quicker (within 0.56%) numpy ones in spherical.py
     :return: distance in meters
     """
-    geo = Geod(ellps='WGS84')
+    geo = _engine_geod(engine)
     _, _, dist = geo.inv(longitude_start, latitude_start,
                          longitude_end, latitude_end)
     return dist
 
 
+@instrumented
+def great_circle_distances(longitudes_start, latitudes_start,
+                           longitudes_end, latitudes_end,
+                           engine='wgs84'):
+    """
+    Batch version of great_circle_distance, for arrays of pairs
+    :param longitudes_start: array, degrees [-180,180]
+    :param latitudes_start: array, degrees [-90,90]
+    :param longitudes_end: array, degrees [-180,180]
+    :param latitudes_end: array, degrees [-90,90]
+    :param engine: 'wgs84' for pyproj's ellipsoidal geodesics, or 'sphere'
+    for the quicker (within 0.56%) numpy ones in spherical.py
+    :return: array of distances in meters
+    """
+    lon1, lat1, lon2, lat2 = np.broadcast_arrays(
+        np.atleast_1d(np.asarray(longitudes_start, dtype=np.float64)),
+        np.atleast_1d(np.asarray(latitudes_start, dtype=np.float64)),
+        np.atleast_1d(np.asarray(longitudes_end, dtype=np.float64)),
+        np.atleast_1d(np.asarray(latitudes_end, dtype=np.float64)))
+    geo = _engine_geod(engine)
+    _, _, dist = geo.inv(lon1, lat1, lon2, lat2)
+    return np.asarray(dist, dtype=np.float64)
+
+
+@instrumented
+def great_circle_distance_matrix(longitudes_a, latitudes_a,
+                                 longitudes_b, latitudes_b,
+                                 k=None,
+                                 max_distance_m=None,
+                                 file_name=None,
+                                 chunk_size=1000000):
+    """
+    Distances between every point in a and every point in b, worked out
+    a block of rows at a time so that memory use is bounded.
+    By default the full (N, M) matrix is returned. With k, only the k
+    nearest b for each a are kept; with max_distance_m only pairs within
+    that distance are kept. Both can be combined.
+    :param longitudes_a: N longitudes, degrees [-180,180]
+    :param latitudes_a: N latitudes, degrees [-90,90]
+    :param longitudes_b: M longitudes, degrees [-180,180]
+    :param latitudes_b: M latitudes, degrees [-90,90]
+    :param k: keep the k nearest of b for each of a
+    :param max_distance_m: keep only pairs within this distance
+    :param file_name: write the full matrix to this .npy file, memory-mapped,
+    rather than holding it in memory; not with k or max_distance_m
+    :param chunk_size: approximate number of distances worked out at once
+    :return: full matrix: (N, M) array (np.memmap if file_name given)
+    k: ((N, k) indices into b, (N, k) distances), nearest first; where
+    max_distance_m is also given, missing neighbours have index -1 and
+    distance inf
+    max_distance_m only: (indices into a, indices into b, distances)
+    """
+    if file_name is not None and (k is not None or max_distance_m is not None):
+        raise ValueError("file_name only applies to the full matrix, not with k or max_distance_m")
+    lon_a = np.atleast_1d(np.asarray(longitudes_a, dtype=np.float64))
+    lat_a = np.atleast_1d(np.asarray(latitudes_a, dtype=np.float64))
+    lon_b = np.atleast_1d(np.asarray(longitudes_b, dtype=np.float64))
+    lat_b = np.atleast_1d(np.asarray(latitudes_b, dtype=np.float64))
+    n, m = lon_a.size, lon_b.size
+    geo = get_geod('WGS84')
+    rows = max(1, chunk_size // max(m, 1))
+    if k is not None:
+        k = min(k, m)
+        indices = np.empty((n, k), dtype=np.int64)
+        nearest = np.empty((n, k), dtype=np.float64)
+    elif max_distance_m is not None:
+        found = []
+    elif file_name is not None:
+        matrix = np.lib.format.open_memmap(file_name, mode='w+',
+                                           dtype=np.float64, shape=(n, m))
+    else:
+        matrix = np.empty((n, m), dtype=np.float64)
+    for start in range(0, n, rows):
+        end = min(start + rows, n)
+        _, _, dist = geo.inv(np.repeat(lon_a[start:end], m),
+                             np.repeat(lat_a[start:end], m),
+                             np.tile(lon_b, end - start),
+                             np.tile(lat_b, end - start))
+        dist = np.asarray(dist, dtype=np.float64).reshape(end - start, m)
+        if k is not None:
+            if max_distance_m is not None:
+                dist[dist > max_distance_m] = np.inf
+            if k < m:
+                part = np.argpartition(dist, k - 1, axis=1)[:, :k]
+            else:
+                part = np.broadcast_to(np.arange(m), dist.shape)
+            part_dist = np.take_along_axis(dist, part, axis=1)
+            order = np.argsort(part_dist, axis=1)
+            indices[start:end] = np.take_along_axis(part, order, axis=1)
+            nearest[start:end] = np.take_along_axis(part_dist, order, axis=1)
+        elif max_distance_m is not None:
+            row, col = np.nonzero(dist <= max_distance_m)
+            found.append((row + start, col, dist[row, col]))
+        else:
+            matrix[start:end] = dist
+    if k is not None:
+        if max_distance_m is not None:
+            indices[np.isinf(nearest)] = -1
+        return indices, nearest
+    if max_distance_m is not None:
+        if not found:
+            return (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64),
+                    np.empty(0, dtype=np.float64))
+        return tuple(np.concatenate(parts) for parts in zip(*found))
+    if file_name is not None:
+        matrix.flush()
+    return matrix
+
+
+@instrumented
 def great_circle(longitude_start, latitude_start,
                  longitude_end, latitude_end,
                  segments=100,
-                 geom_type=LineString):
+                 geom_type=LineString,
+                 max_deviation_m=None,
+                 max_segment_m=None,
+                 split_antimeridian=False,
+                 engine='wgs84'):
     """
     Generate great circle between two points with given number of
     segments. Good for plotting flight paths of planes :-)
+    If max_deviation_m or max_segment_m is given, segments is ignored and
+    only as many vertices as needed are used, so short routes stay small.
     :param longitude_start: 
     :param latitude_start: 
     :param longitude_end: 
     :param latitude_end: 
     :param segments: number of segments
-    :param geom_type: use Multipoint or LineString
+    :param geom_type: use Multipoint or LineString, or a lazy type
+    (see lazy.py)
+    :param max_deviation_m: maximum distance in meters between the true
+    great circle and the straight lon/lat line between two vertices
+    :param max_segment_m: maximum length of a segment in meters
+    :param split_antimeridian: split a LineString crossing +/-180 into
+    a MultiLineString
+    :param engine: 'wgs84' for pyproj's ellipsoidal geodesics, or 'sphere'
+    for the quicker (within 0.56%) numpy ones in spherical.py
     :return: WKT of great circle
     """
-    geo = Geod(ellps='WGS84')
-    points = []
-    points.append((longitude_start, latitude_start))
-    # geo.npts only includes intermediate steps
-    points2 = geo.npts(lon1=longitude_start, lat1=latitude_start,
-                       lon2=longitude_end, lat2=latitude_end,
-                       npts=segments-1, radians=False)
-    points.extend(points2)
-    points.append((longitude_end, latitude_end))
+    points = _great_circle_coords(longitude_start, latitude_start,
+                                  longitude_end, latitude_end,
+                                  segments, max_deviation_m, max_segment_m, engine)
+    if split_antimeridian:
+        return _split_geometry(points, geom_type)
     arc = geom_type(points)
     return arc
 
 
+def _great_circle_coords(longitude_start, latitude_start,
+                         longitude_end, latitude_end,
+                         segments=100,
+                         max_deviation_m=None,
+                         max_segment_m=None,
+                         engine='wgs84'):
+    """
+    Coordinates of great_circle, see there for parameters
+    :return: (M, 2) array of lon/lat
+    """
+    geo = _engine_geod(engine)
+    if max_deviation_m is not None or max_segment_m is not None:
+        fwd, _, dist = geo.inv(longitude_start, latitude_start,
+                               longitude_end, latitude_end)
+        steps = 1
+        if max_segment_m is not None:
+            steps = max(1, int(math.ceil(dist / max_segment_m)))
+        fractions = np.arange(1, steps, dtype=np.float64) / steps
+        xx, yy, _ = geo.fwd(np.full(steps - 1, longitude_start, dtype=np.float64),
+                            np.full(steps - 1, latitude_start, dtype=np.float64),
+                            np.full(steps - 1, fwd, dtype=np.float64),
+                            dist * fractions)
+        lons = np.concatenate(([longitude_start], xx, [longitude_end]))
+        lats = np.concatenate(([latitude_start], yy, [latitude_end]))
+        if max_deviation_m is not None:
+            lons, lats = _densify_geodesic(geo, lons, lats, max_deviation_m)
+        return np.column_stack((lons, lats))
+    points = np.empty((segments + 1, 2), dtype=np.float64)
+    points[0] = (longitude_start, latitude_start)
+    # geo.npts only includes intermediate steps
+    if segments > 1:
+        points[1:-1] = geo.npts(lon1=longitude_start, lat1=latitude_start,
+                                lon2=longitude_end, lat2=latitude_end,
+                                npts=segments-1, radians=False)
+    points[-1] = (longitude_end, latitude_end)
+    return points
+
+
+@instrumented
+def great_circles(longitudes_start, latitudes_start,
+                  longitudes_end, latitudes_end,
+                  segments=100,
+                  geom_type=None,
+                  split_antimeridian=False,
+                  engine='wgs84'):
+    """
+    Batch version of great_circle. Densifies every start/end pair in
+    one vectorized pass, which is much quicker than calling great_circle
+    in a loop when plotting thousands of flight paths.
+    :param longitudes_start: array of start longitudes, degrees [-180,180]
+    :param latitudes_start: array of start latitudes, degrees [-90,90]
+    :param longitudes_end: array of end longitudes, degrees [-180,180]
+    :param latitudes_end: array of end latitudes, degrees [-90,90]
+    :param segments: number of segments per route
+    :param geom_type: None for a packed array, else shapely type
+    (e.g. LineString, MultiPoint) applied to each route,
+    or a lazy type (see lazy.py)
+    :param split_antimeridian: split LineStrings crossing +/-180 into
+    MultiLineStrings
+    :param engine: 'wgs84' for pyproj's ellipsoidal geodesics, or 'sphere'
+    for the quicker (within 0.56%) numpy ones in spherical.py
+    :return: (N, segments+1, 2) array of lon/lat, or list of geometries
+    """
+    lon1 = np.atleast_1d(np.asarray(longitudes_start, dtype=np.float64))
+    lat1 = np.atleast_1d(np.asarray(latitudes_start, dtype=np.float64))
+    lon2 = np.atleast_1d(np.asarray(longitudes_end, dtype=np.float64))
+    lat2 = np.atleast_1d(np.asarray(latitudes_end, dtype=np.float64))
+    lon1, lat1, lon2, lat2 = np.broadcast_arrays(lon1, lat1, lon2, lat2)
+    geo = _engine_geod(engine)
+    coords = np.empty((lon1.size, segments + 1, 2), dtype=np.float64)
+    coords[:, 0, 0] = lon1
+    coords[:, 0, 1] = lat1
+    coords[:, -1, 0] = lon2
+    coords[:, -1, 1] = lat2
+    if segments > 1 and lon1.size:
+        fwd, _, dist = geo.inv(lon1, lat1, lon2, lat2)
+        # intermediate vertices only, the ends are copied exactly
+        fractions = np.arange(1, segments, dtype=np.float64) / segments
+        shape = (lon1.size, segments - 1)
+        xx, yy, _ = geo.fwd(np.broadcast_to(lon1[:, None], shape),
+                            np.broadcast_to(lat1[:, None], shape),
+                            np.broadcast_to(fwd[:, None], shape),
+                            dist[:, None] * fractions[None, :])
+        coords[:, 1:-1, 0] = xx
+        coords[:, 1:-1, 1] = yy
+    if geom_type is None:
+        return coords
+    if split_antimeridian:
+        # only routes which actually cross need splitting
+        crosses = (np.abs(np.diff(coords[:, :, 0], axis=1)) > 180.0).any(axis=1)
+        return [_split_geometry(route, geom_type) if cross else geom_type(route)
+                for route, cross in zip(coords, crosses)]
+    return [geom_type(route) for route in coords]
+
+
+@instrumented
 def geo_point_buffer(longitude, latitude,
                      segments, distance_m,
                      geom_type=MultiPoint,
@@ -199,26 +803,24 @@ def geo_point_buffer(longitude, latitude,
 
     spec = "+proj=aeqd +lat_0={} +lon_0={} +x_0=0 +y_0=0 +a=6371000 +b=6371000 +units=m +no_defs"
     spec = spec.format(latitude, longitude)
-    custom = pyproj.Proj(spec)
-    wgs84 = pyproj.Proj("+init=EPSG:4326")
-    geodesic = pyproj.Geod(ellps='WGS84')
-    coords = []
-    xx, yy = pyproj.transform(wgs84, custom, longitude, latitude)
-    for i in range(0, segments):
-        angle = (2.0 * math.pi / segments) * float(i)
-        x1 = xx + distance_m * math.sin(angle)
-        y1 = yy + distance_m * math.cos(angle)
-        x84, y84 = pyproj.transform(custom, wgs84, x1, y1)
-        coords.append((x84, y84))
-
-    ring = geom_type(coords)
+    to_custom = get_transformer(WGS84, spec)
+    from_custom = get_transformer(spec, WGS84)
+    xx, yy = to_custom.transform(longitude, latitude)
+    angles = (2.0 * math.pi / segments) * np.arange(segments, dtype=np.float64)
+    x84, y84 = from_custom.transform(xx + distance_m * np.sin(angles),
+                                     yy + distance_m * np.cos(angles))
+
+    ring = geom_type(np.column_stack((x84, y84)))
 
     return ring
 
 
+@instrumented
 def geodesic_point_buffer(longitude, latitude,
                           segments, distance_m,
-                          geom_type=MultiPoint):
+                          geom_type=MultiPoint,
+                          split_antimeridian=False,
+                          engine='wgs84'):
     """
     Creates a buffer in meters around a point given as long, lat in WGS84
     Uses the geodesic, so should be much more accurate over larger distances
@@ -227,80 +829,571 @@ def geodesic_point_buffer(longitude, latitude,
     :param latitude: center point latitude
     :param segments: segments to approximate (more = smoother)
     :param distance_m: distance in meters
-    :param geom_type: shapely type (e.g. Multipoint, Linestring, Polygon)
+    :param geom_type: shapely type (e.g. Multipoint, Linestring, Polygon),
+    or a lazy type (see lazy.py)
+    :param split_antimeridian: split a Polygon (or LineString) crossing
+    +/-180 into a MultiPolygon (or MultiLineString). A Polygon around a
+    pole is closed along the pole instead.
+    :param engine: 'wgs84' for pyproj's ellipsoidal geodesics, or 'sphere'
+    for the quicker (within 0.56%) numpy ones in spherical.py
     :return: geometry, of requested type
     """
-    geodesic = pyproj.Geod(ellps='WGS84')
-    coords = []
-    for i in range(0, segments):
-        angle = (360.0 / segments) * float(i)
-        x1, y1, z1 = geodesic.fwd(lons=longitude,
-                                  lats=latitude,
-                                  az=angle,
-                                  dist=distance_m,
-                                  radians=False)
-        coords.append((x1, y1))
-
-    ring = geom_type(coords)
+    if split_antimeridian:
+        return geodesic_point_buffers(longitude, latitude, segments, distance_m,
+                                      geom_type, split_antimeridian, engine)[0]
+    coords = geodesic_point_buffers(longitude, latitude, segments, distance_m,
+                                    engine=engine)
+    ring = geom_type(coords[0])
 
     return ring
 
 
-def get_square_point_buffer(longitude_centre, latitude_centre, size_m):
+@instrumented
+def geodesic_point_buffers(longitudes, latitudes,
+                           segments, distances_m,
+                           geom_type=None,
+                           split_antimeridian=False,
+                           engine='wgs84'):
+    """
+    Batch version of geodesic_point_buffer. Every azimuth of every centre
+    is computed with a single broadcast fwd call.
+
+    :param longitudes: array of centre longitudes
+    :param latitudes: array of centre latitudes
+    :param segments: segments to approximate (more = smoother)
+    :param distances_m: distance in meters, scalar or one per centre
+    :param geom_type: None for a packed array, else shapely type
+    (e.g. Multipoint, Linestring, Polygon) applied to each buffer,
+    or a lazy type (see lazy.py)
+    :param split_antimeridian: see geodesic_point_buffer
+    :param engine: see geodesic_point_buffer
+    :return: (N, segments, 2) array of lon/lat, or list of geometries
+    """
+    lons = np.atleast_1d(np.asarray(longitudes, dtype=np.float64))
+    lats = np.atleast_1d(np.asarray(latitudes, dtype=np.float64))
+    dists = np.atleast_1d(np.asarray(distances_m, dtype=np.float64))
+    lons, lats, dists = np.broadcast_arrays(lons, lats, dists)
+    geodesic = _engine_geod(engine)
+    angles = (360.0 / segments) * np.arange(segments, dtype=np.float64)
+    shape = (lons.size, segments)
+    coords = np.empty(shape + (2,), dtype=np.float64)
+    if lons.size:
+        xx, yy, _ = geodesic.fwd(lons=np.broadcast_to(lons[:, None], shape),
+                                 lats=np.broadcast_to(lats[:, None], shape),
+                                 az=np.broadcast_to(angles[None, :], shape),
+                                 dist=np.broadcast_to(dists[:, None], shape),
+                                 radians=False)
+        coords[:, :, 0] = xx
+        coords[:, :, 1] = yy
+    if geom_type is None:
+        return coords
+    if split_antimeridian:
+        # only buffers which actually cross need splitting
+        closed = np.concatenate((coords[:, :, 0], coords[:, :1, 0]), axis=1)
+        crosses = (np.abs(np.diff(closed, axis=1)) > 180.0).any(axis=1)
+        poles = np.zeros(lons.size)
+        kind = geom_type.kind if isinstance(geom_type, lazy) else geom_type
+        if kind is Polygon and crosses.any():
+            poles[crosses] = _pole_inside(lons[crosses], lats[crosses], dists[crosses])
+        return [_split_geometry(ring, geom_type, True, pole or None) if cross else geom_type(ring)
+                for ring, cross, pole in zip(coords, crosses, poles)]
+    return [geom_type(ring) for ring in coords]
+
+
+@instrumented
+def geodesic_corridor(longitude_start, latitude_start,
+                      longitude_end, latitude_end,
+                      distance_m,
+                      segments=100,
+                      cap_segments=16,
+                      geom_type=Polygon,
+                      split_antimeridian=False,
+                      engine='wgs84'):
+    """
+    Corridor of everything within distance_m of the great circle route
+    between two points, e.g. a flight corridor
+
+    :param longitude_start: route start longitude
+    :param latitude_start: route start latitude
+    :param longitude_end: route end longitude
+    :param latitude_end: route end latitude
+    :param distance_m: half width of the corridor in meters
+    :param segments: number of segments along the route
+    :param cap_segments: segments in each semicircular end cap
+    :param geom_type: shapely type (e.g. Polygon, LineString), or a lazy
+    type (see lazy.py)
+    :param split_antimeridian: see geodesic_point_buffer
+    :param engine: see geodesic_point_buffer
+    :return: geometry, of requested type
+    """
+    return geodesic_corridors(longitude_start, latitude_start,
+                              longitude_end, latitude_end, distance_m,
+                              segments, cap_segments, geom_type,
+                              split_antimeridian, engine)[0]
+
+
+@instrumented
+def geodesic_corridors(longitudes_start, latitudes_start,
+                       longitudes_end, latitudes_end,
+                       distances_m,
+                       segments=100,
+                       cap_segments=16,
+                       geom_type=None,
+                       split_antimeridian=False,
+                       engine='wgs84'):
+    """
+    Batch version of geodesic_corridor, without building and merging a
+    buffer per route vertex. Each route is densified with one fwd call,
+    which also gives its azimuth at every vertex; the corridor's sides are
+    the points distances_m away at right angles to the route (the nearest
+    route point to each of them), joined by semicircles around the ends,
+    and all of them for all routes come from a second fwd call.
+    The ring runs clockwise, like geodesic_point_buffer's, and is a valid
+    polygon as long as distances_m is under a quarter of the way round the
+    earth and the end caps don't meet round the back of it. Corridors
+    crossing the antimeridian (or around a pole) should be split for that.
+
+    :param longitudes_start: array of start longitudes, degrees [-180,180]
+    :param latitudes_start: array of start latitudes, degrees [-90,90]
+    :param longitudes_end: array of end longitudes, degrees [-180,180]
+    :param latitudes_end: array of end latitudes, degrees [-90,90]
+    :param distances_m: half width in meters, scalar or one per route
+    :param segments: number of segments along each route
+    :param cap_segments: segments in each semicircular end cap
+    :param geom_type: None for a packed array, else shapely type applied
+    to each corridor, or a lazy type (see lazy.py)
+    :param split_antimeridian: see geodesic_point_buffer
+    :param engine: see geodesic_point_buffer
+    :return: (N, 2 * (segments + cap_segments), 2) array of lon/lat, or
+    list of geometries
+    """
+    lon1, lat1, lon2, lat2, dists = np.broadcast_arrays(
+        np.atleast_1d(np.asarray(longitudes_start, dtype=np.float64)),
+        np.atleast_1d(np.asarray(latitudes_start, dtype=np.float64)),
+        np.atleast_1d(np.asarray(longitudes_end, dtype=np.float64)),
+        np.atleast_1d(np.asarray(latitudes_end, dtype=np.float64)),
+        np.atleast_1d(np.asarray(distances_m, dtype=np.float64)))
+    lon1, lat1, lon2, lat2, dists = [np.ascontiguousarray(values) for values in
+                                     (lon1, lat1, lon2, lat2, dists)]
+    geo = _engine_geod(engine)
+    count = lon1.size
+    size = 2 * (segments + cap_segments)
+    coords = np.empty((count, size, 2), dtype=np.float64)
+    if count:
+        fwd, _, length = geo.inv(lon1, lat1, lon2, lat2)
+        fwd = np.asarray(fwd, dtype=np.float64)
+        fractions = np.arange(segments + 1, dtype=np.float64) / segments
+        shape = (count, segments + 1)
+        xx, yy, back = geo.fwd(np.broadcast_to(lon1[:, None], shape),
+                               np.broadcast_to(lat1[:, None], shape),
+                               np.broadcast_to(fwd[:, None], shape),
+                               np.asarray(length, dtype=np.float64)[:, None] * fractions[None, :])
+        lons = np.asarray(xx, dtype=np.float64).reshape(shape)
+        lats = np.asarray(yy, dtype=np.float64).reshape(shape)
+        azimuths = np.asarray(back, dtype=np.float64).reshape(shape) + 180.0
+        # the ends exactly as given; at the start, the route heads along fwd
+        lons[:, 0], lats[:, 0], azimuths[:, 0] = lon1, lat1, fwd
+        lons[:, -1], lats[:, -1] = lon2, lat2
+        # a route of no length is a circle; keep its vertices identical so
+        # the sides don't zigzag by rounding errors
+        still = np.asarray(length) == 0.0
+        if still.any():
+            lons[still] = lon1[still, None]
+            lats[still] = lat1[still, None]
+            azimuths[still] = fwd[still, None]
+        # which route vertex each corridor vertex is offset from, and the
+        # angle it's offset at: along the left side, round the end, back
+        # along the right side and round the start
+        sweep = (180.0 / cap_segments) * np.arange(1, cap_segments, dtype=np.float64)
+        along = np.arange(segments + 1)
+        vertex = np.concatenate((along, np.full(cap_segments - 1, segments),
+                                 along[::-1], np.zeros(cap_segments - 1, dtype=np.int64)))
+        turn = np.concatenate((np.full(segments + 1, -90.0), sweep - 90.0,
+                               np.full(segments + 1, 90.0), sweep + 90.0))
+        shape = (count, size)
+        xx, yy, _ = geo.fwd(lons[:, vertex], lats[:, vertex],
+                            azimuths[:, vertex] + turn[None, :],
+                            np.broadcast_to(dists[:, None], shape))
+        coords[:, :, 0] = np.asarray(xx, dtype=np.float64).reshape(shape)
+        coords[:, :, 1] = np.asarray(yy, dtype=np.float64).reshape(shape)
+    if geom_type is None:
+        return coords
+    if split_antimeridian:
+        closed = np.concatenate((coords[:, :, 0], coords[:, :1, 0]), axis=1)
+        steps = np.diff(closed, axis=1)
+        crosses = (np.abs(steps) > 180.0).any(axis=1)
+        # a ring going all the way round the world encloses a pole; being
+        # clockwise, westwards round the north pole and eastwards round the south
+        steps = (steps + 180.0) % 360.0 - 180.0
+        winding = steps.sum(axis=1)
+        poles = np.where(winding < -180.0, 90.0, np.where(winding > 180.0, -90.0, 0.0))
+        kind = geom_type.kind if isinstance(geom_type, lazy) else geom_type
+        if kind is not Polygon:
+            return [_split_geometry(ring, geom_type, True) if cross else geom_type(ring)
+                    for ring, cross in zip(coords, crosses)]
+        return [_split_polygon(ring, pole or None) if cross else geom_type(ring)
+                for ring, cross, pole in zip(coords, crosses, poles)]
+    return [geom_type(ring) for ring in coords]
+
+
+@instrumented
+def in_geodesic_point_buffer(longitudes, latitudes,
+                             longitudes_centre, latitudes_centre,
+                             distances_m,
+                             return_distance=False):
+    """
+    Test whether points fall within a geodesic buffer, using the true
+    geodesic distance to the centre rather than a buffer polygon.
+    Arguments are broadcast against each other numpy-style, so e.g. pass
+    points[:, None] and centres[None, :] to test every point against
+    every centre.
+    :param longitudes: point longitudes
+    :param latitudes: point latitudes
+    :param longitudes_centre: buffer centre longitudes
+    :param latitudes_centre: buffer centre latitudes
+    :param distances_m: buffer radii in meters
+    :param return_distance: also return the distances
+    :return: boolean array (and array of distances in meters, if
+    return_distance)
+    """
+    lons, lats, centre_lons, centre_lats, radii = np.broadcast_arrays(
+        np.asarray(longitudes, dtype=np.float64),
+        np.asarray(latitudes, dtype=np.float64),
+        np.asarray(longitudes_centre, dtype=np.float64),
+        np.asarray(latitudes_centre, dtype=np.float64),
+        np.asarray(distances_m, dtype=np.float64))
+    _, _, dist = get_geod('WGS84').inv(centre_lons.ravel(), centre_lats.ravel(),
+                                       lons.ravel(), lats.ravel())
+    dist = np.asarray(dist, dtype=np.float64).reshape(lons.shape)
+    inside = dist <= radii
+    if return_distance:
+        return inside, dist
+    return inside
+
+
+def _eastern_longitudes(geo, lons, lats, dists, max_iterations=60):
+    """
+    Longitudes where geodesic circles (which don't contain a pole) reach
+    furthest east. There the circle runs due north-south, so the geodesic
+    from the centre arrives heading due east; its starting azimuth is
+    found by secant steps from the spherical answer, falling back to
+    bisection (the arrival azimuth grows steadily from 0 to 180 as the
+    starting azimuth does).
+    :return: array of longitudes, in [-180,180]
+    """
+    # spherical triangle: cos(azimuth) = tan(radius) tan(latitude)
+    sigma = np.minimum(dists / 6371008.8, 0.5 * math.pi - 1e-9)
+    azimuths = np.degrees(np.arccos(np.clip(np.tan(sigma) * np.tan(np.radians(lats)),
+                                            -1.0, 1.0)))
+    east = np.empty(lons.size, dtype=np.float64)
+    low = np.zeros(lons.size, dtype=np.float64)
+    high = np.full(lons.size, 180.0)
+    active = np.arange(lons.size)
+    previous = None
+    for iteration in range(0, max_iterations):
+        xx, _, back = geo.fwd(lons[active], lats[active], azimuths, dists[active])
+        east[active] = xx
+        # arrival azimuth less 90, in [-180,180)
+        error = (np.asarray(back, dtype=np.float64) + 270.0) % 360.0 - 180.0
+        low[active] = np.where(error < 0.0, azimuths, low[active])
+        high[active] = np.where(error > 0.0, azimuths, high[active])
+        if previous is None:
+            following = azimuths + 1e-3
+        else:
+            previous_azimuths, previous_error = previous
+            slope = (error - previous_error) / (azimuths - previous_azimuths)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                following = azimuths - error / slope
+        outside = ~((following > low[active]) & (following < high[active]))
+        following = np.where(outside, 0.5 * (low[active] + high[active]), following)
+        # the longitude is at an extreme, so barely moves near the answer
+        unfinished = np.abs(error) > 1e-9
+        if not unfinished.any():
+            break
+        active = active[unfinished]
+        previous = (azimuths[unfinished], error[unfinished])
+        azimuths = following[unfinished]
+    return east
+
+
+@instrumented
+def geodesic_circle_bounds(longitudes, latitudes, distances_m):
+    """
+    Bounding boxes of geodesic circles (as drawn by geodesic_point_buffer),
+    worked out directly rather than by tracing the circles. The northern
+    and southern extremes lie due north and south of the centre, and the
+    eastern and western ones are found in a few fwd calls each.
+    :param longitudes: array of centre longitudes
+    :param latitudes: array of centre latitudes
+    :param distances_m: radius in meters, scalar or one per centre
+    :return: (N, 4) array of west, south, east, north. A circle crossing
+    the antimeridian has west > east (as in geojson); one containing a pole
+    reaches that pole and spans all longitudes.
+    """
+    lons = np.atleast_1d(np.asarray(longitudes, dtype=np.float64))
+    lats = np.atleast_1d(np.asarray(latitudes, dtype=np.float64))
+    dists = np.atleast_1d(np.asarray(distances_m, dtype=np.float64))
+    lons, lats, dists = [np.ascontiguousarray(values) for values in
+                         np.broadcast_arrays(lons, lats, dists)]
+    bounds = np.empty((lons.size, 4), dtype=np.float64)
+    if not lons.size:
+        return bounds
+    geo = get_geod('WGS84')
+    _, north, _ = geo.fwd(lons, lats, np.zeros(lons.size), dists)
+    _, south, _ = geo.fwd(lons, lats, np.full(lons.size, 180.0), dists)
+    _, _, to_north = geo.inv(lons, lats, lons, np.full(lons.size, 90.0))
+    _, _, to_south = geo.inv(lons, lats, lons, np.full(lons.size, -90.0))
+    north_pole = np.asarray(to_north) <= dists
+    south_pole = np.asarray(to_south) <= dists
+    polar = north_pole | south_pole
+    bounds[:, 1] = np.where(south_pole, -90.0, south)
+    bounds[:, 3] = np.where(north_pole, 90.0, north)
+    bounds[:, 0] = -180.0
+    bounds[:, 2] = 180.0
+    if not polar.all():
+        rest = ~polar
+        east = _eastern_longitudes(geo, lons[rest], lats[rest], dists[rest])
+        # circles are symmetric about their central meridian
+        span = (east - lons[rest]) % 360.0
+        bounds[rest, 0] = (lons[rest] - span + 180.0) % 360.0 - 180.0
+        bounds[rest, 2] = (lons[rest] + span + 180.0) % 360.0 - 180.0
+    return bounds
+
+
+def _polygon_rings(polygons):
+    """
+    Flatten polygons into one run of ring coordinates
+    :param polygons: (N, M, 2) array of rings, PackedGeometries, or a list
+    of Polygon, MultiPolygon, LazyGeometry or (M, 2) arrays
+    :return: ((V, 2) coordinates, ring offsets (R + 1), polygon of each
+    ring (R), whether each ring is a hole (R), number of polygons)
+    """
+    if hasattr(polygons, 'ring_offsets'):
+        # PackedGeometries; the first ring of each part is its exterior
+        ring_offsets = np.asarray(polygons.ring_offsets, dtype=np.int64)
+        part_offsets = np.asarray(polygons.part_offsets, dtype=np.int64)
+        geom_offsets = np.asarray(polygons.geom_offsets, dtype=np.int64)
+        rings = len(ring_offsets) - 1
+        ring_part = np.repeat(np.arange(len(part_offsets) - 1), np.diff(part_offsets))
+        part_geom = np.repeat(np.arange(len(geom_offsets) - 1), np.diff(geom_offsets))
+        holes = np.ones(rings, dtype=bool)
+        holes[part_offsets[:-1][np.diff(part_offsets) > 0]] = False
+        return (np.asarray(polygons.coordinates), ring_offsets,
+                part_geom[ring_part], holes, len(geom_offsets) - 1)
+    if isinstance(polygons, np.ndarray):
+        count, size = polygons.shape[:2]
+        return (polygons.reshape(-1, 2), np.arange(count + 1, dtype=np.int64) * size,
+                np.arange(count), np.zeros(count, dtype=bool), count)
+    chunks, lengths, owners, holes = [], [], [], []
+    count = 0
+    for count, polygon in enumerate(polygons, 1):
+        if isinstance(polygon, LazyGeometry):
+            boundaries = [(polygon.coords, False)]
+        elif isinstance(polygon, np.ndarray):
+            boundaries = [(polygon, False)]
+        else:
+            parts = polygon.geoms if isinstance(polygon, MultiPolygon) else [polygon]
+            boundaries = []
+            for part in parts:
+                boundaries.append((part.exterior.coords, False))
+                boundaries.extend((interior.coords, True) for interior in part.interiors)
+        for coords, hole in boundaries:
+            coords = np.asarray(coords, dtype=np.float64)[:, :2]
+            chunks.append(coords)
+            lengths.append(len(coords))
+            owners.append(count - 1)
+            holes.append(hole)
+    ring_offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=ring_offsets[1:])
+    coords = np.concatenate(chunks) if chunks else np.empty((0, 2))
+    return (coords, ring_offsets, np.asarray(owners, dtype=np.int64),
+            np.asarray(holes, dtype=bool), count)
+
+
+def _next_vertices(ring_offsets, size):
+    """
+    :return: index of the vertex following each one around its ring
+    """
+    following = np.arange(1, size + 1, dtype=np.int64)
+    starts, ends = ring_offsets[:-1], ring_offsets[1:]
+    filled = ends > starts
+    following[ends[filled] - 1] = starts[filled]
+    return following
+
+
+def _wrap_degrees(longitudes):
+    """
+    Wrap longitude differences into [-180, 180], leaving small ones exact
+    """
+    longitudes = np.where(longitudes > 180.0, longitudes - 360.0, longitudes)
+    return np.where(longitudes < -180.0, longitudes + 360.0, longitudes)
+
+
+@instrumented
+def geodesic_areas(polygons, engine='wgs84'):
+    """
+    Areas of many polygons on the ellipsoid, straight from their lon/lat
+    coordinates (no reprojection), vectorized over every vertex at once.
+    Latitudes are mapped to the authalic (equal area) sphere, where each
+    edge adds the signed area between it and the equator. Edges are taken
+    as great circles on that sphere rather than ellipsoidal geodesics, so
+    for densified outputs such as geodesic buffers and projection extents
+    areas are within 1e-6 of pyproj's polygon_area_perimeter (~1e-9 for
+    buffers under 100km), and within 2e-5 for edges of 1000km.
+    Rings may run either way, be closed or not, and cross the
+    antimeridian; each must enclose less than half the earth. Holes are
+    subtracted.
+    :param polygons: (N, M, 2) array of rings (e.g. from
+    geodesic_point_buffers with geom_type=None), a PackedGeometries of
+    polygons, or a list of Polygon, MultiPolygon, LazyGeometry or (M, 2)
+    arrays
+    :param engine: 'wgs84', or 'sphere' for areas on the sphere of
+    spherical.py, to go with its buffers (about 0.85% from WGS84)
+    :return: array of areas in square meters
+    """
+    coords, ring_offsets, owners, holes, count = _polygon_rings(polygons)
+    geo = _engine_geod(engine)
+    following = _next_vertices(ring_offsets, len(coords))
+    # longitudes relative to the start of their ring, then each edge's
+    # change in longitude; kept small so rounding doesn't swamp the area
+    # of small rings, which is left after much larger terms cancel out
+    starts = np.repeat(ring_offsets[:-1], np.diff(ring_offsets))
+    lons = _wrap_degrees(coords[:, 0] - coords[starts, 0])
+    dlam = np.radians(_wrap_degrees(lons[following] - lons))
+    phi = np.radians(coords[:, 1])
+    if engine == 'wgs84':
+        e2 = geo.f * (2.0 - geo.f)
+        e = math.sqrt(e2)
+        q_pole = 1.0 + (1.0 - e2) / e * math.atanh(e)
+        sin_phi = np.sin(phi)
+        q = (1.0 - e2) * (sin_phi / (1.0 - e2 * sin_phi * sin_phi) + np.arctanh(e * sin_phi) / e)
+        phi = np.arcsin(np.clip(q / q_pole, -1.0, 1.0))
+        radius_squared = geo.a * geo.a * q_pole / 2.0
+    else:
+        radius_squared = geo.a * geo.a
+    t1 = np.tan(0.5 * phi)
+    t2 = t1[following]
+    excess = 2.0 * np.arctan2(np.tan(0.5 * dlam) * (t1 + t2), 1.0 + t1 * t2)
+    ring_sums = np.add.reduceat(np.append(excess, 0.0), ring_offsets[:-1])
+    windings = np.add.reduceat(np.append(dlam, 0.0), ring_offsets[:-1])
+    empty = ring_offsets[1:] == ring_offsets[:-1]
+    ring_sums[empty] = 0.0
+    windings[empty] = 0.0
+    ring_areas = np.abs(ring_sums)
+    # a ring around a pole measured the band between it and the equator
+    polar = np.abs(windings) > math.pi
+    ring_areas[polar] = 2.0 * math.pi - ring_areas[polar]
+    ring_areas *= radius_squared
+    return np.bincount(owners, weights=np.where(holes, -ring_areas, ring_areas),
+                       minlength=count).astype(np.float64)
+
+
+@instrumented
+def geodesic_perimeters(polygons, engine='wgs84'):
+    """
+    Perimeters of many polygons, holes included, as one inv call over all
+    of their edges
+    :param polygons: as for geodesic_areas
+    :param engine: 'wgs84' for pyproj's ellipsoidal geodesics, or 'sphere'
+    for the quicker (within 0.56%) numpy ones in spherical.py
+    :return: array of perimeters in meters
+    """
+    coords, ring_offsets, owners, _, count = _polygon_rings(polygons)
+    following = _next_vertices(ring_offsets, len(coords))
+    lons = np.ascontiguousarray(coords[:, 0], dtype=np.float64)
+    lats = np.ascontiguousarray(coords[:, 1], dtype=np.float64)
+    geo = _engine_geod(engine)
+    _, _, lengths = geo.inv(lons, lats, lons[following], lats[following])
+    ring_lengths = np.bincount(np.repeat(np.arange(len(owners)), np.diff(ring_offsets)),
+                               weights=np.asarray(lengths, dtype=np.float64),
+                               minlength=len(owners))
+    return np.bincount(owners, weights=ring_lengths, minlength=count).astype(np.float64)
+
+
+def _square_polygon(ring, crosses, split_antimeridian):
+    """
+    Polygon of a square buffer's ring
+    :param ring: (M, 2) array of lon/lat, closed
+    :param crosses: whether the square crosses the antimeridian, i.e. its
+    bounds have west > east
+    :param split_antimeridian: see get_square_point_buffer
+    :return: Polygon or MultiPolygon
+    """
+    if not crosses:
+        return Polygon(ring)
+    # carry the longitudes on continuously from the first corner, so a
+    # square across the antimeridian goes past 180 rather than round the world
+    step = (np.diff(ring[:, 0]) + 180.0) % 360.0 - 180.0
+    ring = ring.copy()
+    ring[1:, 0] = ring[0, 0] + np.cumsum(step)
+    if split_antimeridian:
+        return _split_polygon(ring[:-1])
+    return Polygon(ring)
+
+
+@instrumented
+def get_square_point_buffer(longitude_centre, latitude_centre, size_m,
+                            split_antimeridian=False):
     """
     Create a square buffer. Done as cartesian bound box of geodesic buffer
     :param longitude_centre: 
     :param latitude_centre: 
     :param size_m: length of edge
+    :param split_antimeridian: split a square crossing +/-180 into a
+    MultiPolygon; otherwise its eastern longitudes go on past 180
     :return: polygon
     """
-    circle = geodesic_point_buffer(longitude_centre, latitude_centre, 1000,
-                                   size_m/2.0, LineString)
-    min_x = min([x for x, y in circle.coords])
-    min_y = min([y for x, y in circle.coords])
-    max_x = max([x for x, y in circle.coords])
-    max_y = max([y for x, y in circle.coords])
-    return Polygon(
-        [
-            [min_x, min_y],
-            [min_x, max_y],
-            [max_x, max_y],
-            [max_x, min_y],
-            [min_x, min_y]
-        ]
+    min_x, min_y, max_x, max_y = geodesic_circle_bounds(longitude_centre, latitude_centre,
+                                                        size_m/2.0)[0]
+    # crossing the antimeridian, west > east; see geodesic_circle_bounds
+    crosses = min_x > max_x
+    if crosses:
+        max_x += 360.0
+    return _square_polygon(
+        np.array(
+            [
+                [min_x, min_y],
+                [min_x, max_y],
+                [max_x, max_y],
+                [max_x, min_y],
+                [min_x, min_y]
+            ]
+        ),
+        crosses,
+        split_antimeridian
     )
 
 
-def get_square_point_buffer_geodesic(longitude_centre, latitude_centre, size_m):
+@instrumented
+def get_square_point_buffer_geodesic(longitude_centre, latitude_centre, size_m,
+                                     max_deviation_m=None,
+                                     max_segment_m=None,
+                                     split_antimeridian=False):
     """
     Create a square buffer. Edges are great circles.
     :param longitude_centre: 
     :param latitude_centre: 
     :param size_m: length of edge
+    :param max_deviation_m: see great_circle
+    :param max_segment_m: see great_circle
+    :param split_antimeridian: see get_square_point_buffer
     :return: polygon
     """
-    circle = geodesic_point_buffer(longitude_centre, latitude_centre, 1000,
-                                   size_m/2.0, LineString)
-    min_x = min([x for x, y in circle.coords])
-    min_y = min([y for x, y in circle.coords])
-    max_x = max([x for x, y in circle.coords])
-    max_y = max([y for x, y in circle.coords])
-    geom_w = great_circle(min_x, min_y, min_x, max_y)
-    geom_n = great_circle(min_x, max_y, max_x, max_y)
-    geom_e = great_circle(max_x, max_y, max_x, min_y)
-    geom_s = great_circle(max_x, min_y, min_x, min_y)
-    points = []
-    for x, y in geom_w.coords:
-        points.append([x, y])
-    for x, y in geom_n.coords:
-        points.append([x, y])
-    for x, y in geom_e.coords:
-        points.append([x, y])
-    for x, y in geom_s.coords:
-        points.append([x, y])
-    return Polygon(points)
+    min_x, min_y, max_x, max_y = geodesic_circle_bounds(longitude_centre, latitude_centre,
+                                                        size_m/2.0)[0]
+    options = {'segments': 100,
+               'max_deviation_m': max_deviation_m,
+               'max_segment_m': max_segment_m}
+    points = np.concatenate((
+        _great_circle_coords(min_x, min_y, min_x, max_y, **options),
+        _great_circle_coords(min_x, max_y, max_x, max_y, **options),
+        _great_circle_coords(max_x, max_y, max_x, min_y, **options),
+        _great_circle_coords(max_x, min_y, min_x, min_y, **options)
+    ))
+    return _square_polygon(points, min_x > max_x, split_antimeridian)
 
 
+@instrumented
 def get_size_of_degree_at(latitude=0.0):
     """
     Returns the size of a degree at a given latitude (these values don't vary by longitude)
@@ -313,3 +1406,53 @@ def get_size_of_degree_at(latitude=0.0):
         great_circle_distance(0.0, latitude, 1.0, latitude),
         great_circle_distance(0.0, latitude, 0.0, latitude+1)
     )
+
+
+_DEGREE_TABLE_STEP = 0.01
+_degree_table = None
+
+
+def _get_degree_table():
+    """
+    Sizes of a degree every 0.01 degrees of latitude, worked out
+    (once) exactly as get_size_of_degree_at does
+    :return: (latitudes, longitude sizes, latitude sizes)
+    """
+    global _degree_table
+    if _degree_table is None:
+        lats = np.linspace(-90.0, 90.0, int(round(180.0 / _DEGREE_TABLE_STEP)) + 1)
+        zeros = np.zeros_like(lats)
+        _degree_table = (
+            lats,
+            great_circle_distances(zeros, lats, zeros + 1.0, lats),
+            great_circle_distances(zeros, lats, zeros, lats + 1.0)
+        )
+    return _degree_table
+
+
+@instrumented
+def get_sizes_of_degree_at(latitudes):
+    """
+    Array version of get_size_of_degree_at, interpolated from a table
+    built on first use. Results are within 1mm of get_size_of_degree_at
+    (linear interpolation every 0.01 degrees; the sizes change by at most
+    ~34m per square degree, so the error is below 34 * 0.01^2 / 8 m).
+    :param latitudes: array of latitudes
+    :return: (array of size degree longitude in m, array of size degree
+    latitude in m), NaN where abs(latitude) >= 90
+    """
+    lats = np.asarray(latitudes, dtype=np.float64)
+    _, lon_sizes, lat_sizes = _get_degree_table()
+    invalid = ~(np.abs(lats) < 90.0)
+    # the table is evenly spaced, so look up the rows directly
+    position = (np.where(invalid, 0.0, lats) + 90.0) / _DEGREE_TABLE_STEP
+    row = np.minimum(position.astype(np.int64), len(lon_sizes) - 2)
+    fraction = position - row
+    # exactly on a row, take it as is: the next row may be NaN, e.g. the
+    # latitude size above 89 degrees, where a degree north passes the pole
+    on_row = fraction == 0.0
+    size_lon = np.where(on_row, lon_sizes[row],
+                        lon_sizes[row] + fraction * (lon_sizes[row + 1] - lon_sizes[row]))
+    size_lat = np.where(on_row, lat_sizes[row],
+                        lat_sizes[row] + fraction * (lat_sizes[row + 1] - lat_sizes[row]))
+    return np.where(invalid, np.nan, size_lon), np.where(invalid, np.nan, size_lat)
@@ -0,0 +1,239 @@
+"""
+Opt-in instrumentation of geodesics.py and cartesian.py, for finding out
+where the time goes in a slow render job.
+
+    with recording() as stats:
+        get_tissot_indicatrix()
+    print(stats.report())
+
+While recording, every call to a public function records its wall time
+(inclusive of any functions it calls) and the vertices and shapely
+geometries it returned. Calls to pyproj Geod and Transformer methods, and
+the number of points passed to them, are counted at the source, as are the
+pyproj objects built by registry.py.
+
+When nothing is recording, the only overhead is checking one global per
+function call.
+"""
+
+import functools
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+from lazy import LazyGeometry
+
+# Stats objects currently recording; empty when instrumentation is off
+_active = ()
+_lock = threading.Lock()
+
+_COUNTED_METHODS = frozenset((
+    'fwd', 'inv', 'npts', 'line_length', 'polygon_area_perimeter',
+    'geometry_area_perimeter', 'transform', 'itransform'
+))
+
+
+class Stats(object):
+    """
+    Numbers recorded by one recording() block
+    """
+
+    def __init__(self):
+        self.functions = {}
+        self.counters = {}
+        self.seconds = 0.0
+        self._started = time.perf_counter()
+
+    def add_call(self, name, seconds, vertices, geometries):
+        """
+        Record one call of an instrumented function
+        :param name: module.function
+        :param seconds: wall time of the call
+        :param vertices: vertices in the result
+        :param geometries: shapely geometries in the result
+        :return: n/a
+        """
+        with _lock:
+            try:
+                entry = self.functions[name]
+            except KeyError:
+                entry = self.functions[name] = {
+                    'calls': 0, 'seconds': 0.0, 'vertices': 0, 'geometries': 0
+                }
+            entry['calls'] += 1
+            entry['seconds'] += seconds
+            entry['vertices'] += vertices
+            entry['geometries'] += geometries
+
+    def add(self, name, amount=1):
+        """
+        Add to a counter
+        :param name: counter name, e.g. 'geod.fwd'
+        :param amount: amount to add
+        :return: n/a
+        """
+        with _lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def as_dict(self):
+        """
+        :return: dict of seconds, functions and counters, ready for json
+        """
+        with _lock:
+            return {
+                'seconds': self.seconds,
+                'functions': {name: dict(entry) for name, entry in self.functions.items()},
+                'counters': dict(self.counters)
+            }
+
+    def report(self):
+        """
+        :return: text table of the functions (slowest first) and counters
+        """
+        stats = self.as_dict()
+        lines = ["{:<50} {:>8} {:>10} {:>12} {:>10}".format(
+            'function', 'calls', 'seconds', 'vertices', 'geometries')]
+        for name, entry in sorted(stats['functions'].items(),
+                                  key=lambda item: -item[1]['seconds']):
+            lines.append("{:<50} {:>8} {:>10.4f} {:>12} {:>10}".format(
+                name, entry['calls'], entry['seconds'],
+                entry['vertices'], entry['geometries']))
+        lines.append("")
+        for name, value in sorted(stats['counters'].items()):
+            lines.append("{:<50} {:>8}".format(name, value))
+        lines.append("total {:.4f}s".format(stats['seconds']))
+        return "\n".join(lines)
+
+
+@contextmanager
+def recording():
+    """
+    Record instrumentation for the duration of a with block. Recording is
+    process wide, so calls made by other threads are included; blocks can
+    be nested, and each sees everything that happens inside it.
+    :return: Stats, filled in as the block runs
+    """
+    global _active
+    stats = Stats()
+    with _lock:
+        _active = _active + (stats,)
+    try:
+        yield stats
+    finally:
+        stats.seconds = time.perf_counter() - stats._started
+        with _lock:
+            _active = tuple(active for active in _active if active is not stats)
+
+
+def is_recording():
+    """
+    :return: True if any recording() block is active
+    """
+    return bool(_active)
+
+
+def count(name, amount=1):
+    """
+    Add to a counter in every active recording, if there are any
+    :param name: counter name
+    :param amount: amount to add
+    :return: n/a
+    """
+    for stats in _active:
+        stats.add(name, amount)
+
+
+def _coordinate_count(geometry):
+    if geometry.is_empty:
+        return 0
+    if hasattr(geometry, 'geoms'):
+        return sum(_coordinate_count(part) for part in geometry.geoms)
+    if hasattr(geometry, 'exterior'):
+        return len(geometry.exterior.coords) + \
+            sum(len(ring.coords) for ring in geometry.interiors)
+    return len(geometry.coords)
+
+
+def _measure(result):
+    """
+    :return: (vertices, shapely geometries) in a function's result
+    """
+    if isinstance(result, np.ndarray):
+        # only packed (N, M, 2) coordinate arrays hold vertices
+        if result.ndim == 3 and result.shape[-1] == 2 and result.dtype.kind == 'f':
+            return result.shape[0] * result.shape[1], 0
+        return 0, 0
+    if isinstance(result, list):
+        vertices = geometries = 0
+        for item in result:
+            item_vertices, item_geometries = _measure(item)
+            vertices += item_vertices
+            geometries += item_geometries
+        return vertices, geometries
+    if isinstance(result, LazyGeometry):
+        # no shapely geometry has been built
+        return len(result), 0
+    if hasattr(result, 'geom_type'):
+        return _coordinate_count(result), 1
+    return 0, 0
+
+
+def instrumented(function):
+    """
+    Decorator recording the calls of a function while recording() is active
+    """
+    name = "{}.{}".format(function.__module__, function.__name__)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not _active:
+            return function(*args, **kwargs)
+        started = time.perf_counter()
+        result = function(*args, **kwargs)
+        seconds = time.perf_counter() - started
+        vertices, geometries = _measure(result)
+        for stats in _active:
+            stats.add_call(name, seconds, vertices, geometries)
+        return result
+    return wrapper
+
+
+class _Counted(object):
+    """
+    Stands in for a pyproj Geod or Transformer, counting method calls
+    and the points passed to them
+    """
+
+    def __init__(self, target, kind):
+        self._target = target
+        self._kind = kind
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if name not in _COUNTED_METHODS:
+            return value
+        key = "{}.{}".format(self._kind, name)
+
+        def call(*args, **kwargs):
+            if name == 'npts':
+                points = kwargs.get('npts', args[4] if len(args) > 4 else 0)
+            elif args:
+                points = np.size(args[0])
+            else:
+                points = np.size(next(iter(kwargs.values()), ()))
+            count(key)
+            count(key + '.points', int(points))
+            return value(*args, **kwargs)
+        return call
+
+
+def counted(target, kind):
+    """
+    While recording, wrap a pyproj object so its calls are counted
+    :param target: pyproj Geod or Transformer
+    :param kind: counter prefix, e.g. 'geod' or 'transformer'
+    :return: target, or a counting wrapper around it while recording
+    """
+    if not _active:
+        return target
+    return _Counted(target, kind)
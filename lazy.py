@@ -0,0 +1,127 @@
+"""
+Lazy geometries: a coordinate array plus the shapely type to make from it.
+
+Pass lazy(LineString), lazy(Polygon) etc. as the geom_type of any function
+in geodesics.py which takes one, e.g.
+
+    routes = great_circles(lon1, lat1, lon2, lat2, 100, lazy(LineString))
+
+and each result holds a view onto the generated coordinates. Nothing is
+copied and no shapely geometry is built unless it is asked for; bounds,
+GeoJSON and packed files come straight from the array.
+"""
+
+import numpy as np
+from shapely.geometry import LineString, Polygon, MultiPoint
+
+KINDS = (LineString, Polygon, MultiPoint)
+
+
+class LazyGeometry(object):
+    """
+    Coordinates whose shapely geometry is only built on demand. Anything
+    not defined here (wkt, area, exterior, ...) is looked up on the built
+    geometry, so it can mostly be used in place of one.
+    """
+
+    __slots__ = ('coords', 'kind', '_geometry')
+
+    def __init__(self, coords, kind):
+        """
+        :param coords: (M, 2) array of lon/lat; used as is, not copied
+        :param kind: shapely type to build, e.g. LineString, Polygon
+        or MultiPoint
+        """
+        self.coords = coords
+        self.kind = kind
+        self._geometry = None
+
+    @property
+    def geometry(self):
+        """
+        :return: shapely geometry, built on first use
+        """
+        if self._geometry is None:
+            self._geometry = self.kind(self.coords)
+        return self._geometry
+
+    @property
+    def geom_type(self):
+        return self.kind.__name__
+
+    @property
+    def is_empty(self):
+        return len(self.coords) == 0
+
+    @property
+    def bounds(self):
+        """
+        :return: (min x, min y, max x, max y), as shapely gives
+        """
+        if self.is_empty:
+            return ()
+        min_x, min_y = np.min(self.coords, axis=0)
+        max_x, max_y = np.max(self.coords, axis=0)
+        return float(min_x), float(min_y), float(max_x), float(max_y)
+
+    def ring(self):
+        """
+        :return: coordinates with the first repeated at the end, if they
+        aren't already, as the exterior of a Polygon has
+        """
+        coords = np.asarray(self.coords)
+        if len(coords) and not (coords[0] == coords[-1]).all():
+            coords = np.concatenate((coords, coords[:1]))
+        return coords
+
+    def to_geojson(self, precision=None):
+        """
+        GeoJSON geometry made directly from the coordinates
+        :param precision: decimal places to keep, or None for all
+        :return: dict
+        """
+        coords = self.ring() if self.kind is Polygon else np.asarray(self.coords, dtype=np.float64)
+        if precision is not None:
+            coords = np.round(coords, precision)
+        coords = coords.tolist()
+        if self.kind is Polygon:
+            coords = [coords] if coords else []
+        return {'type': self.geom_type, 'coordinates': coords}
+
+    @property
+    def __geo_interface__(self):
+        return self.to_geojson()
+
+    def __len__(self):
+        return len(self.coords)
+
+    def __getattr__(self, name):
+        # only reached for names not found normally; private and slot names
+        # must not go to the geometry, or copy and pickle, which look them up
+        # before __init__ has run, would recurse forever
+        if name.startswith('_') or name in LazyGeometry.__slots__:
+            raise AttributeError(name)
+        return getattr(self.geometry, name)
+
+    def __reduce__(self):
+        return LazyGeometry, (self.coords, self.kind)
+
+    def __repr__(self):
+        return "<LazyGeometry {} of {} vertices>".format(self.geom_type, len(self))
+
+
+class lazy(object):
+    """
+    geom_type which makes LazyGeometry results of another type
+    """
+
+    def __init__(self, kind):
+        """
+        :param kind: shapely type made on demand, e.g. LineString
+        """
+        if kind not in KINDS:
+            raise ValueError("can't make {} lazily".format(kind.__name__))
+        self.kind = kind
+
+    def __call__(self, coords):
+        return LazyGeometry(coords, self.kind)
@@ -0,0 +1,300 @@
+"""
+Binary geometry files, much quicker to write and reload than WKT or geojson.
+
+Two formats are supported:
+
+- WKB batches: each geometry is written as a uint32 (little-endian) byte
+  count followed by its WKB. Read back as a stream.
+- packed files: all coordinates in one float64 array, with offset arrays
+  giving where each geometry, part and ring starts, much like GeoArrow.
+  These can be memory-mapped, so single geometries or their coordinates
+  can be sliced out without reading the whole file.
+
+Packed file layout (little-endian, each section padded to 8 bytes):
+
+    header      magic, version, dimensions, then int64 counts of
+                geometries, parts, rings and coordinates
+    kinds       uint8 per geometry, WKB geometry type code
+    geom_offsets    int64 per geometry + 1, index into parts
+    part_offsets    int64 per part + 1, index into rings
+    ring_offsets    int64 per ring + 1, index into coordinates
+    coords      float64 (coordinates, 2)
+
+A part is a polygon or a line, a ring is a run of coordinates. A Point or
+LineString has one part with one ring, a Polygon one part with a ring per
+boundary, a MultiPoint one part with one ring holding all its points.
+"""
+
+import struct
+import numpy as np
+from shapely import wkb
+from shapely.geometry import Point, LineString, Polygon
+from shapely.geometry import MultiPoint, MultiLineString, MultiPolygon
+from lazy import LazyGeometry
+
+MAGIC = b'KAYPACK\x00'
+VERSION = 1
+_HEADER = struct.Struct('<8sII4q')
+_LENGTH = struct.Struct('<I')
+
+POINT = 1
+LINESTRING = 2
+POLYGON = 3
+MULTIPOINT = 4
+MULTILINESTRING = 5
+MULTIPOLYGON = 6
+
+_KINDS = {
+    'Point': POINT,
+    'LineString': LINESTRING,
+    'LinearRing': LINESTRING,
+    'Polygon': POLYGON,
+    'MultiPoint': MULTIPOINT,
+    'MultiLineString': MULTILINESTRING,
+    'MultiPolygon': MULTIPOLYGON
+}
+
+
+def write_wkb(geometries, file_name):
+    """
+    Write geometries as a batch of length-prefixed WKB records
+    :param geometries: iterable of shapely geometries (or LazyGeometry)
+    :param file_name: path, or an open binary file
+    :return: number of geometries written
+    """
+    if hasattr(file_name, 'write'):
+        return _write_wkb(geometries, file_name)
+    with open(file_name, "wb") as fo:
+        return _write_wkb(geometries, fo)
+
+
+def _lazy_wkb(geometry):
+    """
+    Little-endian WKB of a LazyGeometry, without building the geometry
+    """
+    kind = _KINDS[geometry.geom_type]
+    coords = np.ascontiguousarray(geometry.coords, dtype='<f8').reshape(-1, 2)
+    if kind == LINESTRING:
+        return struct.pack('<BII', 1, kind, len(coords)) + coords.tobytes()
+    if kind == POLYGON:
+        if not len(coords):
+            return struct.pack('<BII', 1, kind, 0)
+        ring = np.ascontiguousarray(geometry.ring(), dtype='<f8')
+        return struct.pack('<BIII', 1, kind, 1, len(ring)) + ring.tobytes()
+    # MultiPoint, each point a WKB Point of its own
+    points = np.empty(len(coords), dtype=[('order', 'u1'), ('kind', '<u4'), ('xy', '<f8', 2)])
+    points['order'] = 1
+    points['kind'] = POINT
+    points['xy'] = coords
+    return struct.pack('<BII', 1, kind, len(coords)) + points.tobytes()
+
+
+def _write_wkb(geometries, fo):
+    count = 0
+    for geometry in geometries:
+        if isinstance(geometry, LazyGeometry):
+            data = _lazy_wkb(geometry)
+        else:
+            data = wkb.dumps(geometry)
+        fo.write(_LENGTH.pack(len(data)))
+        fo.write(data)
+        count += 1
+    return count
+
+
+def read_wkb(file_name):
+    """
+    Generator over the geometries in a WKB batch file
+    :param file_name: path
+    :return: shapely geometries, one at a time
+    """
+    with open(file_name, "rb") as fi:
+        while True:
+            prefix = fi.read(_LENGTH.size)
+            if not prefix:
+                break
+            length, = _LENGTH.unpack(prefix)
+            yield wkb.loads(fi.read(length))
+
+
+def _rings(geometry):
+    """
+    :return: (kind, list of parts, each a list of (M, 2) ring arrays)
+    """
+    if isinstance(geometry, LazyGeometry):
+        # straight from the coordinates, without building the geometry
+        kind = _KINDS[geometry.geom_type]
+        if geometry.is_empty:
+            return kind, []
+        if kind == POLYGON:
+            return kind, [[geometry.ring()]]
+        return kind, [[np.asarray(geometry.coords)]]
+    try:
+        kind = _KINDS[geometry.geom_type]
+    except KeyError:
+        raise ValueError("can't pack {}".format(geometry.geom_type))
+    if geometry.is_empty:
+        return kind, []
+    if kind in (POINT, LINESTRING):
+        return kind, [[np.asarray(geometry.coords)[:, :2]]]
+    if kind == MULTIPOINT:
+        return kind, [[np.array([point.coords[0][:2] for point in geometry.geoms])]]
+    if kind == POLYGON:
+        return kind, [_polygon_rings(geometry)]
+    if kind == MULTILINESTRING:
+        return kind, [[np.asarray(line.coords)[:, :2]] for line in geometry.geoms]
+    return kind, [_polygon_rings(polygon) for polygon in geometry.geoms]
+
+
+def _polygon_rings(polygon):
+    return [np.asarray(ring.coords)[:, :2]
+            for ring in [polygon.exterior] + list(polygon.interiors)]
+
+
+def _padded(data):
+    return data + b'\x00' * (-len(data) % 8)
+
+
+def write_packed(geometries, file_name, kind=LINESTRING):
+    """
+    Write geometries to a packed file.
+    A packed (N, M, 2) coordinate array, as returned by great_circles or
+    geodesic_point_buffers, is written directly without building any
+    shapely geometries.
+    :param geometries: iterable of shapely geometries (or LazyGeometry),
+    or (N, M, 2) array
+    :param file_name: path
+    :param kind: geometry type code used for each row of an array,
+    e.g. LINESTRING, POLYGON or MULTIPOINT
+    :return: number of geometries written
+    """
+    if isinstance(geometries, np.ndarray):
+        coords = np.ascontiguousarray(geometries, dtype=np.float64)
+        count, size = coords.shape[0], coords.shape[1]
+        kinds = np.full(count, kind, dtype=np.uint8)
+        if kind == POLYGON:
+            # rings are closed, as shapely would do
+            coords = np.concatenate((coords, coords[:, :1]), axis=1)
+            size += 1
+        geom_offsets = np.arange(count + 1, dtype=np.int64)
+        part_offsets = geom_offsets
+        ring_offsets = geom_offsets * size
+        coords = coords.reshape(-1, 2)
+    else:
+        kinds = []
+        geom_offsets = [0]
+        part_offsets = [0]
+        ring_offsets = [0]
+        chunks = []
+        for geometry in geometries:
+            geom_kind, parts = _rings(geometry)
+            kinds.append(geom_kind)
+            for rings in parts:
+                for ring in rings:
+                    chunks.append(ring)
+                    ring_offsets.append(ring_offsets[-1] + len(ring))
+                part_offsets.append(len(ring_offsets) - 1)
+            geom_offsets.append(len(part_offsets) - 1)
+        kinds = np.array(kinds, dtype=np.uint8)
+        geom_offsets = np.array(geom_offsets, dtype=np.int64)
+        part_offsets = np.array(part_offsets, dtype=np.int64)
+        ring_offsets = np.array(ring_offsets, dtype=np.int64)
+        if chunks:
+            coords = np.concatenate(chunks).astype(np.float64)
+        else:
+            coords = np.empty((0, 2), dtype=np.float64)
+    with open(file_name, "wb") as fo:
+        fo.write(_HEADER.pack(MAGIC, VERSION, 2,
+                              len(kinds), len(part_offsets) - 1,
+                              len(ring_offsets) - 1, len(coords)))
+        fo.write(_padded(kinds.tobytes()))
+        for offsets in (geom_offsets, part_offsets, ring_offsets):
+            fo.write(offsets.astype('<i8').tobytes())
+        fo.write(np.ascontiguousarray(coords, dtype='<f8').tobytes())
+    return len(kinds)
+
+
+class PackedGeometries(object):
+    """
+    Memory-mapped view of a packed file. Indexing returns shapely
+    geometries; coords() returns zero-copy coordinate slices.
+    """
+
+    def __init__(self, file_name):
+        """
+        :param file_name: path of a file written by write_packed
+        """
+        raw = np.memmap(file_name, dtype=np.uint8, mode='r')
+        try:
+            header = _HEADER.unpack(raw[:_HEADER.size].tobytes())
+        except struct.error:
+            raise ValueError("{} is not a packed geometry file".format(file_name))
+        magic, version, dims, n_geoms, n_parts, n_rings, n_coords = header
+        if magic != MAGIC or version != VERSION or dims != 2:
+            raise ValueError("{} is not a packed geometry file".format(file_name))
+        sections = []
+        offset = _HEADER.size
+        for dtype, shape in (('<u1', (n_geoms,)),
+                             ('<i8', (n_geoms + 1,)),
+                             ('<i8', (n_parts + 1,)),
+                             ('<i8', (n_rings + 1,)),
+                             ('<f8', (n_coords, 2))):
+            size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            sections.append(raw[offset:offset + size].view(dtype).reshape(shape))
+            offset += size + (-size % 8)
+        self.kinds, self.geom_offsets, self.part_offsets, \
+            self.ring_offsets, self.coordinates = sections
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __iter__(self):
+        for i in range(0, len(self)):
+            yield self[i]
+
+    def coords(self, index):
+        """
+        All coordinates of one geometry, as a read-only view onto the file
+        :param index: geometry number
+        :return: (M, 2) array
+        """
+        start = self.ring_offsets[self.part_offsets[self.geom_offsets[index]]]
+        end = self.ring_offsets[self.part_offsets[self.geom_offsets[index + 1]]]
+        return self.coordinates[start:end]
+
+    def _parts(self, index):
+        parts = []
+        for part in range(self.geom_offsets[index], self.geom_offsets[index + 1]):
+            rings = []
+            for ring in range(self.part_offsets[part], self.part_offsets[part + 1]):
+                rings.append(self.coordinates[self.ring_offsets[ring]:self.ring_offsets[ring + 1]])
+            parts.append(rings)
+        return parts
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        kind = self.kinds[index]
+        parts = self._parts(index)
+        if kind == POINT:
+            return Point(parts[0][0][0]) if parts else Point()
+        if kind == LINESTRING:
+            return LineString(parts[0][0]) if parts else LineString()
+        if kind == POLYGON:
+            return Polygon(parts[0][0], parts[0][1:]) if parts else Polygon()
+        if kind == MULTIPOINT:
+            return MultiPoint(parts[0][0]) if parts else MultiPoint()
+        if kind == MULTILINESTRING:
+            return MultiLineString([rings[0] for rings in parts])
+        return MultiPolygon([(rings[0], rings[1:]) for rings in parts])
+
+
+def read_packed(file_name):
+    """
+    Open a packed file, memory-mapped
+    :param file_name: path
+    :return: PackedGeometries
+    """
+    return PackedGeometries(file_name)
@@ -0,0 +1,224 @@
+"""
+Shared cache of pyproj objects.
+Parsing ellipsoid and CRS definitions is slow compared to the
+calculations themselves, so Geod, Proj and Transformer objects are
+built once and reused, keyed on the ellipsoid name or proj4 string.
+Each cache is bounded, evicting the least recently used entry.
+Geod objects are shared by all threads. Proj and Transformer objects hold
+a PROJ context which must not be used from two threads at once, so each
+thread gets its own cache of them.
+"""
+
+import threading
+import weakref
+from collections import OrderedDict
+from pyproj import Geod, Proj, Transformer
+from instrumentation import count, counted
+
+WGS84 = "EPSG:4326"
+
+
+class LRURegistry(object):
+    """
+    Bounded, thread-safe cache of objects created by a factory function
+    """
+
+    def __init__(self, factory, maxsize=128):
+        """
+        :param factory: called with the key arguments to build a missing entry
+        :param maxsize: maximum number of entries kept
+        """
+        self.factory = factory
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, *key):
+        """
+        Return the cached object for key, building it if needed
+        :param key: arguments passed to the factory
+        :return: cached object
+        """
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                pass
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+        # build outside the lock; CRS parsing can be slow
+        value = self.factory(*key)
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        """
+        Drop all entries and reset the statistics
+        :return: n/a
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self):
+        """
+        :return: dict of hits, misses, evictions, size and maxsize
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'maxsize': self.maxsize
+            }
+
+
+class ThreadLocalRegistry(object):
+    """
+    One LRURegistry per thread, for objects which must not be shared
+    between threads
+    """
+
+    def __init__(self, factory, maxsize=128):
+        """
+        :param factory: called with the key arguments to build a missing entry
+        :param maxsize: maximum number of entries kept by each thread
+        """
+        self.factory = factory
+        self.maxsize = maxsize
+        self._local = threading.local()
+        # registries of live threads, for stats and clear
+        self._registries = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def _registry(self):
+        try:
+            return self._local.registry
+        except AttributeError:
+            registry = LRURegistry(self.factory, self.maxsize)
+            self._local.registry = registry
+            with self._lock:
+                self._registries.add(registry)
+            return registry
+
+    def get(self, *key):
+        """
+        Return the calling thread's cached object for key, building it if needed
+        :param key: arguments passed to the factory
+        :return: cached object
+        """
+        return self._registry().get(*key)
+
+    def clear(self):
+        """
+        Drop all entries of every thread and reset the statistics
+        :return: n/a
+        """
+        with self._lock:
+            registries = list(self._registries)
+        for registry in registries:
+            registry.clear()
+
+    def stats(self):
+        """
+        :return: dict of hits, misses, evictions and size summed over all
+        threads, the maxsize of each and the number of threads
+        """
+        with self._lock:
+            registries = list(self._registries)
+        totals = {'hits': 0, 'misses': 0, 'evictions': 0, 'size': 0}
+        for registry in registries:
+            for name, value in registry.stats().items():
+                if name in totals:
+                    totals[name] += value
+        totals['maxsize'] = self.maxsize
+        totals['threads'] = len(registries)
+        return totals
+
+
+def _make_geod(ellipsoid):
+    count('built.Geod')
+    return Geod(ellps=ellipsoid)
+
+
+def _make_proj(proj4_string):
+    count('built.Proj')
+    return Proj(proj4_string)
+
+
+def _make_transformer(proj4_from, proj4_to):
+    count('built.Transformer')
+    return Transformer.from_proj(get_proj(proj4_from), get_proj(proj4_to),
+                                 always_xy=True)
+
+
+_geods = LRURegistry(_make_geod, maxsize=16)
+_projs = ThreadLocalRegistry(_make_proj, maxsize=256)
+_transformers = ThreadLocalRegistry(_make_transformer, maxsize=256)
+
+
+def get_geod(ellipsoid='WGS84'):
+    """
+    Shared Geod for an ellipsoid
+    :param ellipsoid: pyproj ellipsoid name, e.g. 'WGS84' or 'sphere'
+    :return: pyproj.Geod
+    """
+    return counted(_geods.get(ellipsoid), 'geod')
+
+
+def get_proj(proj4_string):
+    """
+    Proj for a proj4 definition, shared within the calling thread;
+    don't hand it to other threads
+    :param proj4_string: proj4 definition of coordinate system
+    :return: pyproj.Proj
+    """
+    return _projs.get(proj4_string)
+
+
+def get_transformer(proj4_from, proj4_to=WGS84):
+    """
+    Transformer between two proj4 definitions, shared within the calling
+    thread; don't hand it to other threads. Coordinates are always given
+    and returned as x, y (i.e. lon, lat).
+    :param proj4_from: source proj4 definition
+    :param proj4_to: target proj4 definition, defaults to WGS84
+    :return: pyproj.Transformer
+    """
+    return counted(_transformers.get(proj4_from, proj4_to), 'transformer')
+
+
+def registry_stats():
+    """
+    Cache statistics, for checking hit rates
+    :return: dict of stats keyed on 'geod', 'proj' and 'transformer'
+    """
+    return {
+        'geod': _geods.stats(),
+        'proj': _projs.stats(),
+        'transformer': _transformers.stats()
+    }
+
+
+def clear_registry():
+    """
+    Empty all caches and reset their statistics
+    :return: n/a
+    """
+    _geods.clear()
+    _projs.clear()
+    _transformers.clear()
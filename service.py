@@ -0,0 +1,400 @@
+"""
+Local HTTP service for the batch jobs, using only the standard library.
+
+Concurrent requests for the same kind of job are coalesced: each waits a
+couple of milliseconds (or until enough have arrived) and they are then
+computed together as one vectorized batch, on a worker thread or across a
+pool of worker processes. Many small requests cost about the same as one
+large one.
+
+Endpoints take the fields listed in batch.py, as a query string or a JSON
+object (or list of objects) in a POST body, plus optional segments,
+tolerance and precision:
+
+    /distance   lon1, lat1, lon2, lat2      -> {"distance_m": ...}
+    /route      lon1, lat1, lon2, lat2      -> geojson LineString (great circle)
+    /buffer     lon, lat, radius_m          -> geojson Polygon
+    /extent     x1, y1, x2, y2, proj4       -> geojson LineString
+    /stats      latency and throughput of each endpoint
+
+e.g.
+    python service.py --port 8000 --workers 4
+    curl "http://localhost:8000/distance?lon1=-3.19&lat1=55.95&lon2=31.13&lat2=29.97"
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qsl
+import numpy as np
+from batch import FIELDS, compute, result_geojson
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed'}
+_LATENCIES_KEPT = 10000
+
+
+class RequestError(Exception):
+    """
+    A request which can't be answered, reported to the client as a 400
+    """
+    pass
+
+
+def _parse_row(job, params):
+    """
+    :param job: one of FIELDS
+    :param params: dict of request parameters
+    :return: (row dict, (segments, tolerance, precision))
+    """
+    row = {}
+    for field in FIELDS[job]:
+        if field not in params:
+            raise RequestError("missing {}".format(field))
+        if field == 'proj4':
+            row[field] = str(params[field])
+            continue
+        try:
+            row[field] = float(params[field])
+        except (TypeError, ValueError):
+            raise RequestError("{} is not a number".format(field))
+        if not math.isfinite(row[field]):
+            raise RequestError("{} is not a finite number".format(field))
+    try:
+        segments = int(params.get('segments', 100))
+        tolerance = params.get('tolerance')
+        tolerance = None if tolerance is None else float(tolerance)
+        precision = int(params.get('precision', 6))
+    except (TypeError, ValueError):
+        raise RequestError("bad segments, tolerance or precision")
+    if segments < 1:
+        raise RequestError("segments must be at least 1")
+    return row, (segments, tolerance, precision)
+
+
+def _respond(job, result, precision):
+    # NaN or infinity (e.g. from a latitude beyond 90) isn't valid JSON
+    if job == 'distance':
+        finite = math.isfinite(result)
+    elif job in ('route', 'buffer'):
+        finite = np.isfinite(result).all()
+    else:
+        finite = result.is_empty or np.isfinite(result.bounds).all()
+    if not finite:
+        raise ValueError("result is not finite, check the coordinates")
+    if job == 'distance':
+        return {'distance_m': float(result)}
+    return result_geojson(job, result, precision)
+
+
+def compute_rows(job, rows, options):
+    """
+    Compute a coalesced batch. Runs in a worker.
+    If the batch fails as a whole (e.g. one bad proj4 string), the rows are
+    retried one at a time so only the bad ones fail.
+    :param job: one of FIELDS
+    :param rows: list of row dicts
+    :param options: (segments, tolerance, precision)
+    :return: list of (True, JSON-ready response) or (False, error message)
+    """
+    segments, tolerance, precision = options
+    settings = {'segments': segments, 'tolerance': tolerance}
+    try:
+        return [(True, _respond(job, result, precision))
+                for result in compute(job, rows, settings)]
+    except Exception as error:
+        if len(rows) == 1:
+            return [(False, str(error))]
+    return [compute_rows(job, [row], options)[0] for row in rows]
+
+
+class EndpointStats(object):
+    """
+    Request counts and latencies of one endpoint
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+        self.batched_rows = 0
+        self.latencies = deque(maxlen=_LATENCIES_KEPT)
+
+    def as_dict(self, elapsed):
+        """
+        :param elapsed: seconds the service has been running
+        :return: dict of counts, mean batch size, throughput and latency
+        percentiles in milliseconds (over the most recent requests)
+        """
+        latencies = sorted(self.latencies)
+
+        def percentile(fraction):
+            if not latencies:
+                return 0.0
+            return 1000.0 * latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'batches': self.batches,
+            'mean_batch_size': self.batched_rows / self.batches if self.batches else 0.0,
+            'requests_per_second': self.requests / elapsed if elapsed > 0 else 0.0,
+            'latency_ms': {
+                'mean': 1000.0 * sum(latencies) / len(latencies) if latencies else 0.0,
+                'p50': percentile(0.5),
+                'p95': percentile(0.95),
+                'p99': percentile(0.99),
+                'max': 1000.0 * latencies[-1] if latencies else 0.0
+            }
+        }
+
+
+class Coalescer(object):
+    """
+    Gathers rows for the same job and options into batches, computed in
+    an executor
+    """
+
+    def __init__(self, executor, stats, max_batch=1000, max_delay=0.002):
+        """
+        :param executor: concurrent.futures executor batches run on
+        :param stats: dict of EndpointStats by job
+        :param max_batch: rows at which a batch is sent straight away
+        :param max_delay: seconds a batch waits for more rows
+        """
+        self.executor = executor
+        self.stats = stats
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._pending = {}
+
+    async def submit(self, job, rows, options):
+        """
+        Add rows to the current batch for job and options
+        :return: list of (ok, response), one per row
+        """
+        loop = asyncio.get_running_loop()
+        key = (job, options)
+        futures = []
+        for row in rows:
+            batch = self._pending.get(key)
+            if batch is None:
+                batch = self._pending[key] = []
+                loop.call_later(self.max_delay, self._flush, key, batch)
+            future = loop.create_future()
+            batch.append((row, future))
+            futures.append(future)
+            if len(batch) >= self.max_batch:
+                self._flush(key, batch)
+        return await asyncio.gather(*futures)
+
+    def _flush(self, key, batch):
+        # the timer of a batch already sent for being full does nothing
+        if self._pending.get(key) is not batch:
+            return
+        del self._pending[key]
+        job, options = key
+        stats = self.stats[job]
+        stats.batches += 1
+        stats.batched_rows += len(batch)
+        rows = [row for row, _ in batch]
+        task = asyncio.get_running_loop().run_in_executor(
+            self.executor, compute_rows, job, rows, options)
+
+        def done(task):
+            try:
+                results = task.result()
+            except Exception as error:
+                results = [(False, str(error))] * len(batch)
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        task.add_done_callback(done)
+
+
+class GeodesyService(object):
+    """
+    asyncio HTTP server for the batch jobs
+    """
+
+    def __init__(self, host='127.0.0.1', port=8000, workers=0,
+                 max_batch=1000, max_delay=0.002):
+        """
+        :param host: interface to listen on
+        :param port: port to listen on, 0 to pick a free one
+        :param workers: worker processes, 0 to compute on one thread
+        :param max_batch: see Coalescer
+        :param max_delay: see Coalescer
+        """
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.stats = {job: EndpointStats() for job in FIELDS}
+        self._server = None
+        self._connections = set()
+        self._executor = None
+        self._coalescer = None
+        self._started = None
+
+    async def start(self):
+        """
+        Start listening; self.port is the actual port afterwards
+        :return: n/a
+        """
+        if self.workers:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=1)
+        self._coalescer = Coalescer(self._executor, self.stats,
+                                    self.max_batch, self.max_delay)
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._started = time.time()
+
+    async def stop(self):
+        """
+        Stop listening and shut down the workers
+        :return: n/a
+        """
+        self._server.close()
+        await self._server.wait_closed()
+        # drop idle keep-alive connections
+        for task in list(self._connections):
+            task.cancel()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        self._executor.shutdown(wait=True)
+
+    def stats_dict(self):
+        """
+        :return: dict of EndpointStats.as_dict() by endpoint
+        """
+        elapsed = time.time() - self._started
+        return {
+            'uptime_s': elapsed,
+            'endpoints': {job: stats.as_dict(elapsed) for job, stats in self.stats.items()}
+        }
+
+    async def _handle(self, reader, writer):
+        """
+        Serve requests on one connection until the client closes it
+        """
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = b''
+                length = int(headers.get('content-length', 0))
+                if length:
+                    body = await reader.readexactly(length)
+                status, response = await self._dispatch(request_line.decode('latin-1'), body)
+                data = json.dumps(response, separators=(',', ':'),
+                                  allow_nan=False).encode('utf-8')
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                writer.write("HTTP/1.1 {} {}\r\nContent-Type: application/json\r\n"
+                             "Content-Length: {}\r\nConnection: {}\r\n\r\n".format(
+                                 status, _REASONS[status], len(data),
+                                 'keep-alive' if keep_alive else 'close').encode('latin-1'))
+                writer.write(data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        except asyncio.CancelledError:
+            # the service is stopping
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    async def _dispatch(self, request_line, body):
+        """
+        :return: (HTTP status, JSON-ready response)
+        """
+        try:
+            method, target, _ = request_line.split(' ', 2)
+        except ValueError:
+            return 400, {'error': "bad request line"}
+        url = urlsplit(target)
+        job = url.path.strip('/')
+        if job == 'stats':
+            return 200, self.stats_dict()
+        if job not in FIELDS:
+            return 404, {'error': "unknown endpoint {}".format(url.path)}
+        if method not in ('GET', 'POST'):
+            return 405, {'error': "use GET or POST"}
+        started = time.perf_counter()
+        stats = self.stats[job]
+        stats.requests += 1
+        try:
+            if method == 'POST':
+                try:
+                    params = json.loads(body.decode('utf-8'))
+                except ValueError:
+                    raise RequestError("body is not json")
+            else:
+                params = dict(parse_qsl(url.query))
+            many = isinstance(params, list)
+            parsed = [_parse_row(job, item) for item in (params if many else [params])]
+        except (RequestError, AttributeError, TypeError) as error:
+            stats.errors += 1
+            return 400, {'error': str(error) or "bad parameters"}
+        if not parsed:
+            return 200, []
+        options = parsed[0][1]
+        if any(item_options != options for _, item_options in parsed):
+            stats.errors += 1
+            return 400, {'error': "segments, tolerance and precision must match"}
+        results = await self._coalescer.submit(job, [row for row, _ in parsed], options)
+        stats.latencies.append(time.perf_counter() - started)
+        if not all(ok for ok, _ in results):
+            stats.errors += 1
+            return 400, {'error': next(value for ok, value in results if not ok)}
+        responses = [value for _, value in results]
+        return 200, responses if many else responses[0]
+
+
+async def _serve(service):
+    await service.start()
+    print("listening on http://{}:{}".format(service.host, service.port))
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await service.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local geodesy HTTP service")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=0,
+                        help="worker processes, 0 to compute on one thread")
+    parser.add_argument('--max-batch', type=int, default=1000,
+                        help="rows at which a batch is sent straight away")
+    parser.add_argument('--max-delay', type=float, default=0.002,
+                        help="seconds a batch waits for more rows")
+    args = parser.parse_args(argv)
+    service = GeodesyService(args.host, args.port, args.workers,
+                             args.max_batch, args.max_delay)
+    try:
+        asyncio.run(_serve(service))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+Spatial index over lon/lat points for "everything within X meters" and
+nearest neighbour queries, without building buffer polygons.
+
+Points are bucketed into a lon/lat grid. A query visits only the grid
+cells that could hold a match, drops candidates with a quick spherical
+(unit vector) test, and then works out exact WGS84 geodesic distances for
+the few that remain.
+"""
+
+import math
+import numpy as np
+from registry import get_geod
+
+# lower bounds on the length of a degree, in meters, on WGS84. A degree of
+# latitude is never shorter than at the equator, and a degree of longitude
+# never shorter than this times cos(latitude)
+_MIN_DEGREE_M = 110574.0
+# smallest radius of curvature on WGS84, a(1 - e^2); any geodesic is at
+# least this times the angle between the (geodetic) unit vectors of its ends
+_MIN_RADIUS_M = 6335439.0
+_SLACK = 1.001
+_HALF_CIRCUMFERENCE_M = 20003931.5
+
+
+def _unit_vectors(longitudes, latitudes):
+    lon = np.radians(longitudes)
+    lat = np.radians(latitudes)
+    cos_lat = np.cos(lat)
+    return np.column_stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)))
+
+
+class PointIndex(object):
+    """
+    Grid index over a set of WGS84 points.
+    """
+
+    def __init__(self, longitudes, latitudes, cell_degrees=1.0):
+        """
+        :param longitudes: array of point longitudes, degrees [-180,180]
+        :param latitudes: array of point latitudes, degrees [-90,90]
+        :param cell_degrees: size of the grid cells; smaller cells suit
+        dense points and small radii
+        """
+        lons = np.atleast_1d(np.asarray(longitudes, dtype=np.float64))
+        lats = np.atleast_1d(np.asarray(latitudes, dtype=np.float64))
+        self.cell_degrees = float(cell_degrees)
+        self.rows = int(math.ceil(180.0 / self.cell_degrees))
+        self.cols = int(math.ceil(360.0 / self.cell_degrees))
+        cells = self._rows_of(lats) * self.cols + self._cols_of(lons)
+        # points sorted by cell, so every run of cells in a grid row
+        # is one contiguous slice
+        self.order = np.argsort(cells, kind='stable')
+        self.longitudes = lons[self.order]
+        self.latitudes = lats[self.order]
+        self.vectors = _unit_vectors(self.longitudes, self.latitudes)
+        self.starts = np.searchsorted(cells[self.order],
+                                      np.arange(self.rows * self.cols + 1))
+
+    def __len__(self):
+        return len(self.order)
+
+    def _rows_of(self, latitudes):
+        rows = np.floor((np.asarray(latitudes) + 90.0) / self.cell_degrees).astype(np.int64)
+        return np.clip(rows, 0, self.rows - 1)
+
+    def _cols_of(self, longitudes):
+        lons = (np.asarray(longitudes) + 180.0) % 360.0
+        cols = np.floor(lons / self.cell_degrees).astype(np.int64)
+        return np.clip(cols, 0, self.cols - 1)
+
+    def _candidates(self, longitude, latitude, radius_m):
+        """
+        Positions (in sorted order) of the points in grid cells which
+        could be within radius_m
+        """
+        if radius_m >= _HALF_CIRCUMFERENCE_M:
+            return np.arange(len(self))
+        dlat = _SLACK * radius_m / _MIN_DEGREE_M
+        row_0 = int(self._rows_of(latitude - dlat))
+        row_1 = int(self._rows_of(latitude + dlat))
+        max_lat = abs(latitude) + dlat + self.cell_degrees
+        col_ranges = [(0, self.cols - 1)]
+        if max_lat < 90.0:
+            dlon = dlat / math.cos(math.radians(max_lat))
+            if dlon < 180.0 - self.cell_degrees:
+                col_0 = int(self._cols_of(longitude - dlon))
+                col_1 = int(self._cols_of(longitude + dlon))
+                if col_0 <= col_1:
+                    col_ranges = [(col_0, col_1)]
+                else:
+                    # wraps across the antimeridian
+                    col_ranges = [(col_0, self.cols - 1), (0, col_1)]
+        slices = []
+        for row in range(row_0, row_1 + 1):
+            for col_0, col_1 in col_ranges:
+                start = self.starts[row * self.cols + col_0]
+                end = self.starts[row * self.cols + col_1 + 1]
+                if end > start:
+                    slices.append(np.arange(start, end))
+        if not slices:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(slices)
+
+    def _within(self, longitude, latitude, radius_m):
+        """
+        :return: (positions in sorted order, distances) of points within radius_m
+        """
+        candidates = self._candidates(longitude, latitude, radius_m)
+        if candidates.size:
+            # spherical test: the angle between unit vectors bounds the
+            # geodesic distance from below
+            query = _unit_vectors(longitude, latitude)[0]
+            cos_angle = self.vectors[candidates].dot(query)
+            max_angle = min(math.pi, _SLACK * radius_m / _MIN_RADIUS_M)
+            candidates = candidates[cos_angle >= math.cos(max_angle)]
+        if not candidates.size:
+            return candidates, np.empty(0, dtype=np.float64)
+        _, _, dist = get_geod('WGS84').inv(np.full(candidates.size, longitude),
+                                           np.full(candidates.size, latitude),
+                                           self.longitudes[candidates],
+                                           self.latitudes[candidates])
+        dist = np.asarray(dist, dtype=np.float64)
+        inside = dist <= radius_m
+        return candidates[inside], dist[inside]
+
+    def query_radius(self, longitudes, latitudes, radius_m, return_distance=False):
+        """
+        Find the points within a geodesic distance of each query point
+        :param longitudes: array of query longitudes
+        :param latitudes: array of query latitudes
+        :param radius_m: distance in meters, scalar or one per query
+        :param return_distance: also return the distances
+        :return: list with an array of point indices for each query, nearest
+        first (and a matching list of distance arrays if return_distance)
+        """
+        lons, lats, radii = np.broadcast_arrays(
+            np.atleast_1d(np.asarray(longitudes, dtype=np.float64)),
+            np.atleast_1d(np.asarray(latitudes, dtype=np.float64)),
+            np.atleast_1d(np.asarray(radius_m, dtype=np.float64)))
+        indices = []
+        distances = []
+        for lon, lat, radius in zip(lons, lats, radii):
+            found, dist = self._within(lon, lat, radius)
+            order = np.argsort(dist, kind='stable')
+            indices.append(self.order[found[order]])
+            distances.append(dist[order])
+        if return_distance:
+            return indices, distances
+        return indices
+
+    def query_nearest(self, longitudes, latitudes, k=1):
+        """
+        Find the k nearest points to each query point, by geodesic distance
+        :param longitudes: array of query longitudes
+        :param latitudes: array of query latitudes
+        :param k: number of neighbours
+        :return: ((Q, k) point indices, (Q, k) distances in meters), nearest
+        first; padded with -1 and inf if there are fewer than k points
+        """
+        lons, lats = np.broadcast_arrays(
+            np.atleast_1d(np.asarray(longitudes, dtype=np.float64)),
+            np.atleast_1d(np.asarray(latitudes, dtype=np.float64)))
+        indices = np.full((lons.size, k), -1, dtype=np.int64)
+        distances = np.full((lons.size, k), np.inf, dtype=np.float64)
+        if not len(self):
+            return indices, distances
+        wanted = min(k, len(self))
+        # radius expected to hold about k points if they were spread evenly
+        area = 4.0 * math.pi * 6371008.8 ** 2 / len(self)
+        first_radius = max(1.0, math.sqrt(wanted * area / math.pi))
+        for i, (lon, lat) in enumerate(zip(lons, lats)):
+            radius = first_radius
+            while True:
+                found, dist = self._within(lon, lat, radius)
+                if found.size >= wanted or radius >= _HALF_CIRCUMFERENCE_M:
+                    break
+                radius *= 4.0
+            order = np.argsort(dist, kind='stable')[:wanted]
+            indices[i, :order.size] = self.order[found[order]]
+            distances[i, :order.size] = dist[order]
+        return indices, distances
@@ -0,0 +1,140 @@
+"""
+Spherical geodesics in pure numpy, for bulk work where speed matters more
+than sub-metre accuracy.
+
+SphericalGeod has the fwd, inv and npts methods of pyproj's Geod (the
+parts of them this library uses), worked out with closed-form great circle
+formulas on a sphere of the mean earth radius, treating WGS84 latitudes as
+spherical ones. Against the WGS84 ellipsoid, the worst case errors are
+
+    distances               0.56% of the distance (about 0.1% typically)
+    positions from fwd      0.56% of the distance travelled
+    azimuths (fwd and back) 0.2 degrees up to 10,000km apart,
+                            0.8 degrees up to 18,000km, 1.7 up to 19,000km
+
+so e.g. a 10km buffer is within about 56m, and a 100m one within 0.6m.
+Azimuths between nearly antipodal points (over about 19,000km apart)
+can be out by tens of degrees, as the shortest route there depends on
+the flattening.
+"""
+
+import math
+import numpy as np
+
+# mean earth radius, (2a + b) / 3 for WGS84
+EARTH_RADIUS_M = 6371008.8
+
+
+_NUMBERS = (int, float)
+
+
+def _degrees_result(values):
+    values = np.asarray(values, dtype=np.float64)
+    return float(values) if values.ndim == 0 else values
+
+
+def _radians_result(values):
+    return _degrees_result(np.radians(values))
+
+
+def _wrap(longitudes):
+    return (longitudes + 180.0) % 360.0 - 180.0
+
+
+class SphericalGeod(object):
+    """
+    Great circle calculations on a sphere, with the Geod calling
+    conventions (degrees, or radians with radians=True, azimuths
+    clockwise from north, meters)
+    """
+
+    def __init__(self, radius_m=EARTH_RADIUS_M):
+        """
+        :param radius_m: radius of the sphere
+        """
+        self.a = float(radius_m)
+        self.b = float(radius_m)
+
+    def inv(self, lons1, lats1, lons2, lats2, radians=False):
+        """
+        Azimuths and distances between pairs of points
+        :return: (forward azimuths, back azimuths, distances in meters)
+        """
+        if radians:
+            az12, az21, dist = self.inv(*[np.degrees(values) for values in
+                                          (lons1, lats1, lons2, lats2)])
+            return _radians_result(az12), _radians_result(az21), dist
+        if isinstance(lons1, _NUMBERS) and isinstance(lats1, _NUMBERS) and \
+                isinstance(lons2, _NUMBERS) and isinstance(lats2, _NUMBERS):
+            return self._inv_scalar(lons1, lats1, lons2, lats2)
+        lam1, phi1, lam2, phi2 = [np.radians(np.asarray(values, dtype=np.float64))
+                                  for values in (lons1, lats1, lons2, lats2)]
+        dlam = lam2 - lam1
+        cos1, sin1 = np.cos(phi1), np.sin(phi1)
+        cos2, sin2 = np.cos(phi2), np.sin(phi2)
+        cos_dlam, sin_dlam = np.cos(dlam), np.sin(dlam)
+        # haversine, well conditioned for short distances
+        h = np.sin(0.5 * (phi2 - phi1)) ** 2 + cos1 * cos2 * np.sin(0.5 * dlam) ** 2
+        dist = 2.0 * self.a * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+        az12 = np.degrees(np.arctan2(sin_dlam * cos2, cos1 * sin2 - sin1 * cos2 * cos_dlam))
+        az21 = np.degrees(np.arctan2(-sin_dlam * cos1, cos2 * sin1 - sin2 * cos1 * cos_dlam))
+        return _degrees_result(az12), _degrees_result(az21), _degrees_result(dist)
+
+    def _inv_scalar(self, lon1, lat1, lon2, lat2):
+        # math is several times quicker than numpy for single values
+        lam1, phi1, lam2, phi2 = map(math.radians, (lon1, lat1, lon2, lat2))
+        dlam = lam2 - lam1
+        cos1, sin1 = math.cos(phi1), math.sin(phi1)
+        cos2, sin2 = math.cos(phi2), math.sin(phi2)
+        h = math.sin(0.5 * (phi2 - phi1)) ** 2 + cos1 * cos2 * math.sin(0.5 * dlam) ** 2
+        dist = 2.0 * self.a * math.asin(math.sqrt(min(1.0, max(0.0, h))))
+        az12 = math.degrees(math.atan2(math.sin(dlam) * cos2,
+                                       cos1 * sin2 - sin1 * cos2 * math.cos(dlam)))
+        az21 = math.degrees(math.atan2(-math.sin(dlam) * cos1,
+                                       cos2 * sin1 - sin2 * cos1 * math.cos(dlam)))
+        return az12, az21, dist
+
+    def fwd(self, lons, lats, az, dist, radians=False):
+        """
+        Points reached by travelling dist meters from each point along
+        each azimuth
+        :return: (longitudes, latitudes, back azimuths)
+        """
+        if radians:
+            xx, yy, back = self.fwd(np.degrees(lons), np.degrees(lats), np.degrees(az), dist)
+            return _radians_result(xx), _radians_result(yy), _radians_result(back)
+        lam1 = np.radians(np.asarray(lons, dtype=np.float64))
+        phi1 = np.radians(np.asarray(lats, dtype=np.float64))
+        theta = np.radians(np.asarray(az, dtype=np.float64))
+        delta = np.asarray(dist, dtype=np.float64) / self.a
+        sin1, cos1 = np.sin(phi1), np.cos(phi1)
+        sin_delta, cos_delta = np.sin(delta), np.cos(delta)
+        sin2 = np.clip(sin1 * cos_delta + cos1 * sin_delta * np.cos(theta), -1.0, 1.0)
+        phi2 = np.arcsin(sin2)
+        y = np.sin(theta) * sin_delta * cos1
+        x = cos_delta - sin1 * sin2
+        lam2 = lam1 + np.arctan2(y, x)
+        # azimuth from the end back to the start
+        dlam = lam1 - lam2
+        back = np.degrees(np.arctan2(np.sin(dlam) * cos1,
+                                     np.cos(phi2) * sin1 - sin2 * cos1 * np.cos(dlam)))
+        return (_degrees_result(_wrap(np.degrees(lam2))),
+                _degrees_result(np.degrees(phi2)),
+                _degrees_result(back))
+
+    def npts(self, lon1, lat1, lon2, lat2, npts, radians=False):
+        """
+        Equally spaced points between two points, not including them
+        :return: (npts, 2) array of lon/lat
+        """
+        if radians:
+            return np.radians(self.npts(math.degrees(lon1), math.degrees(lat1),
+                                        math.degrees(lon2), math.degrees(lat2), npts))
+        az12, _, dist = self.inv(lon1, lat1, lon2, lat2)
+        steps = dist * np.arange(1, npts + 1, dtype=np.float64) / (npts + 1)
+        xx, yy, _ = self.fwd(np.full(npts, lon1), np.full(npts, lat1),
+                             np.full(npts, az12), steps)
+        return np.column_stack((xx, yy))
+
+
+SPHERE = SphericalGeod()
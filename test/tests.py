@@ -1,13 +1,41 @@
 import unittest
-from geodesics import great_circle, geodesic_point_buffer
-from geodesics import geo_point_buffer
+from geodesics import great_circle, geodesic_point_buffer, great_circles
+from geodesics import geodesic_point_buffers, great_circles_through_points
+from geodesics import great_circle_distances, great_circle_distance_matrix
+from geodesics import in_geodesic_point_buffer, get_sizes_of_degree_at
+from geodesics import geo_point_buffer, geodesic_circle_bounds
 from geodesics import great_circle_distance, get_bounding_box, get_square_point_buffer
 from geodesics import get_tissot_indicatrix, get_size_of_degree_at, get_square_point_buffer_geodesic
 from geodesics import get_great_circle_from_two_points, get_great_circle_from_two_points2
-from geodesics import convert_projection_extent
+from geodesics import convert_projection_extent, geodesic_areas, geodesic_perimeters
+from geodesics import geodesic_corridor, geodesic_corridors
 from cartesian import get_bounding_box_cartesian, get_line_cartesian, get_graticules
-from shapely.geometry import Polygon, MultiPoint, LineString, MultiLineString, MultiPolygon
+from shapely.geometry import Polygon, MultiPoint, LineString, MultiLineString, MultiPolygon, Point, box
+from units import MI
 from utils import float_range_by, float_range, parse_qgis_extent
+from utils import float_array, float_array_by, interpolate_coords
+from utils import write_geojson, geometry_to_geojson
+import copy
+import csv
+import math
+import io
+import json
+from packed import write_packed, read_packed, write_wkb, read_wkb, POLYGON
+import os
+import pickle
+import tempfile
+import threading
+import batch
+import asyncio
+from service import GeodesyService
+from spatial_index import PointIndex
+from registry import WGS84, LRURegistry, get_geod, get_transformer, registry_stats, clear_registry
+import numpy as np
+from benchmarks import bench
+from instrumentation import recording, is_recording
+from lazy import lazy, LazyGeometry
+from spherical import EARTH_RADIUS_M, SPHERE
+from disk_cache import DiskCache, enable_disk_cache, disable_disk_cache, disk_cache_stats
 
 
 class TestGeodesics(unittest.TestCase):
@@ -36,6 +64,21 @@ class TestGeodesics(unittest.TestCase):
         geom = convert_projection_extent(5456328, -2786634, 14254990, 2320744, example)
         self.assertIsInstance(geom, LineString)
 
+    def test_get_projection_extent_adaptive(self):
+        example = "+proj=moll +lon_0=0 + x_0=0 +y_0=0 +datum=WGS84 +units=m +no_defs"
+        fixed = convert_projection_extent(5456328, -2786634, 14254990, 2320744, example)
+        geom = convert_projection_extent(5456328, -2786634, 14254990, 2320744, example,
+                                         tolerance=0.01)
+        self.assertIsInstance(geom, LineString)
+        self.assertLess(len(geom.coords), len(fixed.coords) / 10)
+        self.assertLess(geom.hausdorff_distance(fixed), 0.01)
+
+    def test_get_projection_extent_drops_invalid(self):
+        # corners lie outside the valid area of mollweide
+        example = "+proj=moll +lon_0=0 + x_0=0 +y_0=0 +datum=WGS84 +units=m +no_defs"
+        geom = convert_projection_extent(-1.8e7, -1e7, 1.8e7, 1e7, example)
+        self.assertTrue(np.isfinite(np.array(geom.coords)).all())
+
     def test_get_great_cicle_two_points2(self):
         # Rapa Nui to Kheops Pyramid Great Circle
         geom = get_great_circle_from_two_points(-109.28894, -27.12201, 31.13074, 29.97594, ellipsoid='sphere')
@@ -45,6 +88,31 @@ class TestGeodesics(unittest.TestCase):
         geom = get_great_circle_from_two_points(-3.0, 55.97,  151.209444, -33.865)
         self.assertIsInstance(geom, MultiPoint)
 
+    def test_great_circles_through_points(self):
+        coords = great_circles_through_points([-3.0, -109.28894], [55.97, -27.12201],
+                                              [151.209444, 31.13074], [-33.865, 29.97594],
+                                              resolution_m=100000.0, ellipsoid='sphere')
+        self.assertEqual(coords.shape[0], 2)
+        self.assertEqual(coords.shape[2], 2)
+        self.assertTrue(np.allclose(coords[:, 0], [[-3.0, 55.97], [-109.28894, -27.12201]]))
+        # on a sphere the circle nearly joins up by itself
+        self.assertTrue(np.allclose(coords[:, -1], coords[:, 0], atol=1e-6))
+
+    def test_great_circles_through_points_closed(self):
+        geoms = great_circles_through_points(-3.0, 55.97, 151.209444, -33.865,
+                                             resolution_m=50000.0, closed=True,
+                                             geom_type=LineString)
+        self.assertEqual(len(geoms), 1)
+        self.assertTrue(geoms[0].is_closed)
+        # a meridian is traced once round, without overshooting the start
+        coords = great_circles_through_points(0.0, 10.0, 0.0, 20.0, resolution_m=10000.0,
+                                              closed=True)
+        geod = get_geod('WGS84')
+        _, _, steps = geod.inv(coords[0, :-1, 0], coords[0, :-1, 1],
+                               coords[0, 1:, 0], coords[0, 1:, 1])
+        self.assertAlmostEqual(float(np.max(steps)), float(np.min(steps)), places=3)
+        self.assertAlmostEqual(float(np.sum(steps)), 40007862.9, places=0)
+
     def test_get_square_buffer(self):
         geom = get_square_point_buffer(-0.088852182554, 51.5133703623, 1000.0)
         self.assertIsInstance(geom, Polygon)
@@ -53,7 +121,21 @@ class TestGeodesics(unittest.TestCase):
     def test_get_square_buffer_geodesic(self):
         geom = get_square_point_buffer_geodesic(-0.088852182554, 51.5133703623, 1000000.0)
         self.assertIsInstance(geom, Polygon)
-        self.assertAlmostEqual(geom.area, 129.52600421911623)  # square degrees
+        self.assertAlmostEqual(geom.area, 129.526206635533)  # square degrees
+
+    def test_get_square_buffers_across_antimeridian(self):
+        for make in (get_square_point_buffer, get_square_point_buffer_geodesic):
+            east = make(-179.9, 10.0, 100000.0)
+            geom = make(179.9, 10.0, 100000.0)
+            self.assertIsInstance(geom, Polygon)
+            self.assertGreater(geom.bounds[2], 180.0)
+            self.assertAlmostEqual(geom.area, east.area, places=6)
+            split = make(179.9, 10.0, 100000.0, split_antimeridian=True)
+            self.assertIsInstance(split, MultiPolygon)
+            self.assertTrue(split.is_valid)
+            self.assertEqual(split.bounds[0], -180.0)
+            self.assertEqual(split.bounds[2], 180.0)
+            self.assertAlmostEqual(split.area, east.area, places=6)
 
     def test_float_range_ascending(self):
         vals = list([x for x in float_range(0.0, 1.0, 100)])
@@ -91,10 +173,113 @@ class TestGeodesics(unittest.TestCase):
         with self.assertRaises(AssertionError):
             vals = list([x for x in float_range_by(0.0, 0.0, .1)])
 
+    def test_float_array(self):
+        vals = float_array(1.0, 0.0, 100)
+        self.assertEqual(vals.shape, (101,))
+        self.assertEqual(vals[0], 1.0)
+        self.assertEqual(vals[-1], 0.0)
+        self.assertEqual(len(float_array(0.0, 0.0, 100)), 101)
+
+    def test_float_array_by(self):
+        vals = float_array_by(0.0, 1.0, .1)
+        self.assertEqual(len(vals), 11)
+        self.assertEqual(vals[-1], 1.0)
+        self.assertAlmostEqual(vals[3], 0.3)
+        vals = float_array_by(1.0, 0.0, .3)
+        self.assertEqual(list(vals[-2:]), [1.0 - 3 * .3, 0.0])
+        with self.assertRaises(AssertionError):
+            float_array_by(0.0, 0.0, .1)
+
+    def test_interpolate_coords(self):
+        coords = interpolate_coords(-180.0, -90.0, 180.0, 90.0, 4)
+        self.assertEqual(coords.shape, (5, 2))
+        self.assertEqual(tuple(coords[2]), (0.0, 0.0))
+        self.assertEqual(tuple(coords[-1]), (180.0, 90.0))
+
+    def test_get_graticules_count(self):
+        geom = get_graticules()
+        # 37 meridians and 19 parallels, no duplicates at the ends
+        self.assertEqual(len(geom.geoms), 56)
+
+    def test_geometry_to_geojson_precision(self):
+        geom = Polygon([(0.123456789, 0.0), (1.0, 0.0), (1.0, 1.0)])
+        data = geometry_to_geojson(geom, precision=3)
+        self.assertEqual(data['type'], 'Polygon')
+        self.assertEqual(data['coordinates'][0][0], [0.123, 0.0])
+
+    def test_write_geojson_feature_collection(self):
+        fo = io.StringIO()
+        geoms = (great_circle(0.0, 0.0, 10.0, float(i), 10) for i in range(-89, 90, 2))
+        count = write_geojson(((geom, {'id': i}) for i, geom in enumerate(geoms)), fo)
+        self.assertEqual(count, 90)
+        data = json.loads(fo.getvalue())
+        self.assertEqual(data['type'], 'FeatureCollection')
+        self.assertEqual(len(data['features']), 90)
+        self.assertEqual(data['features'][7]['properties'], {'id': 7})
+        self.assertEqual(data['features'][48]['geometry']['coordinates'][-1], [10.0, 7.0])
+        self.assertNotIn(' ', fo.getvalue())
+        with self.assertRaises(ValueError):
+            write_geojson([LineString([(0, 0), (1, float('nan'))])], io.StringIO())
+
+    def test_write_geojson_sequence(self):
+        fo = io.StringIO()
+        count = write_geojson([LineString([(0, 0), (1, 1)]), Polygon([(0, 0), (1, 0), (1, 1)])],
+                              fo, sequence=True)
+        lines = fo.getvalue().splitlines()
+        self.assertEqual(count, 2)
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(json.loads(lines[1])['geometry']['type'], 'Polygon')
+
     def test_get_graticules(self):
         geom = get_graticules(longitude_resolution=5, latitude_resolution=5)
         self.assertIsInstance(geom, MultiLineString)
 
+    def test_get_graticules_projected(self):
+        proj4 = "+proj=laea +lat_0=52 +lon_0=10 +ellps=GRS80 +units=m"
+        transformer = get_transformer(WGS84, proj4)
+        lonlat = get_graticules(-30.0, 50.0, 30.0, 70.0, 5.0, 5.0)
+        geom = get_graticules(-30.0, 50.0, 30.0, 70.0, 5.0, 5.0, proj4_string=proj4)
+        self.assertEqual(len(geom.geoms), len(lonlat.geoms))
+        for line, projected in zip(lonlat.geoms, geom.geoms):
+            xx, yy = transformer.transform(*np.array(line.coords).T)
+            np.testing.assert_allclose(np.array(projected.coords), np.column_stack((xx, yy)))
+        # clipped to the canvas, without cutting lines where they cross
+        extent = (-1000000.0, -500000.0, 1000000.0, 1500000.0)
+        clipped = get_graticules(-30.0, 50.0, 30.0, 70.0, 5.0, 5.0, proj4_string=proj4,
+                                 extent=extent)
+        self.assertAlmostEqual(clipped.length, geom.intersection(box(*extent)).length, places=3)
+        self.assertLessEqual(len(clipped.geoms), len(geom.geoms))
+        min_x, min_y, max_x, max_y = clipped.bounds
+        self.assertEqual((min_x, max_x, max_y), (-1000000.0, 1000000.0, 1500000.0))
+        # only as many vertices as it takes to follow the curves closely
+        adaptive = get_graticules(-30.0, 50.0, 30.0, 70.0, 5.0, 5.0, proj4_string=proj4,
+                                  extent=extent, tolerance=10.0)
+        self.assertLess(len(np.concatenate([line.coords for line in adaptive.geoms])),
+                        len(np.concatenate([line.coords for line in clipped.geoms])) / 4)
+        self.assertLess(adaptive.hausdorff_distance(clipped), 50.0)
+        box_lines = get_bounding_box_cartesian(-10.0, 40.0, 30.0, 60.0, proj4_string=proj4,
+                                               extent=extent, tolerance=1.0)
+        self.assertIsInstance(box_lines, MultiLineString)
+        # only the northern edge crosses the canvas
+        self.assertEqual(len(box_lines.geoms), 1)
+        self.assertEqual((box_lines.bounds[0], box_lines.bounds[2]), (-1000000.0, 1000000.0))
+
+    def test_get_graticules_projected_seams(self):
+        # lines crossing the seam at -165 are broken there, not joined across the map
+        proj4 = "+proj=moll +lon_0=15 +datum=WGS84 +units=m"
+        for tolerance in (None, 1000.0):
+            geom = get_graticules(proj4_string=proj4, tolerance=tolerance)
+            for line in geom.geoms:
+                steps = np.hypot(*np.diff(np.array(line.coords), axis=0).T)
+                self.assertLess(steps.max(), 2000000.0)
+        # an azimuthal projection has no line through its centre's antipode
+        proj4 = "+proj=laea +lat_0=52 +lon_0=10 +ellps=GRS80 +units=m"
+        extent = (-2000000.0, -2000000.0, 2000000.0, 2000000.0)
+        fixed = get_graticules(proj4_string=proj4, extent=extent)
+        adaptive = get_graticules(proj4_string=proj4, extent=extent, tolerance=1000.0)
+        self.assertEqual(len(fixed.geoms), len(adaptive.geoms))
+        self.assertAlmostEqual(adaptive.length / fixed.length, 1.0, places=2)
+
     def test_tissot_indicatrix(self):
         geom = get_tissot_indicatrix()
         self.assertIsInstance(geom, MultiPolygon)
@@ -118,6 +303,45 @@ class TestGeodesics(unittest.TestCase):
                                      31.130786522, 29.9759689257)
         self.assertEqual(dist, 3945700.7804510733)
 
+    def test_greatcircle_distances(self):
+        dists = great_circle_distances([-3.18904598892, 0.0], [55.9532968753, 0.0],
+                                       [31.130786522, 1.0], [29.9759689257, 0.0])
+        self.assertEqual(dists.shape, (2,))
+        self.assertAlmostEqual(dists[0], 3945700.7804510733, places=5)
+        self.assertEqual(int(dists[1]), 111319)
+
+    def test_greatcircle_distance_matrix(self):
+        lons = np.array([0.0, 1.0, 2.0, 3.0])
+        lats = np.zeros(4)
+        matrix = great_circle_distance_matrix(lons, lats, lons[:3], lats[:3], chunk_size=5)
+        self.assertEqual(matrix.shape, (4, 3))
+        self.assertEqual(matrix[1, 1], 0.0)
+        self.assertAlmostEqual(matrix[3, 0], great_circle_distance(3.0, 0.0, 0.0, 0.0))
+        indices, dists = great_circle_distance_matrix(lons, lats, lons[:3], lats[:3], k=2,
+                                                      chunk_size=5)
+        self.assertEqual(indices.tolist(), [[0, 1], [1, 0], [2, 1], [2, 1]])
+        self.assertAlmostEqual(dists[3, 1], matrix[3, 1])
+        rows, cols, dists = great_circle_distance_matrix(lons, lats, lons[:3], lats[:3],
+                                                         max_distance_m=120000.0)
+        self.assertEqual(sorted(zip(rows.tolist(), cols.tolist())),
+                         [(0, 0), (0, 1), (1, 0), (1, 1), (1, 2), (2, 1), (2, 2), (3, 2)])
+
+    def test_greatcircle_distance_matrix_memmap(self):
+        folder = tempfile.mkdtemp()
+        file_name = os.path.join(folder, "matrix.npy")
+        matrix = great_circle_distance_matrix([0.0, 1.0], [0.0, 0.0], [0.0, 0.0, 1.0], [0.0, 1.0, 1.0],
+                                              file_name=file_name)
+        del matrix
+        loaded = np.load(file_name, mmap_mode='r')
+        self.assertEqual(loaded.shape, (2, 3))
+        self.assertEqual(int(loaded[0, 1]), 110574)
+        del loaded
+        os.remove(file_name)
+        with self.assertRaises(ValueError):
+            great_circle_distance_matrix([0.0], [0.0], [1.0], [1.0], k=1, file_name=file_name)
+        self.assertFalse(os.path.exists(file_name))
+        os.rmdir(folder)
+
     def test_great_circle_degree_lon_at_equator(self):
         dist = great_circle_distance(0.0, 0.0,
                                      1.0, 0.0)
@@ -168,6 +392,213 @@ class TestGeodesics(unittest.TestCase):
         self.assertAlmostEqual(xn, 31.130786522)
         self.assertAlmostEqual(yn, 29.9759689257)
 
+    def test_great_circle_max_deviation(self):
+        # short haul, Heathrow to Edinburgh
+        geom = great_circle(-0.455, 51.471, -3.36, 55.95, max_deviation_m=100.0)
+        dense = great_circle(-0.455, 51.471, -3.36, 55.95, 1000)
+        self.assertLess(len(geom.coords), 20)
+        self.assertEqual(geom.coords[0], (-0.455, 51.471))
+        self.assertEqual(geom.coords[-1], (-3.36, 55.95))
+        self.assertLess(geom.hausdorff_distance(dense), 0.002)
+        # long haul needs more vertices for the same tolerance
+        geom_long = great_circle(-0.455, 51.471, 151.2, -33.9, max_deviation_m=100.0)
+        self.assertGreater(len(geom_long.coords), len(geom.coords))
+
+    def test_great_circle_max_segment(self):
+        geom = great_circle(-0.455, 51.471, 55.368, 25.250, max_segment_m=50000.0)
+        coords = np.array(geom.coords)
+        _, _, lengths = get_geod('WGS84').inv(coords[:-1, 0], coords[:-1, 1],
+                                              coords[1:, 0], coords[1:, 1])
+        self.assertLessEqual(max(lengths), 50000.0)
+        self.assertGreater(min(lengths), 45000.0)
+
+    def test_bounding_box_adaptive(self):
+        geom = get_bounding_box(10.0, 20.0, 45.0, 32.0, max_deviation_m=100.0)
+        self.assertIsInstance(geom, MultiLineString)
+        self.assertLess(sum([len(line.coords) for line in geom.geoms]), 4004)
+
+    def test_sphere_engine(self):
+        wgs84 = great_circle_distance(-3.189, 55.953, 31.13, 29.97)
+        sphere = great_circle_distance(-3.189, 55.953, 31.13, 29.97, engine='sphere')
+        self.assertLess(abs(sphere - wgs84) / wgs84, 0.0056)
+        np.testing.assert_allclose(great_circle_distances([-3.189, 0.0], [55.953, 0.0],
+                                                          [31.13, 1.0], [29.97, 0.0],
+                                                          engine='sphere'),
+                                   [sphere, 6371008.8 * math.pi / 180.0])
+        route = great_circle(-0.455, 51.471, 55.368, 25.250, 100, engine='sphere')
+        self.assertEqual(route.coords[0], (-0.455, 51.471))
+        self.assertEqual(route.coords[-1], (55.368, 25.250))
+        self.assertLess(route.hausdorff_distance(great_circle(-0.455, 51.471, 55.368, 25.250, 100)),
+                        0.1)
+        ring = geodesic_point_buffer(-3.189, 55.953, 16, 10000.0, engine='sphere')
+        lons, lats = np.asarray([point.coords[0] for point in ring.geoms]).T
+        distances = great_circle_distances(-3.189, 55.953, lons, lats, engine='sphere')
+        np.testing.assert_allclose(distances, 10000.0)
+        circle = get_great_circle_from_two_points(-109.28894, -27.12201, 31.13074, 29.97594,
+                                                  engine='sphere')
+        self.assertEqual(len(circle.geoms), 10001)
+        with self.assertRaises(ValueError):
+            great_circle_distance(0.0, 0.0, 1.0, 1.0, engine='mars')
+
+    def test_sphere_engine_accuracy(self):
+        # the worst case errors given in spherical.py
+        random = np.random.RandomState(1)
+        lon1, lon2 = random.uniform(-180.0, 180.0, (2, 200000))
+        lat1, lat2 = np.degrees(np.arcsin(random.uniform(-1.0, 1.0, (2, 200000))))
+        fwd, back, dist = get_geod('WGS84').inv(lon1, lat1, lon2, lat2)
+        sphere_fwd, sphere_back, sphere_dist = SPHERE.inv(lon1, lat1, lon2, lat2)
+        self.assertLess(np.max(np.abs(sphere_dist - dist) / dist), 0.0057)
+        for azimuths, sphere_azimuths in ((fwd, sphere_fwd), (back, sphere_back)):
+            error = np.abs((sphere_azimuths - azimuths + 180.0) % 360.0 - 180.0)
+            for within, bound in ((10000000.0, 0.2), (18000000.0, 0.8), (19000000.0, 1.7)):
+                self.assertLess(np.max(error[dist < within]), bound)
+
+    def test_sphere_engine_radians(self):
+        # like Geod, radians=True takes and returns radians, and meters
+        lon1, lat1, lon2, lat2 = -3.189, 55.953, 31.13, 29.97
+        fwd, back, dist = SPHERE.inv(lon1, lat1, lon2, lat2)
+        result = SPHERE.inv(*np.radians([lon1, lat1, lon2, lat2]), radians=True)
+        np.testing.assert_allclose(result, (math.radians(fwd), math.radians(back), dist))
+        xx, yy, end_back = SPHERE.fwd([lon1], [lat1], [fwd], [dist])
+        result = SPHERE.fwd(np.radians([lon1]), np.radians([lat1]), np.radians([fwd]), [dist],
+                            radians=True)
+        np.testing.assert_allclose(np.concatenate(result),
+                                   np.radians(np.concatenate((xx, yy, end_back))))
+        points = SPHERE.npts(lon1, lat1, lon2, lat2, 5)
+        np.testing.assert_allclose(SPHERE.npts(*np.radians([lon1, lat1, lon2, lat2]), 5,
+                                               radians=True), np.radians(points))
+
+    def test_geodesic_circle_bounds(self):
+        lons = [-0.088852182554, 10.0, 20.0, 170.0, 0.0]
+        lats = [51.5133703623, 80.0, -70.0, 10.0, 45.0]
+        radii = [500.0, 1110000.0, 2000000.0, 2000000.0, 9000000.0]
+        bounds = geodesic_circle_bounds(lons, lats, radii)
+        for i in range(0, 3):
+            ring = geodesic_point_buffers(lons[i], lats[i], 20000, radii[i])[0]
+            np.testing.assert_allclose(bounds[i, :2], ring.min(axis=0), atol=1e-6)
+            np.testing.assert_allclose(bounds[i, 2:], ring.max(axis=0), atol=1e-6)
+        # across the antimeridian, west > east
+        self.assertGreater(bounds[3, 0], bounds[3, 2])
+        self.assertAlmostEqual(bounds[3, 0] + bounds[3, 2], 2.0 * 170.0 - 360.0)
+        # around the north pole
+        self.assertEqual((bounds[4, 0], bounds[4, 2], bounds[4, 3]), (-180.0, 180.0, 90.0))
+
+    def test_geodesic_areas_perimeters(self):
+        geo = get_geod('WGS84')
+        rings = geodesic_point_buffers([-3.189, 179.9, 20.0], [55.953, 10.0, -70.0], 64,
+                                       [100.0, 50000.0, 1000000.0])
+        areas = geodesic_areas(rings)
+        perimeters = geodesic_perimeters(rings)
+        for i in range(0, 3):
+            area, perimeter = geo.polygon_area_perimeter(rings[i, :, 0], rings[i, :, 1])
+            self.assertAlmostEqual(areas[i] / abs(area), 1.0, places=6)
+            self.assertAlmostEqual(perimeters[i] / perimeter, 1.0, places=9)
+        # a hole, a pole and an antimeridian crossing, as geometries
+        holed = Polygon([(0, 0), (10, 0), (10, 10), (0, 10)], [[(2, 2), (2, 4), (4, 4), (4, 2)]])
+        polar = geodesic_point_buffer(10.0, 85.0, 360, 1500000.0, Polygon)
+        split = geodesic_point_buffer(179.9, 10.0, 64, 50000.0, Polygon,
+                                      split_antimeridian=True)
+        self.assertIsInstance(split, MultiPolygon)
+        areas = geodesic_areas([holed, polar, split])
+        outer, _ = geo.polygon_area_perimeter([0, 10, 10, 0], [0, 0, 10, 10])
+        inner, _ = geo.polygon_area_perimeter([2, 2, 4, 4], [2, 4, 4, 2])
+        self.assertAlmostEqual(areas[0] / (abs(outer) - abs(inner)), 1.0, places=4)
+        area, _ = geo.polygon_area_perimeter(*np.array(polar.exterior.coords).T)
+        self.assertAlmostEqual(areas[1] / abs(area), 1.0, places=6)
+        self.assertAlmostEqual(areas[2] / geodesic_areas(rings[1:2])[0], 1.0, places=6)
+        # packed files and lazy geometries give the same
+        file_name = os.path.join(tempfile.mkdtemp(), "polygons.bin")
+        write_packed([holed, polar, split], file_name, POLYGON)
+        np.testing.assert_allclose(geodesic_areas(read_packed(file_name)), areas)
+        lazies = geodesic_point_buffers([1.0], [2.0], 64, 1000.0, lazy(Polygon))
+        self.assertAlmostEqual(geodesic_perimeters(lazies)[0],
+                               geodesic_perimeters(geodesic_point_buffers([1.0], [2.0], 64, 1000.0))[0])
+        self.assertAlmostEqual(geodesic_perimeters(rings, engine='sphere')[2] / perimeters[2], 1.0, places=2)
+
+    def test_geodesic_corridor(self):
+        route = great_circle(-0.455, 51.471, 55.368, 25.250, 100)
+        corridor = geodesic_corridor(-0.455, 51.471, 55.368, 25.250, 100000.0)
+        self.assertIsInstance(corridor, Polygon)
+        self.assertTrue(corridor.is_valid)
+        self.assertTrue(corridor.contains(route))
+        # everything within 100km of the route, i.e. the buffers along it
+        buffers = MultiPolygon([geodesic_point_buffer(x, y, 64, 99000.0, Polygon)
+                                for x, y in route.coords])
+        self.assertTrue(corridor.contains(buffers.buffer(0)))
+        # on the sphere, a strip either side of the route plus a circle
+        lon1, lat1 = [-3.189, 170.0, 10.0], [55.953, 10.0, 80.0]
+        lon2, lat2 = [31.131, -170.0, -170.0], [29.976, 20.0, 80.0]
+        radii = np.array([50000.0, 200000.0, 500000.0])
+        rings = geodesic_corridors(lon1, lat1, lon2, lat2, radii, 200, 32, engine='sphere')
+        self.assertEqual(rings.shape, (3, 464, 2))
+        length = great_circle_distances(lon1, lat1, lon2, lat2, engine='sphere') / EARTH_RADIUS_M
+        angle = radii / EARTH_RADIUS_M
+        expected = EARTH_RADIUS_M ** 2 * (2.0 * length * np.sin(angle) +
+                                          2.0 * math.pi * (1.0 - np.cos(angle)))
+        np.testing.assert_allclose(geodesic_areas(rings, engine='sphere'), expected, rtol=1e-3)
+        # across the antimeridian, and round the north pole
+        split = geodesic_corridors(lon1, lat1, lon2, lat2, radii, 200, 32, Polygon,
+                                   split_antimeridian=True, engine='sphere')
+        self.assertIsInstance(split[1], MultiPolygon)
+        self.assertIsInstance(split[2], Polygon)
+        self.assertEqual(split[2].bounds[3], 90.0)
+        self.assertTrue(all(geom.is_valid for geom in split))
+        np.testing.assert_allclose(geodesic_areas(split, engine='sphere'), expected, rtol=1e-3)
+        # a route of no length is a circle
+        circle = geodesic_corridor(1.0, 1.0, 1.0, 1.0, 5000.0, 4, 32)
+        self.assertTrue(circle.is_valid)
+        self.assertAlmostEqual(circle.area, geodesic_point_buffer(1.0, 1.0, 64, 5000.0, Polygon).area)
+
+    def test_get_square_buffer_geodesic_adaptive(self):
+        geom = get_square_point_buffer_geodesic(-0.088852182554, 51.5133703623, 1000000.0,
+                                                max_deviation_m=10.0)
+        self.assertIsInstance(geom, Polygon)
+        self.assertAlmostEqual(geom.area, 129.52600421911623, places=2)
+
+    def test_great_circle_split_antimeridian(self):
+        geom = great_circle(170.0, 10.0, -170.0, 20.0, 100, split_antimeridian=True)
+        self.assertIsInstance(geom, MultiLineString)
+        west, east = geom.geoms
+        self.assertEqual(west.coords[0], (170.0, 10.0))
+        self.assertEqual(west.coords[-1][0], 180.0)
+        self.assertEqual(east.coords[0][0], -180.0)
+        self.assertEqual(west.coords[-1][1], east.coords[0][1])
+        self.assertEqual(east.coords[-1], (-170.0, 20.0))
+        geom = great_circle(-0.455, 51.471, 55.368, 25.250, split_antimeridian=True)
+        self.assertIsInstance(geom, LineString)
+        # starting or ending on the antimeridian isn't a crossing
+        geom = great_circle(180.0, 0.0, -170.0, 10.0, 10, split_antimeridian=True)
+        self.assertIsInstance(geom, LineString)
+        self.assertEqual(geom.coords[0], (-180.0, 0.0))
+        geom = great_circle(170.0, 0.0, 180.0, 10.0, 10, split_antimeridian=True)
+        self.assertIsInstance(geom, LineString)
+        self.assertEqual(geom.coords[-1], (180.0, 10.0))
+
+    def test_great_circles_split_antimeridian(self):
+        geoms = great_circles([170.0, 0.0], [10.0, 0.0], [-170.0, 10.0], [20.0, 10.0], 50,
+                              LineString, split_antimeridian=True)
+        self.assertIsInstance(geoms[0], MultiLineString)
+        self.assertIsInstance(geoms[1], LineString)
+
+    def test_great_circles_matches_scalar(self):
+        starts = [(-3.18904598892, 55.9532968753), (170.0, 10.0)]
+        ends = [(31.130786522, 29.9759689257), (-170.0, 20.0)]
+        coords = great_circles([x for x, y in starts], [y for x, y in starts],
+                               [x for x, y in ends], [y for x, y in ends],
+                               100)
+        self.assertEqual(coords.shape, (2, 101, 2))
+        for i in range(0, 2):
+            geom = great_circle(starts[i][0], starts[i][1],
+                                ends[i][0], ends[i][1], 100)
+            self.assertTrue(np.allclose(coords[i], np.array(geom.coords)))
+
+    def test_great_circles_geometry_types(self):
+        geoms = great_circles([-3.0, 0.0], [55.0, 0.0], [31.0, 10.0], [29.0, 10.0],
+                              10, LineString)
+        self.assertEqual(len(geoms), 2)
+        self.assertIsInstance(geoms[0], LineString)
+        self.assertEqual(len(geoms[1].coords), 11)
+
     def test_geodesic_pointbuffer_number_segments(self):
         geom = geodesic_point_buffer(-3.18907797315, 55.953326627,
                                      2000, 50000,
@@ -182,6 +613,72 @@ class TestGeodesics(unittest.TestCase):
         # again, expect N+1 points for N segments
         self.assertEqual(len(geom.exterior.coords), 2001)
 
+    def test_geodesic_pointbuffers_matches_scalar(self):
+        coords = geodesic_point_buffers([-3.18907797315, 151.2], [55.953326627, -33.8],
+                                        360, [50000, 500000])
+        self.assertEqual(coords.shape, (2, 360, 2))
+        geom = geodesic_point_buffer(151.2, -33.8, 360, 500000, LineString)
+        self.assertTrue(np.allclose(coords[1], np.array(geom.coords)))
+
+    def test_geodesic_pointbuffers_geometry_types(self):
+        geoms = geodesic_point_buffers([0.0, 10.0, 20.0], [0.0, 10.0, 20.0],
+                                       100, 1000.0, Polygon)
+        self.assertEqual(len(geoms), 3)
+        self.assertIsInstance(geoms[2], Polygon)
+        self.assertEqual(len(geoms[2].exterior.coords), 101)
+
+    def test_in_geodesic_point_buffer(self):
+        # Leith to London is ~535km, to Paris ~870km
+        lons = np.array([-0.1276, 2.3522])
+        lats = np.array([51.5072, 48.8566])
+        inside = in_geodesic_point_buffer(lons, lats, -3.17011665725, 55.9764025681, 500.0 * MI)
+        self.assertEqual(inside.tolist(), [True, False])
+        inside, dists = in_geodesic_point_buffer(lons[:, None], lats[:, None],
+                                                 [-3.17, 2.0], [55.97, 49.0],
+                                                 [600000.0, 100000.0],
+                                                 return_distance=True)
+        self.assertEqual(inside.shape, (2, 2))
+        self.assertEqual(inside.tolist(), [[True, False], [False, True]])
+        self.assertAlmostEqual(dists[1, 0], great_circle_distance(-3.17, 55.97, 2.3522, 48.8566))
+
+    def test_in_geodesic_point_buffer_matches_polygon(self):
+        geom = geodesic_point_buffer(-3.18907797315, 55.953326627, 2000, 500000, Polygon)
+        random = np.random.RandomState(1)
+        lons = random.uniform(-12.0, 6.0, 200)
+        lats = random.uniform(50.0, 61.0, 200)
+        inside, dists = in_geodesic_point_buffer(lons, lats, -3.18907797315, 55.953326627,
+                                                 500000, return_distance=True)
+        # the polygon is only an approximation, so skip points right on the edge
+        clear = np.abs(dists - 500000) > 2000
+        expected = [geom.contains(Point(x, y)) for x, y in zip(lons, lats)]
+        self.assertEqual(inside[clear].tolist(), np.array(expected)[clear].tolist())
+
+    def test_geodesic_pointbuffer_split_antimeridian(self):
+        geom = geodesic_point_buffer(179.0, 0.0, 360, 500000, Polygon, split_antimeridian=True)
+        self.assertIsInstance(geom, MultiPolygon)
+        self.assertTrue(geom.is_valid)
+        self.assertEqual(geom.bounds[0], -180.0)
+        self.assertEqual(geom.bounds[2], 180.0)
+        unsplit = geodesic_point_buffer(0.0, 0.0, 360, 500000, Polygon)
+        self.assertAlmostEqual(geom.area, unsplit.area, places=6)
+
+    def test_geodesic_pointbuffer_around_pole(self):
+        for latitude, pole in ((85.0, 90.0), (-85.0, -90.0)):
+            geom = geodesic_point_buffer(179.5, latitude, 360, 1000000, Polygon,
+                                         split_antimeridian=True)
+            self.assertIsInstance(geom, Polygon)
+            self.assertTrue(geom.is_valid)
+            self.assertTrue(geom.contains(Point(0.0, pole * 0.99)))
+            self.assertTrue(geom.contains(Point(179.5, latitude)))
+            self.assertFalse(geom.contains(Point(0.0, 0.0)))
+
+    def test_geodesic_pointbuffers_split_antimeridian(self):
+        geoms = geodesic_point_buffers([179.0, 0.0, -179.9], [0.0, 0.0, 89.0], 100,
+                                       [500000, 500000, 200000], Polygon,
+                                       split_antimeridian=True)
+        self.assertEqual([geom.geom_type for geom in geoms], ['MultiPolygon', 'Polygon', 'Polygon'])
+        self.assertTrue(all([geom.is_valid for geom in geoms]))
+
     def test_geo_point_buffer_number_segments(self):
         geom = geo_point_buffer(-3.18907797315, 55.953326627,
                                 2000, 500000,
@@ -198,6 +695,421 @@ class TestGeodesics(unittest.TestCase):
         self.assertAlmostEqual(xsize, 19393.246801386882)
         self.assertAlmostEqual(ysize, 111663.20092602777)
 
+    def test_sizes_of_degrees(self):
+        xsize, ysize = get_sizes_of_degree_at([0.0, 80.0, 90.0, -90.0])
+        self.assertAlmostEqual(xsize[0], 111319.49079327357, places=3)
+        self.assertAlmostEqual(ysize[0], 110574.38855779878, places=3)
+        self.assertAlmostEqual(xsize[1], 19393.246801386882, places=3)
+        self.assertAlmostEqual(ysize[1], 111663.20092602777, places=3)
+        self.assertTrue(np.isnan(xsize[2:]).all())
+        self.assertTrue(np.isnan(ysize[2:]).all())
+
+    def test_sizes_of_degrees_error_bound(self):
+        latitudes = np.random.RandomState(0).uniform(-89.0, 89.0, 200)
+        xsize, ysize = get_sizes_of_degree_at(latitudes)
+        for latitude, x, y in zip(latitudes, xsize, ysize):
+            expected_x, expected_y = get_size_of_degree_at(latitude)
+            self.assertLess(abs(x - expected_x), 0.001)
+            self.assertLess(abs(y - expected_y), 0.001)
+        # the last latitudes with a full degree north before the pole
+        for latitude in (89.0, -89.0):
+            (x,), (y,) = get_sizes_of_degree_at([latitude])
+            expected_x, expected_y = get_size_of_degree_at(latitude)
+            self.assertLess(abs(x - expected_x), 0.001)
+            self.assertLess(abs(y - expected_y), 0.001)
+
+
+class TestRegistry(unittest.TestCase):
+
+    def test_shared_geod(self):
+        clear_registry()
+        self.assertIs(get_geod('WGS84'), get_geod('WGS84'))
+        self.assertIsNot(get_geod('WGS84'), get_geod('sphere'))
+        stats = registry_stats()['geod']
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 2)
+
+    def test_shared_transformer(self):
+        clear_registry()
+        spec = "+proj=moll +lon_0=0 +x_0=0 +y_0=0 +datum=WGS84 +units=m +no_defs"
+        transformer = get_transformer(spec)
+        self.assertIs(transformer, get_transformer(spec))
+        x, y = transformer.transform(0.0, 0.0)
+        self.assertAlmostEqual(x, 0.0)
+        self.assertAlmostEqual(y, 0.0)
+
+    def test_transformer_per_thread(self):
+        clear_registry()
+        spec = "+proj=moll +lon_0=0 +x_0=0 +y_0=0 +datum=WGS84 +units=m +no_defs"
+        transformer = get_transformer(spec)
+        other = []
+        thread = threading.Thread(target=lambda: other.extend([get_transformer(spec),
+                                                               get_transformer(spec)]))
+        thread.start()
+        thread.join()
+        self.assertIs(other[0], other[1])
+        self.assertIsNot(other[0], transformer)
+        self.assertIs(get_transformer(spec), transformer)
+
+    def test_lru_eviction(self):
+        registry = LRURegistry(lambda key: [key], maxsize=2)
+        first = registry.get('a')
+        registry.get('b')
+        registry.get('a')
+        registry.get('c')  # evicts 'b', the least recently used
+        self.assertIs(registry.get('a'), first)
+        stats = registry.stats()
+        self.assertEqual(stats['size'], 2)
+        self.assertEqual(stats['evictions'], 1)
+        self.assertEqual(stats['hits'], 2)
+        registry.get('b')
+        self.assertEqual(registry.stats()['misses'], 4)
+
+
+class TestPacked(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        for name in os.listdir(self.folder):
+            os.remove(os.path.join(self.folder, name))
+        os.rmdir(self.folder)
+
+    def test_wkb_round_trip(self):
+        file_name = os.path.join(self.folder, "routes.wkb")
+        geoms = great_circles([0.0, 10.0], [0.0, 10.0], [50.0, 60.0], [20.0, 30.0], 10, LineString)
+        self.assertEqual(write_wkb(geoms, file_name), 2)
+        loaded = list(read_wkb(file_name))
+        self.assertEqual(len(loaded), 2)
+        self.assertTrue(loaded[1].equals(geoms[1]))
+
+    def test_packed_round_trip(self):
+        file_name = os.path.join(self.folder, "mixed.pack")
+        geoms = [
+            LineString([(0, 0), (1, 1)]),
+            Polygon([(0, 0), (4, 0), (4, 4)], [[(1, 0.5), (2, 0.5), (2, 1)]]),
+            MultiPoint([(0, 0), (1, 1)]),
+            MultiLineString([[(0, 0), (1, 1)], [(2, 2), (3, 3)]]),
+            MultiPolygon([Polygon([(0, 0), (1, 0), (1, 1)]), Polygon([(5, 5), (6, 5), (6, 6)])])
+        ]
+        self.assertEqual(write_packed(geoms, file_name), 5)
+        packed = read_packed(file_name)
+        self.assertEqual(len(packed), 5)
+        for geom, loaded in zip(geoms, packed):
+            self.assertEqual(geom.geom_type, loaded.geom_type)
+            self.assertTrue(geom.equals(loaded))
+        self.assertEqual(packed.coords(1).shape, (8, 2))
+
+    def test_packed_array(self):
+        file_name = os.path.join(self.folder, "buffers.pack")
+        coords = geodesic_point_buffers([0.0, 10.0, 20.0], [0.0, 10.0, 20.0], 16, 1000.0)
+        write_packed(coords, file_name, POLYGON)
+        packed = read_packed(file_name)
+        self.assertIsInstance(packed[2], Polygon)
+        self.assertTrue(np.array_equal(packed.coords(2)[:-1], coords[2]))
+        self.assertTrue(packed[2].equals(Polygon(coords[2])))
+
+    def test_not_packed(self):
+        file_name = os.path.join(self.folder, "foo.pack")
+        with open(file_name, "wb") as fo:
+            fo.write(b"x" * 100)
+        with self.assertRaises(ValueError):
+            read_packed(file_name)
+
+
+class TestPointIndex(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(42)
+        self.lons = random.uniform(-180.0, 180.0, 5000)
+        self.lats = np.degrees(np.arcsin(random.uniform(-1.0, 1.0, 5000)))
+        self.index = PointIndex(self.lons, self.lats, cell_degrees=2.0)
+        # queries near the antimeridian and a pole as well
+        self.query_lons = np.array([-3.189, 179.9, -179.5, 10.0])
+        self.query_lats = np.array([55.953, 10.0, -60.0, 89.9])
+        self.matrix = great_circle_distance_matrix(self.query_lons, self.query_lats,
+                                                   self.lons, self.lats)
+
+    def test_query_radius(self):
+        found, dists = self.index.query_radius(self.query_lons, self.query_lats, 1000000.0,
+                                               return_distance=True)
+        for i in range(0, 4):
+            expected = np.nonzero(self.matrix[i] <= 1000000.0)[0]
+            self.assertEqual(sorted(found[i].tolist()), expected.tolist())
+            self.assertTrue(np.allclose(dists[i], self.matrix[i][found[i]]))
+            self.assertTrue(np.all(np.diff(dists[i]) >= 0.0))
+
+    def test_query_nearest(self):
+        indices, dists = self.index.query_nearest(self.query_lons, self.query_lats, k=4)
+        self.assertEqual(indices.tolist(), np.argsort(self.matrix, axis=1)[:, :4].tolist())
+        self.assertTrue(np.allclose(dists, np.sort(self.matrix, axis=1)[:, :4]))
+
+    def test_query_nearest_too_few(self):
+        index = PointIndex([0.0, 1.0], [0.0, 0.0])
+        indices, dists = index.query_nearest([0.1], [0.0], k=3)
+        self.assertEqual(indices.tolist(), [[0, 1, -1]])
+        self.assertTrue(np.isinf(dists[0, 2]))
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        for name in os.listdir(self.folder):
+            os.remove(os.path.join(self.folder, name))
+        os.rmdir(self.folder)
+
+    def path(self, name):
+        return os.path.join(self.folder, name)
+
+    def write_pairs(self):
+        with open(self.path("pairs.csv"), "w") as fo:
+            fo.write("id,lon1,lat1,lon2,lat2\n")
+            for i in range(0, 25):
+                fo.write("r{},-3.189,55.953,{},29.97\n".format(i, float(i)))
+        return self.path("pairs.csv")
+
+    def test_route_job(self):
+        stats = batch.run('route', self.write_pairs(), self.path("routes.geojsonl"),
+                          chunk_size=10, segments=20)
+        self.assertEqual(stats['rows'], 25)
+        self.assertEqual(stats['chunks'], 3)
+        with open(self.path("routes.geojsonl")) as fi:
+            features = [json.loads(line) for line in fi]
+        self.assertEqual(len(features), 25)
+        self.assertEqual(features[24]['properties']['id'], 'r24')
+        self.assertEqual(len(features[24]['geometry']['coordinates']), 21)
+        self.assertEqual(features[24]['geometry']['coordinates'][-1], [24.0, 29.97])
+
+    def test_non_finite_rows_skipped(self):
+        with open(self.path("pairs.csv"), "w") as fo:
+            fo.write("id,lon1,lat1,lon2,lat2\nok,0,0,1,1\nbad,0,nan,1,1\nfar,0,0,1,99\n")
+        for job in ('route', 'distance'):
+            stats = batch.run(job, self.path("pairs.csv"), self.path("out.geojsonl"))
+            self.assertEqual(stats['rows'], 3)
+            self.assertEqual(stats['skipped'], 2)
+            with open(self.path("out.geojsonl")) as fi:
+                lines = [json.loads(line) for line in fi]
+            self.assertEqual(len(lines), 1)
+
+    def test_distance_job_workers(self):
+        batch.main(['distance', self.write_pairs(), self.path("dist.csv"),
+                    '--output-format', 'csv', '--workers', '2',
+                    '--chunk-size', '4', '--quiet'])
+        with open(self.path("dist.csv")) as fi:
+            rows = list(csv.DictReader(fi))
+        self.assertEqual([row['id'] for row in rows], ['r{}'.format(i) for i in range(0, 25)])
+        expected = great_circle_distance(-3.189, 55.953, 10.0, 29.97)
+        self.assertAlmostEqual(float(rows[10]['distance_m']), expected, places=3)
+
+    def test_progress_workers(self):
+        # fewer chunks than are kept in flight, so all are written while draining
+        progress = io.StringIO()
+        batch.run('distance', self.write_pairs(), self.path("dist.geojsonl"), workers=2,
+                  chunk_size=10, progress=progress, report_every=0.0)
+        lines = progress.getvalue().splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[-1].startswith("done: 25 rows"))
+
+    def test_buffer_job_wkb(self):
+        with open(self.path("centres.ndjson"), "w") as fo:
+            for i in range(0, 5):
+                fo.write(json.dumps({'lon': i, 'lat': i, 'radius_m': 1000.0 * (i + 1)}) + "\n")
+        batch.run('buffer', self.path("centres.ndjson"), self.path("buffers.wkb"),
+                  segments=32, output_format='wkb')
+        geoms = list(read_wkb(self.path("buffers.wkb")))
+        self.assertEqual(len(geoms), 5)
+        self.assertIsInstance(geoms[0], Polygon)
+        self.assertEqual(len(geoms[0].exterior.coords), 33)
+
+
+class TestService(unittest.TestCase):
+
+    @staticmethod
+    async def fetch(port, target, body=None):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        data = json.dumps(body).encode('utf-8') if body is not None else b''
+        writer.write("{} {} HTTP/1.1\r\nContent-Length: {}\r\nConnection: close\r\n\r\n".format(
+            'POST' if body is not None else 'GET', target, len(data)).encode('latin-1') + data)
+        response = await reader.read()
+        writer.close()
+        head, _, payload = response.partition(b'\r\n\r\n')
+        return int(head.split()[1]), json.loads(payload.decode('utf-8'))
+
+    def test_coalesced_requests(self):
+        async def scenario():
+            service = GeodesyService(port=0, max_delay=0.05)
+            await service.start()
+            try:
+                targets = ["/distance?lon1=-3.189&lat1=55.953&lon2={}&lat2=29.97".format(i)
+                           for i in range(0, 20)]
+                results = await asyncio.gather(*[self.fetch(service.port, target)
+                                                 for target in targets])
+                route = await self.fetch(service.port, "/route",
+                                         [{'lon1': 0, 'lat1': 0, 'lon2': 10, 'lat2': 10,
+                                           'segments': 4}])
+                bad = await self.fetch(service.port, "/extent?x1=0&y1=0&x2=1&y2=1&proj4=nonsense")
+                missing = await self.fetch(service.port, "/buffer?lon=0&lat=0")
+                not_finite = await self.fetch(service.port,
+                                              "/distance?lon1=0&lat1=nan&lon2=1&lat2=1")
+                beyond = await self.fetch(service.port, "/route",
+                                          [{'lon1': 0, 'lat1': 0, 'lon2': 1, 'lat2': 1},
+                                           {'lon1': 0, 'lat1': 0, 'lon2': 1, 'lat2': 99}])
+                stats = await self.fetch(service.port, "/stats")
+            finally:
+                await service.stop()
+            return results, route, bad, missing, not_finite, beyond, stats
+
+        results, route, bad, missing, not_finite, beyond, stats = asyncio.run(scenario())
+        self.assertEqual(results[10][0], 200)
+        self.assertAlmostEqual(results[10][1]['distance_m'],
+                               great_circle_distance(-3.189, 55.953, 10.0, 29.97), places=3)
+        self.assertEqual(route[0], 200)
+        self.assertEqual(len(route[1][0]['coordinates']), 5)
+        self.assertEqual(bad[0], 400)
+        self.assertEqual(missing, (400, {'error': 'missing radius_m'}))
+        self.assertEqual(not_finite, (400, {'error': 'lat1 is not a finite number'}))
+        self.assertEqual(beyond, (400, {'error': 'result is not finite, check the coordinates'}))
+        distance = stats[1]['endpoints']['distance']
+        self.assertEqual(distance['requests'], 21)
+        self.assertLess(distance['batches'], 20)
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def test_recording(self):
+        clear_registry()
+        with recording() as stats:
+            great_circles([0.0, 10.0], [0.0, 10.0], [20.0, 30.0], [20.0, 30.0], 10)
+            convert_projection_extent(-2000000, -2000000, 2000000, 2000000,
+                                      "+proj=laea +lat_0=52 +lon_0=10 +ellps=GRS80 +units=m")
+            with recording() as inner:
+                get_tissot_indicatrix(segments=2, radius_m=1000)
+        self.assertFalse(is_recording())
+        functions = stats.as_dict()['functions']
+        self.assertEqual(functions['geodesics.great_circles']['calls'], 1)
+        self.assertEqual(functions['geodesics.great_circles']['vertices'], 22)
+        self.assertEqual(functions['geodesics.convert_projection_extent']['vertices'], 4004)
+        self.assertEqual(functions['geodesics.get_tissot_indicatrix']['geometries'], 1)
+        self.assertEqual(functions['geodesics.geodesic_point_buffers']['geometries'], 9)
+        self.assertEqual(stats.counters['geod.fwd.points'], 18 + 900)
+        self.assertEqual(stats.counters['transformer.transform.points'], 4004)
+        self.assertEqual(stats.counters['built.Transformer'], 1)
+        self.assertNotIn('geodesics.great_circles', inner.functions)
+        self.assertEqual(inner.counters['geod.fwd.points'], 900)
+        self.assertIn('geodesics.get_tissot_indicatrix', stats.report())
+
+    def test_not_recording(self):
+        with recording() as stats:
+            pass
+        great_circle(0.0, 0.0, 10.0, 10.0)
+        self.assertEqual(stats.functions, {})
+        self.assertEqual(stats.counters, {})
+
+
+class TestLazy(unittest.TestCase):
+
+    def test_lazy_routes(self):
+        routes = great_circles([0.0, 170.0], [0.0, 10.0], [20.0, -170.0], [20.0, 30.0],
+                               10, lazy(LineString))
+        eager = great_circles([0.0, 170.0], [0.0, 10.0], [20.0, -170.0], [20.0, 30.0],
+                              10, LineString)
+        self.assertIsInstance(routes[0], LazyGeometry)
+        self.assertIsNone(routes[0]._geometry)
+        self.assertEqual(routes[0].bounds, eager[0].bounds)
+        self.assertEqual(routes[1].to_geojson(6), geometry_to_geojson(eager[1], 6))
+        self.assertEqual(routes[0].wkt, eager[0].wkt)
+        split = great_circles([170.0], [10.0], [-170.0], [30.0], 10, lazy(LineString),
+                              split_antimeridian=True)
+        self.assertIsInstance(split[0], MultiLineString)
+
+    def test_lazy_copy_pickle(self):
+        route = great_circles([0.0], [0.0], [20.0], [20.0], 10, lazy(LineString))[0]
+        for other in (copy.copy(route), copy.deepcopy(route), pickle.loads(pickle.dumps(route))):
+            self.assertIsInstance(other, LazyGeometry)
+            self.assertIs(other.kind, LineString)
+            self.assertTrue(np.array_equal(other.coords, route.coords))
+            self.assertEqual(other.wkt, route.wkt)
+        with self.assertRaises(AttributeError):
+            route._missing
+
+    def test_lazy_buffers(self):
+        buffers = geodesic_point_buffers([0.0, 10.0], [50.0, 60.0], 16, 10000.0, lazy(Polygon))
+        eager = geodesic_point_buffers([0.0, 10.0], [50.0, 60.0], 16, 10000.0, Polygon)
+        self.assertEqual(geometry_to_geojson(buffers[0]), geometry_to_geojson(eager[0]))
+        self.assertAlmostEqual(buffers[1].area, eager[1].area)
+        folder = tempfile.mkdtemp()
+        try:
+            write_packed(buffers, os.path.join(folder, "b.pack"))
+            write_wkb(buffers, os.path.join(folder, "b.wkb"))
+            self.assertTrue(read_packed(os.path.join(folder, "b.pack"))[1].equals(eager[1]))
+            self.assertTrue(list(read_wkb(os.path.join(folder, "b.wkb")))[1].equals(eager[1]))
+        finally:
+            for name in os.listdir(folder):
+                os.remove(os.path.join(folder, name))
+            os.rmdir(folder)
+
+
+class TestDiskCache(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        disable_disk_cache()
+        for name in os.listdir(self.folder):
+            os.remove(os.path.join(self.folder, name))
+        os.rmdir(self.folder)
+
+    def test_cached_layers(self):
+        expected = get_bounding_box(10.0, 20.0, 45.0, 32.0)
+        enable_disk_cache(self.folder)
+        first = get_bounding_box(10.0, 20.0, 45.0, 32.0)
+        second = get_bounding_box(10, 20, 45, 32, segments=1000)
+        self.assertTrue(first.equals_exact(expected, 0.0))
+        self.assertIs(second, first)
+        stats = disk_cache_stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (1, 1, 1))
+        # another process sharing the folder loads it from disk
+        cache = enable_disk_cache(self.folder)
+        self.assertTrue(get_bounding_box(10.0, 20.0, 45.0, 32.0).equals_exact(expected, 0.0))
+        self.assertEqual((cache.hits, cache.memory_hits), (1, 0))
+        disable_disk_cache()
+        self.assertIsNone(disk_cache_stats())
+
+    def test_eviction(self):
+        cache = DiskCache(self.folder, max_bytes=100, memory_items=0)
+        cache.put('a', LineString([(0, 0), (1, 1)]))
+        cache.put('b', LineString([(0, 0), (1, 1), (2, 2), (3, 3), (4, 4)]))
+        self.assertIsNone(cache.get('a'))
+        self.assertTrue(cache.get('b').equals(LineString([(0, 0), (4, 4)])))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_failed_write_skipped(self):
+        folder = os.path.join(self.folder, "gone")
+        cache = DiskCache(folder, memory_items=0)
+        os.rmdir(folder)
+        cache.put('a', LineString([(0, 0), (1, 1)]))
+        self.assertEqual(cache.writes, 0)
+        self.assertIsNone(cache.get('a'))
+
+
+class TestBenchmarks(unittest.TestCase):
+
+    def test_run_benchmarks(self):
+        results = bench.run_benchmarks('utils.float_array', scale=0.01, repeat=1)
+        self.assertEqual(sorted(results['results']), ['utils.float_array', 'utils.float_array_by'])
+        self.assertEqual(results['meta']['scale'], 0.01)
+
+    def test_compare(self):
+        baseline = {'results': {'a': {'best': 1.0}, 'b': {'best': 1.0}, 'c': {'best': 0.0001}}}
+        current = {'results': {'a': {'best': 1.1}, 'b': {'best': 2.0}, 'c': {'best': 0.0005},
+                               'd': {'best': 5.0}}}
+        self.assertEqual(bench.compare(baseline, current), [('b', 1.0, 2.0, 2.0)])
+
 
 if __name__ == '__main__':
     unittest.main()
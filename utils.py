@@ -3,8 +3,11 @@ Utility methods
 """
 
 import json
+import math
 import re
+import numpy as np
 from shapely.geometry import mapping
+from lazy import LazyGeometry
 
 
 def float_range(start_val, end_val, steps):
@@ -49,6 +52,176 @@ def float_range_by(start_val, end_val, step_size):
     yield end_val
 
 
+def float_array(start_val, end_val, steps):
+    """
+    Array version of float_range. Values are interpolated rather than
+    accumulated, so there is no drift and both ends are exact.
+    :param start_val: start value
+    :param end_val: end value
+    :param steps: number of divisions
+    :return: float64 array of steps+1 values
+    """
+    values = np.linspace(start_val, end_val, steps + 1)
+    values[-1] = end_val
+    return values
+
+
+def float_array_by(start_val, end_val, step_size):
+    """
+    Array version of float_range_by. Values are start_val plus whole
+    multiples of step_size, with end_val added if not already reached.
+    :param start_val: start value
+    :param end_val: end value
+    :param step_size: spacing between values
+    :return: float64 array
+    """
+    assert(start_val != end_val)
+    step_size = math.copysign(abs(step_size), end_val - start_val)
+    # allow a little slack so that e.g. 0.0 to 1.0 by 0.1 ends on 1.0
+    steps = int(math.floor((end_val - start_val) / step_size + 1e-9))
+    values = start_val + step_size * np.arange(steps + 1, dtype=np.float64)
+    if abs(values[-1] - end_val) <= 1e-9 * abs(step_size):
+        values[-1] = end_val
+    else:
+        values = np.append(values, end_val)
+    return values
+
+
+def _beyond(extent, margin, *points):
+    """
+    :param extent: (x1, y1, x2, y2)
+    :param margin: array of distances
+    :param points: (x array, y array) pairs
+    :return: boolean array, True where every point lies more than margin
+    beyond the same side of extent
+    """
+    x1, y1, x2, y2 = extent
+    with np.errstate(invalid='ignore'):
+        return np.logical_and.reduce([x < x1 - margin for x, _ in points]) | \
+            np.logical_and.reduce([x > x2 + margin for x, _ in points]) | \
+            np.logical_and.reduce([y < y1 - margin for _, y in points]) | \
+            np.logical_and.reduce([y > y2 + margin for _, y in points])
+
+
+def densify_projected(transformer, xx, yy, tolerance, max_depth=16, extent=None):
+    """
+    Adaptively densify a polyline so that it stays within tolerance of the
+    true curve once transformed. Each pass transforms the midpoints of all
+    remaining segments in one call, and splits those whose transformed
+    midpoint strays too far from the straight line between the transformed
+    ends.
+    Several lines can be densified at once by putting a NaN vertex
+    between them; segments touching one are left alone.
+    :param transformer: pyproj Transformer
+    :param xx: array of source x coords
+    :param yy: array of source y coords
+    :param tolerance: maximum deviation, in target coords
+    :param max_depth: maximum number of times a segment may be split
+    :param extent: (x1, y1, x2, y2) in target coords, or None. Segments
+    wholly beyond one side of it (ends and midpoint further out than the
+    segment's deviation) aren't split any further.
+    :return: (xx, yy, tx, ty) densified source and transformed coords
+    """
+    xx = np.asarray(xx, dtype=np.float64)
+    yy = np.asarray(yy, dtype=np.float64)
+    tx, ty = transformer.transform(xx, yy)
+    tx = np.asarray(tx, dtype=np.float64)
+    ty = np.asarray(ty, dtype=np.float64)
+    todo = np.isfinite(xx[:-1]) & np.isfinite(xx[1:])
+    for _ in range(0, max_depth):
+        split = np.flatnonzero(todo)
+        if not split.size:
+            break
+        mx = (xx[split] + xx[split + 1]) / 2.0
+        my = (yy[split] + yy[split + 1]) / 2.0
+        mtx, mty = transformer.transform(mx, my)
+        mtx = np.asarray(mtx, dtype=np.float64)
+        mty = np.asarray(mty, dtype=np.float64)
+        start_ok = np.isfinite(tx[split]) & np.isfinite(ty[split])
+        end_ok = np.isfinite(tx[split + 1]) & np.isfinite(ty[split + 1])
+        with np.errstate(invalid='ignore'):
+            ex = (tx[split] + tx[split + 1]) / 2.0 - mtx
+            ey = (ty[split] + ty[split + 1]) / 2.0 - mty
+            deviation = np.hypot(ex, ey)
+        # where only one end is outside the projection's domain, keep
+        # splitting to find the edge of the valid area
+        wrong = (start_ok & end_ok & ~(deviation <= tolerance)) | \
+                (start_ok != end_ok)
+        if extent is not None:
+            wrong &= ~_beyond(extent, deviation, (tx[split], ty[split]),
+                              (tx[split + 1], ty[split + 1]), (mtx, mty))
+        keep = split[wrong]
+        where = keep + 1
+        xx = np.insert(xx, where, mx[wrong])
+        yy = np.insert(yy, where, my[wrong])
+        tx = np.insert(tx, where, mtx[wrong])
+        ty = np.insert(ty, where, mty[wrong])
+        # both halves of a split segment are tested on the next pass
+        todo = np.zeros(xx.size - 1, dtype=bool)
+        new_index = keep + np.arange(keep.size)
+        todo[new_index] = True
+        todo[new_index + 1] = True
+    return xx, yy, tx, ty
+
+
+def break_jumps(transformer, xx, yy, tx, ty, tolerance=0.0):
+    """
+    Break transformed lines where they jump across the projection's seam
+    (or, in an azimuthal projection, the antipode of its centre). Such a
+    segment's transformed midpoint lands near one of its ends, rather
+    than near the middle of the straight line between them, however
+    finely the line was densified. All midpoints are transformed in one
+    call.
+    :param transformer: pyproj Transformer
+    :param xx: array of source x coords
+    :param yy: array of source y coords
+    :param tx: array of transformed x coords
+    :param ty: array of transformed y coords
+    :param tolerance: deviation allowed whatever the length of the
+    segment, in target coords (see densify_projected); rounding noise,
+    e.g. where a whole line maps to a pole, is always allowed
+    :return: (xx, yy, tx, ty) with a NaN vertex put into each segment
+    that jumps
+    """
+    xx = np.asarray(xx, dtype=np.float64)
+    yy = np.asarray(yy, dtype=np.float64)
+    tx = np.asarray(tx, dtype=np.float64)
+    ty = np.asarray(ty, dtype=np.float64)
+    ok = np.isfinite(tx) & np.isfinite(ty)
+    segments = np.flatnonzero(ok[:-1] & ok[1:])
+    if not segments.size:
+        return xx, yy, tx, ty
+    mtx, mty = transformer.transform((xx[segments] + xx[segments + 1]) / 2.0,
+                                     (yy[segments] + yy[segments + 1]) / 2.0)
+    with np.errstate(invalid='ignore'):
+        deviation = np.hypot((tx[segments] + tx[segments + 1]) / 2.0 - np.asarray(mtx),
+                             (ty[segments] + ty[segments + 1]) / 2.0 - np.asarray(mty))
+        chord = np.hypot(tx[segments + 1] - tx[segments], ty[segments + 1] - ty[segments])
+        noise = 1e-9 * max(np.abs(tx[ok]).max(), np.abs(ty[ok]).max())
+        # a smooth curve only strays this far from a chord that spans
+        # more than a quarter turn of it
+        jumps = segments[deviation > np.maximum(max(tolerance, noise), chord / 4.0)]
+    where = jumps + 1
+    return (np.insert(xx, where, np.nan), np.insert(yy, where, np.nan),
+            np.insert(tx, where, np.nan), np.insert(ty, where, np.nan))
+
+
+def interpolate_coords(x_start, y_start, x_end, y_end, steps):
+    """
+    Coordinates interpolated along a straight line, ends exact
+    :param x_start: 
+    :param y_start: 
+    :param x_end: 
+    :param y_end: 
+    :param steps: number of segments
+    :return: (steps+1, 2) float64 array
+    """
+    coords = np.empty((steps + 1, 2), dtype=np.float64)
+    coords[:, 0] = float_array(x_start, x_end, steps)
+    coords[:, 1] = float_array(y_start, y_end, steps)
+    return coords
+
+
 def dump_geometry_to_geojson(geometry, file_name="/tmp/foo.geojson"):
     """
     Dump geometry to a geojson file for debugging in QGIS etc.
@@ -70,6 +243,95 @@ def dump_geometry_to_geojson(geometry, file_name="/tmp/foo.geojson"):
         fo.write(json.dumps(record, indent=4))
 
 
+def _round_coords(coords, precision):
+    coords = np.asarray(coords, dtype=np.float64)
+    if precision is not None:
+        coords = np.round(coords, precision)
+    return coords.tolist()
+
+
+def geometry_to_geojson(geometry, precision=None):
+    """
+    Like shapely's mapping(), but coordinates come out as lists,
+    optionally rounded to a number of decimal places
+    :param geometry: shapely geometry, or LazyGeometry
+    :param precision: decimal places to keep, or None for all
+    :return: dict
+    """
+    if isinstance(geometry, LazyGeometry):
+        return geometry.to_geojson(precision)
+    geom_type = geometry.geom_type
+    if geom_type == 'GeometryCollection':
+        return {
+            'type': geom_type,
+            'geometries': [geometry_to_geojson(geom, precision) for geom in geometry.geoms]
+        }
+    if geometry.is_empty:
+        coords = []
+    elif geom_type == 'Point':
+        coords = _round_coords(geometry.coords, precision)[0]
+    elif geom_type in ('LineString', 'LinearRing', 'MultiPoint'):
+        if geom_type == 'MultiPoint':
+            coords = _round_coords([point.coords[0] for point in geometry.geoms], precision)
+        else:
+            coords = _round_coords(geometry.coords, precision)
+        geom_type = 'LineString' if geom_type == 'LinearRing' else geom_type
+    elif geom_type == 'Polygon':
+        coords = [_round_coords(ring.coords, precision)
+                  for ring in [geometry.exterior] + list(geometry.interiors)]
+    else:
+        # MultiLineString, MultiPolygon
+        coords = [geometry_to_geojson(geom, precision)['coordinates'] for geom in geometry.geoms]
+    return {'type': geom_type, 'coordinates': coords}
+
+
+def write_geojson(features, file_name="/tmp/foo.geojson",
+                  precision=6, sequence=False):
+    """
+    Stream geometries to a compact geojson file. Features are written one
+    at a time, so memory use stays flat however many there are.
+    :param features: iterable of geometries, or of (geometry, properties)
+    tuples where properties is a dict
+    :param file_name: path, or an open text file
+    :param precision: decimal places kept for coordinates (6 is ~0.1m),
+    or None for all
+    :param sequence: if True, write newline-delimited features
+    (GeoJSONSeq) rather than a FeatureCollection
+    :return: number of features written
+    :raises ValueError: on a NaN or infinite coordinate, which GeoJSON
+    can't represent; features before it have already been written
+    """
+    if hasattr(file_name, 'write'):
+        return _write_geojson(features, file_name, precision, sequence)
+    with open(file_name, "w") as fo:
+        return _write_geojson(features, fo, precision, sequence)
+
+
+def _write_geojson(features, fo, precision, sequence):
+    encoder = json.JSONEncoder(separators=(',', ':'), allow_nan=False)
+    if not sequence:
+        fo.write('{"type":"FeatureCollection","features":[')
+    count = 0
+    for feature in features:
+        if isinstance(feature, tuple):
+            geometry, properties = feature
+        else:
+            geometry, properties = feature, None
+        if count and not sequence:
+            fo.write(',')
+        fo.write(encoder.encode({
+            'type': 'Feature',
+            'properties': properties,
+            'geometry': geometry_to_geojson(geometry, precision)
+        }))
+        if sequence:
+            fo.write('\n')
+        count += 1
+    if not sequence:
+        fo.write(']}\n')
+    return count
+
+
 def parse_qgis_extent(extent_string):
     """
     takes an extent as copied from Extent Widget and parses into